@@ -0,0 +1,103 @@
+"""Benchmark export/import XLSX degli articoli su un'istanza temporanea.
+
+    python benchmarks/bench_xlsx.py --rows 100000
+
+Misura il tempo di ogni fase: generazione degli articoli (import a blocchi), export
+write_only e reimport read_only del file esportato. Con --memory misura anche il picco
+di memoria Python (tracemalloc, che rallenta molto le fasi): deve restare pressoché
+costante al crescere di --rows.
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSTANCE = tempfile.mkdtemp(prefix="magazzino-bench-")
+os.environ["MAGAZZINO_INSTANCE_PATH"] = INSTANCE
+os.environ["MAGAZZINO_BACKUP_SCHEDULER"] = "0"
+sys.path.insert(0, ROOT)
+
+import magazzino as m  # noqa: E402
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+
+def _rows(count):
+    for n in range(count):
+        yield n + 2, {
+            "name": f"Vite bench {n}",
+            "category": "Viti",
+            "thread_standard": "M",
+            "thread_size": f"M{3 + n % 5}",
+            "length_mm": str(5 + n % 60),
+            "quantity": str(n % 100),
+            "description": f"articolo di prova {n}",
+        }
+
+
+TRACE_MEMORY = False
+
+
+def measure(label, func):
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    line = f"{label:<10} {elapsed:8.2f} s"
+    if TRACE_MEMORY:
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        line += f"   picco {peak / 1024 / 1024:7.1f} MiB"
+    print(line)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--memory", action="store_true", help="misura il picco di memoria (più lento)")
+    args = parser.parse_args()
+    global TRACE_MEMORY
+    TRACE_MEMORY = args.memory
+
+    m.app.config["TESTING"] = True
+    m.init_db()
+    with m.app.app_context():
+        report = measure("genera", lambda: m.import_item_rows(_rows(args.rows)))
+        print(f"           {report['created']} articoli creati, {len(report['errors'])} errori")
+        if not m.User.query.first():
+            admin = m.User(username="bench", role=m.Role.query.filter_by(name="Admin").one())
+            admin.set_password("bench")
+            m.db.session.add(admin)
+            m.db.session.commit()
+        user_id = m.User.query.first().id
+
+    client = m.app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+
+    def export():
+        response = client.get("/admin/items/export.xlsx")
+        data = b"".join(response.response)
+        response.close()
+        return data
+
+    data = measure("export", export)
+    print(f"           {len(data) / 1024 / 1024:.1f} MiB xlsx")
+
+    with m.app.app_context():
+        storage = FileStorage(io.BytesIO(data), filename="articoli.xlsx")
+        report = measure("import", lambda: m.import_item_rows(m._xlsx_import_rows(storage)))
+        print(f"           {report['updated']} aggiornati, {report['created']} nuovi, {len(report['errors'])} errori")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(INSTANCE, ignore_errors=True)
@@ -1,5 +1,5 @@
 # magazzino.py
-from flask import Flask, render_template, redirect, url_for, request, jsonify, flash, send_file, session, send_from_directory
+from flask import Flask, render_template, redirect, url_for, request, jsonify, flash, send_file, session, send_from_directory, abort, g, has_request_context, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager,
@@ -10,18 +10,28 @@ from flask_login import (
     logout_user,
     current_user,
 )
-from sqlalchemy import func, select, or_, text, case
+from sqlalchemy import func, select, or_, text, case, bindparam, insert, update
 from sqlalchemy.orm import selectinload
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy import event as sa_event
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 from itertools import islice
-from functools import wraps
+from collections import namedtuple
+from types import SimpleNamespace
+from functools import wraps, lru_cache
+from contextlib import contextmanager
 import re
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
 import os, io, csv
 import shutil
+import hashlib
+import sqlite3
 import threading
+import time
+import click
 import uuid
 from werkzeug.utils import secure_filename
 
@@ -72,6 +82,21 @@ DEFAULT_MQTT_PORT = 1883
 DEFAULT_MQTT_TOPIC = "magazzino/slot"
 DEFAULT_MQTT_QOS = 0
 DEFAULT_MQTT_RETAIN = False
+KATODO_PAGE_SIZE_DEFAULT = 100
+KATODO_PAGE_SIZE_MAX = 1000
+KATODO_CONCURRENCY_DEFAULT = 4
+KATODO_CONCURRENCY_MAX = 8
+KATODO_HTTP_RETRIES = int(os.getenv("MAGAZZINO_KATODO_HTTP_RETRIES", "3"))
+KATODO_HTTP_BACKOFF = float(os.getenv("MAGAZZINO_KATODO_HTTP_BACKOFF", "0.5"))
+# cache locale delle immagini prodotto (instance/katodo_images/<formato>/<id>.jpg)
+KATODO_IMAGE_SIZES = {
+    # formato locale: (formato PrestaShop scaricato, lato massimo in px dopo il ridimensionamento)
+    "thumb": ("cart_default", 96),
+    "home": ("home_default", 400),
+}
+KATODO_IMAGE_CACHE_MB = float(os.getenv("MAGAZZINO_KATODO_IMAGE_CACHE_MB", "200"))
+KATODO_IMAGE_DOWNLOADS = int(os.getenv("MAGAZZINO_KATODO_IMAGE_DOWNLOADS", "4"))
+KATODO_IMAGE_MAX_AGE = 30 * 24 * 3600
 
 PAGE_FORMAT_OPTIONS = [
     ("A4", "A4"),
@@ -128,13 +153,23 @@ def _save_backup_state(state: dict) -> None:
     with open(BACKUP_STATE_PATH, "w", encoding="utf-8") as handle:
         json.dump(state, handle, ensure_ascii=False, indent=2)
 
+def _backup_state() -> dict:
+    """Stato backup in memoria: letto dal disco una sola volta per processo."""
+    global _BACKUP_STATE
+    if _BACKUP_STATE is None:
+        _BACKUP_STATE = _load_backup_state()
+    return _BACKUP_STATE
+
+BACKUP_EXTENSIONS = {"none": ".db", "gzip": ".db.gz", "zstd": ".db.zst"}
+
 def _list_backup_files() -> list[str]:
     if not os.path.exists(BACKUP_DIR):
         return []
     files = [
         os.path.join(BACKUP_DIR, name)
         for name in os.listdir(BACKUP_DIR)
-        if name.startswith("magazzino_backup_") and name.endswith(".db")
+        if name.startswith("magazzino_backup_")
+        and name.endswith(tuple(BACKUP_EXTENSIONS.values()))
     ]
     return sorted(files, key=lambda path: os.path.getmtime(path), reverse=True)
 
@@ -146,46 +181,228 @@ def _rotate_backups() -> None:
         except OSError:
             continue
 
-def _create_backup(reason: str) -> Optional[str]:
+def _backup_compression() -> str:
+    """Compressione effettiva: zstd richiede il pacchetto opzionale `zstandard`."""
+    mode = BACKUP_COMPRESSION if BACKUP_COMPRESSION in BACKUP_EXTENSIONS else "none"
+    if mode == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            app.logger.warning("zstandard non installato: backup compressi con gzip")
+            return "gzip"
+    return mode
+
+def _compress_file(src: str, dest: str, mode: str) -> None:
+    if mode == "gzip":
+        import gzip
+        with open(src, "rb") as fin, gzip.open(dest, "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+    elif mode == "zstd":
+        import zstandard
+        with open(src, "rb") as fin, open(dest, "wb") as fout:
+            zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(fin, fout)
+    else:
+        os.replace(src, dest)
+
+def _decompress_file(src: str, dest: str) -> None:
+    if src.endswith(".gz"):
+        import gzip
+        with gzip.open(src, "rb") as fin, open(dest, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+    elif src.endswith(".zst"):
+        import zstandard
+        with open(src, "rb") as fin, open(dest, "wb") as fout:
+            zstandard.ZstdDecompressor().copy_stream(fin, fout)
+    else:
+        shutil.copyfile(src, dest)
+
+def _integrity_check(path: str) -> bool:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("PRAGMA integrity_check").fetchone()
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+    return bool(row) and row[0] == "ok"
+
+def verify_backup(path: str) -> bool:
+    """Verifica un backup (anche compresso) con PRAGMA integrity_check."""
+    if not path.endswith((".gz", ".zst")):
+        return _integrity_check(path)
+    tmp_path = os.path.join(BACKUP_DIR, f".verify_{uuid.uuid4().hex}.db")
+    try:
+        _decompress_file(path, tmp_path)
+        return _integrity_check(tmp_path)
+    except (OSError, ImportError, EOFError):
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _db_data_version() -> Optional[int]:
+    """`PRAGMA data_version` su una connessione dedicata del processo:
+    cambia solo quando un'altra connessione esegue un commit sul DB."""
+    global _BACKUP_MONITOR_CONN
+    try:
+        if _BACKUP_MONITOR_CONN is None:
+            _BACKUP_MONITOR_CONN = sqlite3.connect(db_path, check_same_thread=False)
+        return int(_BACKUP_MONITOR_CONN.execute("PRAGMA data_version").fetchone()[0])
+    except sqlite3.Error:
+        return None
+
+def _db_mtime() -> float:
+    mtimes = [os.path.getmtime(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path)]
+    return max(mtimes) if mtimes else 0.0
+
+def _db_changed_since_backup(state: dict) -> bool:
+    """True se il DB è stato modificato dopo l'ultimo backup.
+    Usa data_version se l'ultimo backup è stato fatto da questo processo,
+    altrimenti confronta le date di modifica di DB e WAL."""
+    version = _db_data_version()
+    if version is not None and _BACKUP_LAST_DATA_VERSION is not None:
+        return version != _BACKUP_LAST_DATA_VERSION
+    return _db_mtime() > float(state.get("last_backup_time") or 0)
+
+def _create_backup(reason: str, *, force: bool = False) -> Optional[str]:
+    """Backup online tramite l'API di backup di SQLite (copia consistente
+    anche con scritture in corso), verificato e poi compresso se richiesto.
+    In modalità incrementale il backup viene saltato se il DB non è cambiato."""
+    global _BACKUP_LAST_DATA_VERSION
     if not os.path.exists(db_path):
         return None
     os.makedirs(BACKUP_DIR, exist_ok=True)
+    compression = _backup_compression()
     stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_name = f"magazzino_backup_{stamp}.db"
+    backup_name = f"magazzino_backup_{stamp}{BACKUP_EXTENSIONS[compression]}"
     backup_path = os.path.join(BACKUP_DIR, backup_name)
+    tmp_path = os.path.join(BACKUP_DIR, f".{backup_name}.tmp")
     with _BACKUP_LOCK:
         if not os.path.exists(db_path):
             return None
-        shutil.copy2(db_path, backup_path)
+        state = _backup_state()
+        if BACKUP_MODE == "incremental" and not force and not _db_changed_since_backup(state):
+            return None
+        data_version = _db_data_version()
+        try:
+            source = sqlite3.connect(db_path)
+            dest = sqlite3.connect(tmp_path)
+            try:
+                with dest:
+                    source.backup(dest, pages=BACKUP_PAGES_PER_STEP, sleep=0.005)
+            finally:
+                dest.close()
+                source.close()
+            if not _integrity_check(tmp_path):
+                app.logger.error("Backup %s scartato: integrity_check non superato", backup_name)
+                return None
+            _compress_file(tmp_path, backup_path, compression)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         os.utime(backup_path, None)  # set mtime=now so rotation keeps this file
         _rotate_backups()
-        state = _load_backup_state()
+        _BACKUP_LAST_DATA_VERSION = data_version
         state["last_backup_time"] = os.path.getmtime(backup_path)
         state["last_backup_date"] = datetime.now().date().isoformat()
         state["last_backup_reason"] = reason
+        state["last_backup_file"] = backup_name
         _save_backup_state(state)
     return backup_path
 
+@contextmanager
+def instance_file_lock(name: str):
+    """Lock esclusivo tra processi su un file in instance/ (fcntl).
+    Dove fcntl non esiste vale solo come segnaposto: usare un solo processo."""
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, name), "a+") as handle:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
 def run_startup_backup() -> Optional[str]:
-    return _create_backup("startup")
+    """Backup di avvio; saltato se un altro processo (worker) lo ha appena eseguito."""
+    with instance_file_lock(BACKUP_LOCK_NAME), _BACKUP_LOCK:
+        state = _backup_state()
+        state.clear()
+        state.update(_load_backup_state())
+        last_time = float(state.get("last_backup_time") or 0)
+        if state.get("last_backup_reason") == "startup" and time.time() - last_time < STARTUP_BACKUP_MIN_AGE:
+            return None
+        return _create_backup("startup")
 
 def maybe_daily_backup() -> Optional[str]:
     if not os.path.exists(db_path):
         return None
-    state = _load_backup_state()
     today = datetime.now().date().isoformat()
-    if state.get("last_check_date") == today:
+    if _backup_state().get("last_check_date") == today:
         return None
-    state["last_check_date"] = today
-    last_backup_time = float(state.get("last_backup_time") or 0)
-    db_mtime = os.path.getmtime(db_path)
-    _save_backup_state(state)
-    if db_mtime <= last_backup_time:
+    with instance_file_lock(BACKUP_LOCK_NAME), _BACKUP_LOCK:
+        state = _backup_state()
+        if state.get("last_check_date") == today:
+            return None
+        # Nuovo giorno: rilegge il file per vedere i backup fatti da altri processi
+        state.clear()
+        state.update(_load_backup_state())
+        if state.get("last_check_date") == today:
+            return None
+        state["last_check_date"] = today
+        changed = _db_changed_since_backup(state)
+        _save_backup_state(state)
+        if not changed:
+            return None
+        return _create_backup("daily", force=True)
+
+def _backup_scheduler_loop(interval: float) -> None:
+    while not _BACKUP_SCHEDULER_STOP.wait(interval):
+        try:
+            maybe_daily_backup()
+        except Exception:
+            app.logger.exception("Backup giornaliero non riuscito")
+
+def start_backup_scheduler(interval: Optional[float] = None) -> Optional[threading.Thread]:
+    """Avvia (una sola volta per processo) il thread che gestisce i backup giornalieri."""
+    global _BACKUP_SCHEDULER
+    if not BACKUP_SCHEDULER_ENABLED:
         return None
-    return _create_backup("daily")
+    with _BACKUP_LOCK:
+        if _BACKUP_SCHEDULER is not None and _BACKUP_SCHEDULER.is_alive():
+            return _BACKUP_SCHEDULER
+        _BACKUP_SCHEDULER_STOP.clear()
+        _BACKUP_SCHEDULER = threading.Thread(
+            target=_backup_scheduler_loop,
+            args=(interval or BACKUP_CHECK_INTERVAL,),
+            name="magazzino-backup",
+            daemon=True,
+        )
+        _BACKUP_SCHEDULER.start()
+    return _BACKUP_SCHEDULER
+
+def stop_backup_scheduler() -> None:
+    _BACKUP_SCHEDULER_STOP.set()
+
+def _backup_after_fork() -> None:
+    """Nei worker creati con fork: lock, connessione di controllo e thread non vengono ereditati."""
+    global _BACKUP_LOCK, _BACKUP_MONITOR_CONN, _BACKUP_LAST_DATA_VERSION, _BACKUP_SCHEDULER
+    _BACKUP_LOCK = threading.RLock()
+    _BACKUP_MONITOR_CONN = None
+    _BACKUP_LAST_DATA_VERSION = None
+    had_scheduler = _BACKUP_SCHEDULER is not None
+    _BACKUP_SCHEDULER = None
+    if had_scheduler:
+        start_backup_scheduler()
 
 # ===================== FLASK & DB =====================
-app = Flask(__name__, instance_relative_config=True)
+# MAGAZZINO_INSTANCE_PATH sposta DB, backup e cache (es. istanze separate o test)
+app = Flask(__name__, instance_path=os.getenv("MAGAZZINO_INSTANCE_PATH") or None, instance_relative_config=True)
 app.config['SECRET_KEY'] = "supersecret"
 app.config["REMEMBER_COOKIE_DURATION"] = timedelta(days=30)
 os.makedirs(app.instance_path, exist_ok=True)
@@ -196,8 +413,23 @@ db = SQLAlchemy(app)
 BACKUP_DIR = os.path.join(app.instance_path, "backups")
 BACKUP_STATE_PATH = os.path.join(app.instance_path, "backup_state.json")
 BACKUP_KEEP = int(os.getenv("MAGAZZINO_BACKUP_KEEP", "7"))
-_BACKUP_LOCK = threading.Lock()
+BACKUP_CHECK_INTERVAL = float(os.getenv("MAGAZZINO_BACKUP_CHECK_INTERVAL", "900"))
+BACKUP_SCHEDULER_ENABLED = os.getenv("MAGAZZINO_BACKUP_SCHEDULER", "1").lower() not in {"0", "false", "no", "off"}
+BACKUP_COMPRESSION = os.getenv("MAGAZZINO_BACKUP_COMPRESSION", "none").lower()  # none | gzip | zstd
+BACKUP_MODE = os.getenv("MAGAZZINO_BACKUP_MODE", "full").lower()  # full | incremental
+BACKUP_PAGES_PER_STEP = int(os.getenv("MAGAZZINO_BACKUP_PAGES", "256"))
+_BACKUP_LOCK = threading.RLock()
+_BACKUP_MONITOR_CONN: Optional[sqlite3.Connection] = None
+_BACKUP_LAST_DATA_VERSION: Optional[int] = None
+_BACKUP_STATE: Optional[dict] = None
+_BACKUP_SCHEDULER: Optional[threading.Thread] = None
+_BACKUP_SCHEDULER_STOP = threading.Event()
+BACKUP_LOCK_NAME = "backup.lock"
+STARTUP_BACKUP_MIN_AGE = float(os.getenv("MAGAZZINO_STARTUP_BACKUP_MIN_AGE", "300"))
 AVATAR_UPLOAD_DIR = os.path.join(app.instance_path, "uploads", "avatars")
+KATODO_IMAGE_DIR = os.path.join(app.instance_path, "katodo_images")
+_KATODO_IMAGE_LOCK = threading.Lock()
+_KATODO_IMAGE_ADDED = 0  # byte scritti dall'ultima pulizia LRU
 AVATAR_ALLOWED_EXTS = {"png", "jpg", "jpeg", "webp"}
 AVATAR_DICEBEAR_STYLE = "avataaars"
 AVATAR_LIBRARY_SEEDS = [
@@ -218,9 +450,115 @@ AVATAR_LIBRARY_SEEDS = [
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
-@app.before_request
-def _daily_backup_check():
-    maybe_daily_backup()
+@app.cli.command("backup")
+@click.option("--daily", "daily", is_flag=True, help="Esegue il backup solo se il DB è cambiato dall'ultimo (adatto a cron).")
+def backup_command(daily: bool):
+    """Crea un backup del database (per cron o uso manuale)."""
+    if daily:
+        path = maybe_daily_backup()
+    else:
+        with instance_file_lock(BACKUP_LOCK_NAME), _BACKUP_LOCK:
+            path = _create_backup("manual", force=True)
+    click.echo(path or "Nessun backup necessario.")
+
+@app.cli.command("backup-verify")
+@click.argument("path", required=False)
+def backup_verify_command(path: Optional[str]):
+    """Verifica l'integrità di un backup (default: il più recente)."""
+    if not path:
+        backups = _list_backup_files()
+        if not backups:
+            raise click.ClickException("Nessun backup trovato.")
+        path = backups[0]
+    if not verify_backup(path):
+        raise click.ClickException(f"Backup non valido: {path}")
+    click.echo(f"OK: {path}")
+
+# ===================== SQLITE RUNTIME =====================
+# Pragma applicati a ogni nuova connessione e transazioni di scrittura con BEGIN IMMEDIATE:
+# il lock di scrittura viene preso subito (attendendo fino a busy_timeout) invece di fallire
+# con "database is locked" quando una transazione di lettura prova a diventare di scrittura.
+SQLITE_JOURNAL_MODE = os.getenv("MAGAZZINO_SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("MAGAZZINO_SQLITE_BUSY_TIMEOUT_MS", "15000"))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("MAGAZZINO_SQLITE_CACHE_KIB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("MAGAZZINO_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_RETRIES = int(os.getenv("MAGAZZINO_SQLITE_BUSY_RETRIES", "4"))
+SQLITE_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# POST che leggono soltanto (generazione PDF): transazione differita, nessun lock di scrittura
+SQLITE_READONLY_POST_ENDPOINTS = {"labels_pdf", "dymo_labels_pdf", "cards_pdf"}
+
+
+@sa_event.listens_for(Engine, "connect")
+def _sqlite_on_connect(dbapi_connection, _connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # BEGIN emesso da _sqlite_on_begin, non dal driver
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        if SQLITE_JOURNAL_MODE == "WAL":
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+    finally:
+        cursor.close()
+
+
+def _sqlite_write_transaction() -> bool:
+    if g and g.get("sqlite_write_transaction"):
+        return True
+    if has_request_context():
+        return request.method in SQLITE_WRITE_METHODS and request.endpoint not in SQLITE_READONLY_POST_ENDPOINTS
+    return False
+
+
+@sa_event.listens_for(Engine, "begin")
+def _sqlite_on_begin(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if _sqlite_write_transaction() else "BEGIN")
+
+
+def is_sqlite_busy(exc: BaseException) -> bool:
+    orig = getattr(exc, "orig", exc)
+    if not isinstance(orig, sqlite3.OperationalError):
+        return False
+    message = str(orig).lower()
+    return "locked" in message or "busy" in message
+
+
+def retry_on_busy(fn):
+    """Ripete la funzione (rollback + attesa crescente) se SQLite risponde 'database is locked'.
+    Usare su funzioni che scrivono solo sul DB: gli effetti esterni verrebbero ripetuti."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(SQLITE_BUSY_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as exc:
+                if attempt >= SQLITE_BUSY_RETRIES or not is_sqlite_busy(exc):
+                    raise
+                db.session.rollback()
+                time.sleep(0.05 * (2 ** attempt))
+    return wrapper
+
+
+@app.errorhandler(OperationalError)
+def _sqlite_busy_error(exc):
+    if not is_sqlite_busy(exc):
+        raise exc
+    db.session.rollback()
+    message = "Database occupato, riprova tra qualche istante."
+    if request.path.endswith(".json") or request.is_json or request.path.startswith("/api/"):
+        response = jsonify({"ok": False, "error": message})
+    else:
+        response = app.response_class(message, mimetype="text/plain")
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
 
 # ===================== MODELS =====================
 class User(UserMixin, db.Model):
@@ -249,9 +587,9 @@ class User(UserMixin, db.Model):
     def has_permission(self, permission_key: str) -> bool:
         if not self.role_id:
             return False
-        role = getattr(self, "role", None)
-        if role:
-            return any(p.key == permission_key for p in role.permissions)
+        keys = role_permission_keys(self.role_id)
+        if keys is not None:
+            return permission_key in keys
         return (
             db.session.query(Permission.id)
             .join(RolePermission, Permission.id == RolePermission.permission_id)
@@ -367,6 +705,10 @@ class KatodoSettings(db.Model):
     enabled = db.Column(db.Boolean, nullable=False, default=False)
     api_url = db.Column(db.String(300), nullable=True)
     api_key = db.Column(db.String(200), nullable=True)
+    import_page_size   = db.Column(db.Integer, nullable=False, default=KATODO_PAGE_SIZE_DEFAULT)
+    import_concurrency = db.Column(db.Integer, nullable=False, default=KATODO_CONCURRENCY_DEFAULT)
+    sync_watermark     = db.Column(db.DateTime, nullable=True)  # date_upd più recente dell'ultimo sync riuscito
+    last_sync_at       = db.Column(db.DateTime, nullable=True)
 
 class KatodoProduct(db.Model):
     __tablename__ = 'katodo_product'
@@ -388,6 +730,28 @@ class KatodoProduct(db.Model):
     ps_date_add        = db.Column(db.DateTime, nullable=True)
     ps_date_upd        = db.Column(db.DateTime, nullable=True)
     synced_at          = db.Column(db.DateTime, nullable=True)
+    content_hash       = db.Column(db.String(40), nullable=True)  # impronta dei campi importati
+
+class KatodoImportJob(db.Model):
+    __tablename__ = 'katodo_import_job'
+    id              = db.Column(db.Integer, primary_key=True)
+    status          = db.Column(db.String(16), nullable=False, default="running")  # running | done | error
+    mode            = db.Column(db.String(8), nullable=False, default="full")      # full | delta
+    delta_since     = db.Column(db.DateTime, nullable=True)
+    next_offset     = db.Column(db.Integer, nullable=False, default=0)             # checkpoint: prima pagina non salvata
+    watermark       = db.Column(db.DateTime, nullable=True)
+    total_new       = db.Column(db.Integer, nullable=False, default=0)
+    total_updated   = db.Column(db.Integer, nullable=False, default=0)
+    total_unchanged = db.Column(db.Integer, nullable=False, default=0)
+    total_deleted   = db.Column(db.Integer, nullable=False, default=0)
+    step            = db.Column(db.String(200), nullable=True)
+    progress        = db.Column(db.Integer, nullable=False, default=0)
+    error           = db.Column(db.Text, nullable=True)
+    owner           = db.Column(db.String(64), nullable=True)   # "pid:thread" di chi lo sta eseguendo
+    heartbeat_at    = db.Column(db.DateTime, nullable=True)
+    started_at      = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at     = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index("ix_katodo_import_job_status", "status"),)
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -487,6 +851,8 @@ class Slot(db.Model):
     __table_args__ = (
         db.UniqueConstraint('cabinet_id', 'row_num', 'col_code', name='uq_slot_in_cabinet'),
         db.Index("ix_slot_cabinet_row_col", "cabinet_id", "row_num", "col_code"),
+        # di copertura per griglia/occupazione e join Assignment -> Slot -> Cabinet
+        db.Index("ix_slot_cabinet_col_row_blocked", "cabinet_id", "col_code", "row_num", "is_blocked"),
     )
 
 class DrawerMerge(db.Model):
@@ -503,6 +869,8 @@ class Item(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
     subtype_id  = db.Column(db.Integer, db.ForeignKey("subtype.id"), nullable=True)
     name = db.Column(db.String(120), nullable=False, default="")  # auto-composizione
+    label_line1 = db.Column(db.String(200))  # righe etichetta/cella materializzate (vedi refresh_item_names)
+    label_line2 = db.Column(db.String(200))
     description = db.Column(db.String(255), nullable=True)
     share_drawer = db.Column(db.Boolean, nullable=False, default=False)
     # filettatura / misura
@@ -545,10 +913,11 @@ class Assignment(db.Model):
     compartment_no = db.Column(db.Integer, nullable=False, default=1)
     item_id = db.Column(db.Integer, db.ForeignKey("item.id"), nullable=False)
     __table_args__ = (
-        db.Index("ix_assignment_item", "item_id"),
-        db.Index("ix_assignment_slot", "slot_id"),
+        db.UniqueConstraint('slot_id', 'compartment_no', name='uq_compartment_in_slot'),
+        # di copertura: posizione di un articolo (item -> slot) e contenuto di uno slot (slot -> item)
+        db.Index("ix_assignment_item", "item_id", "slot_id"),
+        db.Index("ix_assignment_slot", "slot_id", "item_id"),
     )
-    __table_args__ = (db.UniqueConstraint('slot_id', 'compartment_no', name='uq_compartment_in_slot'),)
 
 # ===================== HELPERS =====================
 def column_code_valid(code: str) -> bool:
@@ -608,11 +977,25 @@ def normalize_merge_bounds(cab: Cabinet, col_start: str, col_end: str, row_start
         raise ValueError("Seleziona almeno due celle adiacenti.")
     return row_start, row_end, idx_to_colcode(c_start_idx), idx_to_colcode(c_end_idx)
 
-def merge_region_for(cabinet_id: int, col_code: str, row_num: int):
-    merges = DrawerMerge.query.filter_by(cabinet_id=cabinet_id).all()
-    if not merges:
-        return None
-    col_idx = colcode_to_idx(col_code)
+# Cache in-process delle fusioni: cabinet_id -> (versione, {(col_idx, riga): regione}).
+# Invalidata esplicitamente su add/delete fusione e dalla versione "drawer_merge" nel DB
+# (aggiornata da trigger), così le modifiche fatte da altri processi vengono viste.
+_MERGE_REGION_CACHE = {}
+_MERGE_REGION_LOCK = threading.Lock()
+
+
+def reset_merge_region_cache(cabinet_id: int | None = None) -> None:
+    with _MERGE_REGION_LOCK:
+        if cabinet_id is None:
+            _MERGE_REGION_CACHE.clear()
+        else:
+            _MERGE_REGION_CACHE.pop(cabinet_id, None)
+    forget_cache_versions()
+
+
+def _build_merge_region_index(cabinet_id: int) -> dict:
+    index = {}
+    merges = DrawerMerge.query.filter_by(cabinet_id=cabinet_id).order_by(DrawerMerge.id).all()
     for m in merges:
         start_idx = colcode_to_idx(m.col_start)
         end_idx = colcode_to_idx(m.col_end)
@@ -620,16 +1003,38 @@ def merge_region_for(cabinet_id: int, col_code: str, row_num: int):
             start_idx, end_idx = end_idx, start_idx
         row_start = min(m.row_start, m.row_end)
         row_end = max(m.row_start, m.row_end)
-        if start_idx <= col_idx <= end_idx and row_start <= row_num <= row_end:
-            return {
-                "anchor_col": idx_to_colcode(start_idx),
-                "anchor_row": row_start,
-                "row_start": row_start,
-                "row_end": row_end,
-                "col_start": idx_to_colcode(start_idx),
-                "col_end": idx_to_colcode(end_idx),
-            }
-    return None
+        region = {
+            "anchor_col": idx_to_colcode(start_idx),
+            "anchor_row": row_start,
+            "row_start": row_start,
+            "row_end": row_end,
+            "col_start": idx_to_colcode(start_idx),
+            "col_end": idx_to_colcode(end_idx),
+        }
+        for row in range(row_start, row_end + 1):
+            for col_idx in range(start_idx, end_idx + 1):
+                # In caso di sovrapposizioni vince la prima fusione, come nella scansione lineare.
+                index.setdefault((col_idx, row), region)
+    return index
+
+
+def merge_region_index(cabinet_id: int) -> dict:
+    """Indice {(col_idx, riga): regione} delle fusioni della cassettiera, dalla cache se valida."""
+    version = cache_version("drawer_merge")
+    with _MERGE_REGION_LOCK:
+        cached = _MERGE_REGION_CACHE.get(cabinet_id)
+    if cached and version is not None and cached[0] == version:
+        return cached[1]
+    index = _build_merge_region_index(cabinet_id)
+    if version is not None:
+        with _MERGE_REGION_LOCK:
+            _MERGE_REGION_CACHE[cabinet_id] = (version, index)
+    return index
+
+
+def merge_region_for(cabinet_id: int, col_code: str, row_num: int):
+    region = merge_region_index(cabinet_id).get((colcode_to_idx(col_code), row_num))
+    return dict(region) if region else None
 
 def merge_cells_from_region(region):
     if not region:
@@ -717,6 +1122,50 @@ def slot_full_label(cabinet: Cabinet | None, slot: Slot | None, *, for_print: bo
         return f"{cabinet.name}-{base}"
     return base
 
+ITEM_EAGER_RELATIONS = ("category", "subtype", "material", "finish")
+
+
+def item_eager_options(*extra):
+    """Opzioni di caricamento per avere le relazioni usate da auto_name_for senza query aggiuntive."""
+    return [selectinload(getattr(Item, rel)) for rel in ITEM_EAGER_RELATIONS + extra]
+
+
+def positions_for_items(item_ids, *, for_print: bool = False) -> dict:
+    """Restituisce {item_id: posizione completa} con una sola query Assignment ⋈ Slot ⋈ Cabinet."""
+    ids = {int(i) for i in item_ids if i is not None}
+    if not ids:
+        return {}
+    rows = (
+        db.session.query(Assignment.item_id, Cabinet, Slot)
+        .join(Slot, Assignment.slot_id == Slot.id)
+        .join(Cabinet, Slot.cabinet_id == Cabinet.id)
+        .filter(Assignment.item_id.in_(ids))
+        .order_by(Assignment.item_id, Assignment.id.desc())
+        .all()
+    )
+    # A parità di articolo vince la prima assegnazione, come il vecchio .first().
+    positions = {}
+    for item_id, cab, slot in rows:
+        positions[item_id] = slot_full_label(cab, slot, for_print=for_print)
+    return positions
+
+
+def load_items_with_positions(item_ids) -> list[tuple]:
+    """Carica gli articoli indicati (nell'ordine dato) con relazioni e posizione in due round trip."""
+    ids = [int(i) for i in item_ids if i is not None]
+    if not ids:
+        return []
+    by_id = {it.id: it for it in Item.query.options(*item_eager_options()).filter(Item.id.in_(ids)).all()}
+    positions = positions_for_items(by_id.keys())
+    return [(by_id[i], positions.get(i)) for i in ids if i in by_id]
+
+
+def load_item_with_position_or_404(item_id: int) -> tuple:
+    loaded = load_items_with_positions([item_id])
+    if not loaded:
+        abort(404)
+    return loaded[0]
+
 CATEGORY_ROLE_ALIASES = {
     "washer": ["rondelle"],
     "screw": ["viti"],
@@ -724,7 +1173,9 @@ CATEGORY_ROLE_ALIASES = {
     "spacer": ["distanziali"],
 }
 
-_CATEGORY_ROLE_IDS = {}
+# (versione "category", {ruolo: id categoria o None}); ricaricata quando un trigger su
+# category incrementa la versione, quindi anche dopo modifiche fatte da altri processi.
+_CATEGORY_ROLE_IDS: tuple[int | None, dict] | None = None
 
 
 def _normalize_name(value: Optional[str]) -> str:
@@ -732,28 +1183,35 @@ def _normalize_name(value: Optional[str]) -> str:
 
 
 def _category_role_id(role: str) -> Optional[int]:
-    cid = _CATEGORY_ROLE_IDS.get(role)
-    if cid:
-        return cid
-
-    aliases = CATEGORY_ROLE_ALIASES.get(role, [])
-    if not aliases:
+    global _CATEGORY_ROLE_IDS
+    if role not in CATEGORY_ROLE_ALIASES:
         return None
-
-    name_to_id = {
-        _normalize_name(name): cid
-        for cid, name in Category.query.with_entities(Category.id, Category.name)
-    }
-    for alias in aliases:
-        cid = name_to_id.get(_normalize_name(alias))
-        if cid:
-            _CATEGORY_ROLE_IDS[role] = cid
-            return cid
-    return None
+    cached = _CATEGORY_ROLE_IDS
+    # fuori da una richiesta (CLI, import) la versione costerebbe una query per chiamata
+    if cached is None or (has_request_context() and cached[0] != cache_version("category")):
+        version = cache_version("category")
+        name_to_id = {
+            _normalize_name(name): cid
+            for cid, name in Category.query.with_entities(Category.id, Category.name)
+        }
+        # Risolve tutti i ruoli in un colpo solo e memorizza anche i ruoli assenti,
+        # così auto_name_for non interroga il DB per ogni articolo.
+        roles = {
+            role_key: next(
+                (name_to_id[_normalize_name(a)] for a in role_aliases if _normalize_name(a) in name_to_id),
+                None,
+            )
+            for role_key, role_aliases in CATEGORY_ROLE_ALIASES.items()
+        }
+        cached = (version, roles)
+        _CATEGORY_ROLE_IDS = cached
+    return cached[1].get(role)
 
 
 def reset_category_role_cache() -> None:
-    _CATEGORY_ROLE_IDS.clear()
+    global _CATEGORY_ROLE_IDS
+    _CATEGORY_ROLE_IDS = None
+    forget_cache_versions()
 
 
 def is_washer(item: Item) -> bool:
@@ -948,6 +1406,11 @@ def label_line2_text(item: Item) -> str:
 
 def label_lines_for_item(item: Item) -> list[str]:
     """Restituisce le righe di testo da mostrare in cella e in etichetta."""
+    if item.label_line1 is not None:
+        return [ln for ln in (item.label_line1, item.label_line2) if ln] or [item_display_name(item)]
+    return _compute_label_lines(item)
+
+def _compute_label_lines(item: Item) -> list[str]:
     lines = []
     line1 = label_line1_text(item)
     line2 = label_line2_text(item)
@@ -961,6 +1424,75 @@ def label_lines_for_item(item: Item) -> list[str]:
             lines.append(fallback)
     return lines
 
+def item_display_name(item: Item) -> str:
+    """Nome visualizzato: usa la colonna materializzata, ricalcola solo se mancante."""
+    return item.name or auto_name_for(item)
+
+def _resolve_item_relations(item: Item) -> None:
+    # Su articoli appena creati/modificati le relazioni possono non riflettere ancora gli id.
+    for rel, model, fk in (
+        ("category", Category, "category_id"),
+        ("subtype", Subtype, "subtype_id"),
+        ("material", Material, "material_id"),
+    ):
+        fk_val = getattr(item, fk)
+        current = getattr(item, rel)
+        if fk_val is None:
+            if current is not None:
+                setattr(item, rel, None)
+        elif current is None or current.id != fk_val:
+            setattr(item, rel, db.session.get(model, fk_val))
+
+def _computed_item_names(item: Item) -> tuple[str, str, str]:
+    lines = [ln for ln in (label_line1_text(item), label_line2_text(item)) if ln]
+    return (
+        auto_name_for(item),
+        (lines[0] if lines else "")[:200],
+        (lines[1] if len(lines) > 1 else "")[:200],
+    )
+
+def refresh_item_names(item: Item) -> None:
+    """Ricalcola nome e righe etichetta/cella materializzati dell'articolo."""
+    _resolve_item_relations(item)
+    item.name, item.label_line1, item.label_line2 = _computed_item_names(item)
+
+def rebuild_item_names(item_filter=None, batch_size: int = 500) -> int:
+    """Ricalcola i campi materializzati degli articoli (tutti o quelli filtrati); ritorna quanti sono cambiati."""
+    reset_category_role_cache()
+    q = Item.query.options(*item_eager_options()).order_by(Item.id)
+    if item_filter is not None:
+        q = q.filter(item_filter)
+    item_table = Item.__table__
+    # updated_at esplicito: un ricalcolo dei nomi non è una modifica dell'articolo.
+    stmt = (
+        item_table.update()
+        .where(item_table.c.id == bindparam("b_id"))
+        .values(
+            name=bindparam("b_name"),
+            label_line1=bindparam("b_line1"),
+            label_line2=bindparam("b_line2"),
+            updated_at=item_table.c.updated_at,
+        )
+    )
+    changed = 0
+    last_id = 0
+    while True:
+        batch = q.filter(Item.id > last_id).limit(batch_size).all()
+        if not batch:
+            break
+        params = []
+        for item in batch:
+            name, line1, line2 = _computed_item_names(item)
+            if (name, line1, line2) != (item.name, item.label_line1, item.label_line2):
+                params.append({"b_id": item.id, "b_name": name, "b_line1": line1, "b_line2": line2})
+        if params:
+            db.session.execute(stmt, params)
+            changed += len(params)
+        last_id = batch[-1].id
+        db.session.expire_all()
+    db.session.commit()
+    return changed
+
 def dymo_label_lines(item: Item, settings: Settings, position_label: str | None) -> list[str]:
     lines = []
     line1_parts = []
@@ -1023,16 +1555,18 @@ def dymo_label_lines(item: Item, settings: Settings, position_label: str | None)
         lines.append(position_label)
 
     if not lines:
-        fallback = item.name or auto_name_for(item)
+        fallback = item_display_name(item)
         if fallback:
             lines.append(fallback)
     return lines
 
-def ensure_settings_columns():
+def ensure_settings_columns(strict: bool = False):
     """Aggiunge le nuove colonne delle impostazioni se mancano nel DB SQLite."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(settings)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     new_cols = [
@@ -1084,15 +1618,19 @@ def ensure_settings_columns():
                 added = True
             except Exception:
                 db.session.rollback()
+                if strict:
+                    raise
                 return
     if added:
         db.session.commit()
 
-def ensure_item_columns():
+def ensure_item_columns(strict: bool = False):
     """Garantisce la presenza delle nuove colonne nella tabella items (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(item)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     added = False
@@ -1102,6 +1640,8 @@ def ensure_item_columns():
             added = True
         except Exception:
             db.session.rollback()
+            if strict:
+                raise
             return
     if "updated_at" not in existing_cols:
         try:
@@ -1110,15 +1650,29 @@ def ensure_item_columns():
             added = True
         except Exception:
             db.session.rollback()
+            if strict:
+                raise
             return
+    for col_name in ("label_line1", "label_line2"):
+        if col_name not in existing_cols:
+            try:
+                db.session.execute(text(f"ALTER TABLE item ADD COLUMN {col_name} VARCHAR(200)"))
+                added = True
+            except Exception:
+                db.session.rollback()
+                if strict:
+                    raise
+                return
     if added:
         db.session.commit()
 
-def ensure_category_columns():
+def ensure_category_columns(strict: bool = False):
     """Aggiunge colonne mancanti nella tabella category (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(category)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     if "main_measure_mode" not in existing_cols:
@@ -1127,13 +1681,17 @@ def ensure_category_columns():
             db.session.commit()
         except Exception:
             db.session.rollback()
+            if strict:
+                raise
             return
 
-def ensure_mqtt_settings_columns():
+def ensure_mqtt_settings_columns(strict: bool = False):
     """Aggiunge eventuali nuove colonne della configurazione MQTT (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(mqtt_settings)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     new_cols = [
@@ -1148,21 +1706,29 @@ def ensure_mqtt_settings_columns():
                 added = True
             except Exception:
                 db.session.rollback()
+                if strict:
+                    raise
                 return
     if added:
         db.session.commit()
 
-def ensure_katodo_settings_columns():
+def ensure_katodo_settings_columns(strict: bool = False):
     """Aggiunge eventuali nuove colonne della configurazione Katodo (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(katodo_settings)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     new_cols = [
         ("enabled", "BOOLEAN", 0),
         ("api_url",  "VARCHAR(300)", None),
         ("api_key",  "VARCHAR(200)", None),
+        ("import_page_size", "INTEGER", KATODO_PAGE_SIZE_DEFAULT),
+        ("import_concurrency", "INTEGER", KATODO_CONCURRENCY_DEFAULT),
+        ("sync_watermark", "DATETIME", None),
+        ("last_sync_at", "DATETIME", None),
     ]
     added = False
     for col_name, col_type, default_val in new_cols:
@@ -1173,15 +1739,46 @@ def ensure_katodo_settings_columns():
                 added = True
             except Exception:
                 db.session.rollback()
+                if strict:
+                    raise
                 return
     if added:
         db.session.commit()
 
-def ensure_slot_columns():
+def ensure_katodo_product_columns(strict: bool = False):
+    """Aggiunge eventuali nuove colonne dei prodotti Katodo (compatibilità DB esistenti)."""
+    try:
+        rows = db.session.execute(text("PRAGMA table_info(katodo_product)")).fetchall()
+    except Exception:
+        if strict:
+            raise
+        return
+    existing_cols = {r[1] for r in rows}
+    new_cols = [
+        ("content_hash", "VARCHAR(40)", None),
+    ]
+    added = False
+    for col_name, col_type, default_val in new_cols:
+        if col_name not in existing_cols:
+            try:
+                default_sql = f" DEFAULT {default_val}" if default_val is not None else ""
+                db.session.execute(text(f"ALTER TABLE katodo_product ADD COLUMN {col_name} {col_type}{default_sql}"))
+                added = True
+            except Exception:
+                db.session.rollback()
+                if strict:
+                    raise
+                return
+    if added:
+        db.session.commit()
+
+def ensure_slot_columns(strict: bool = False):
     """Aggiunge eventuali nuove colonne alla tabella slot (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(slot)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     new_cols = [
@@ -1197,15 +1794,19 @@ def ensure_slot_columns():
                 added = True
             except Exception:
                 db.session.rollback()
+                if strict:
+                    raise
                 return
     if added:
         db.session.commit()
 
-def ensure_user_columns():
+def ensure_user_columns(strict: bool = False):
     """Aggiunge eventuali nuove colonne alla tabella user (compatibilità DB esistenti)."""
     try:
         rows = db.session.execute(text("PRAGMA table_info(user)")).fetchall()
     except Exception:
+        if strict:
+            raise
         return
     existing_cols = {r[1] for r in rows}
     new_cols = [
@@ -1226,44 +1827,519 @@ def ensure_user_columns():
                 added = True
             except Exception:
                 db.session.rollback()
+                if strict:
+                    raise
                 return
     if added:
         db.session.commit()
 
+# ===================== VERSIONI CACHE =====================
+# Tabella cache_version: un contatore per ogni dominio in cache, incrementato da trigger SQL
+# a ogni scrittura sulle tabelle sorgente. Le cache in-process confrontano la versione letta
+# (una sola query per richiesta) con quella memorizzata, anche tra processi diversi.
+CACHE_VERSION_SOURCES = {
+    "drawer_merge": ("drawer_merge",),
+    "settings": ("settings",),
+    "mqtt_settings": ("mqtt_settings",),
+    "katodo_settings": ("katodo_settings",),
+    "role_permissions": ("role", "permission", "role_permission"),
+    "category": ("category",),
+}
+
+
+def ensure_cache_versions(strict: bool = False):
+    """Crea la tabella cache_version e i trigger che incrementano le versioni."""
+    try:
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS cache_version ("
+            "name VARCHAR(60) PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+        ))
+        for name, tables in CACHE_VERSION_SOURCES.items():
+            db.session.execute(
+                text("INSERT OR IGNORE INTO cache_version (name, version) VALUES (:name, 0)"),
+                {"name": name},
+            )
+            for table in tables:
+                for event in ("INSERT", "UPDATE", "DELETE"):
+                    db.session.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS cache_version_{table}_{event.lower()} "
+                        f"AFTER {event} ON {table} BEGIN "
+                        f"UPDATE cache_version SET version = version + 1 WHERE name = '{name}'; "
+                        f"END"
+                    ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if strict:
+            raise
+
+
+def _read_cache_versions() -> dict | None:
+    try:
+        return dict(db.session.execute(text("SELECT name, version FROM cache_version")).fetchall())
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def cache_version(name: str) -> int | None:
+    """Versione corrente del dominio in cache (letta una volta per richiesta); None se non disponibile."""
+    if has_request_context():
+        versions = g.get("_cache_versions")
+        if versions is None:
+            versions = _read_cache_versions()
+            g._cache_versions = versions
+    else:
+        versions = _read_cache_versions()
+    if versions is None:
+        return None
+    return versions.get(name)
+
+
+def forget_cache_versions() -> None:
+    if has_request_context():
+        g.pop("_cache_versions", None)
+
+
+# ===================== PERMESSI IN CACHE =====================
+# Mappa ruolo -> frozenset delle chiavi permesso, ricaricata per intero (una query)
+# quando cambia la versione "role_permissions" (trigger su role/permission/role_permission).
+_ROLE_PERMISSIONS: tuple[int, dict[int, frozenset]] | None = None
+_HAS_USERS = False
+
+
+def role_permission_keys(role_id: int) -> frozenset | None:
+    """Chiavi dei permessi del ruolo; None se la cache non è disponibile."""
+    global _ROLE_PERMISSIONS
+    version = cache_version("role_permissions")
+    if version is None:
+        return None
+    cached = _ROLE_PERMISSIONS
+    if cached is None or cached[0] != version:
+        rows = db.session.execute(
+            select(RolePermission.role_id, Permission.key)
+            .join(Permission, Permission.id == RolePermission.permission_id)
+        ).all()
+        grouped: dict[int, set] = {}
+        for rid, key in rows:
+            grouped.setdefault(rid, set()).add(key)
+        cached = (version, {rid: frozenset(keys) for rid, keys in grouped.items()})
+        _ROLE_PERMISSIONS = cached
+    return cached[1].get(role_id, frozenset())
+
+
+def reset_permission_cache() -> None:
+    global _ROLE_PERMISSIONS
+    _ROLE_PERMISSIONS = None
+    forget_cache_versions()
+
+
+def has_any_user() -> bool:
+    """True se esiste almeno un utente; una volta vero non viene più interrogato il DB."""
+    global _HAS_USERS
+    if not _HAS_USERS:
+        _HAS_USERS = db.session.query(User.id).first() is not None
+    return _HAS_USERS
+
+
+# ===================== RICERCA FULL-TEXT =====================
+# Due indici FTS5 sugli articoli, mantenuti allineati da trigger SQL:
+#  - item_fts: tokenizer unicode61 con indici di prefisso (ricerche brevi, "M3", "vi")
+#  - item_fts_tri: tokenizer trigram (ricerche per sottostringa, come il vecchio LIKE '%q%')
+ITEM_FTS_TABLE = "item_fts"
+ITEM_FTS_TRIGRAM_TABLE = "item_fts_tri"
+ITEM_FTS_COLUMNS = ("name", "category", "thread_size", "description", "updated")
+# Pesi bm25 nello stesso ordine di ITEM_FTS_COLUMNS.
+ITEM_FTS_WEIGHTS = (10.0, 5.0, 5.0, 1.0, 0.5)
+_item_fts_tables: Optional[set] = None  # None: non ancora letto dal DB in questo processo
+ITEM_FTS_UNAVAILABLE: dict[str, str] = {}  # indici non creati perché FTS5/trigram manca -> errore SQLite
+
+
+def _item_fts_values_sql(ref: str) -> str:
+    return (
+        f"{ref}.id, {ref}.name, (SELECT name FROM category WHERE id = {ref}.category_id), "
+        f"{ref}.thread_size, {ref}.description, strftime('%Y-%m-%d %H:%M', {ref}.updated_at)"
+    )
+
+
+def _item_fts_trigger_sql(table: str) -> list[str]:
+    cols = "rowid, " + ", ".join(ITEM_FTS_COLUMNS)
+    watched = "name, category_id, thread_size, description, updated_at"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON item BEGIN
+            INSERT INTO {table}({cols}) SELECT {_item_fts_values_sql('NEW')};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON item BEGIN
+            DELETE FROM {table} WHERE rowid = OLD.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {watched} ON item BEGIN
+            DELETE FROM {table} WHERE rowid = OLD.id;
+            INSERT INTO {table}({cols}) SELECT {_item_fts_values_sql('NEW')};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_cat_au AFTER UPDATE OF name ON category BEGIN
+            UPDATE {table} SET category = NEW.name
+            WHERE rowid IN (SELECT id FROM item WHERE category_id = NEW.id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_cat_ad AFTER DELETE ON category BEGIN
+            UPDATE {table} SET category = NULL
+            WHERE rowid IN (SELECT id FROM item WHERE category_id = OLD.id);
+        END""",
+    ]
+
+
+def item_fts_tables() -> set:
+    """Indici FTS presenti nel DB, letti da sqlite_master al primo uso in ogni processo.
+
+    Non dipende dall'aver eseguito la migrazione nel processo corrente: i worker avviati
+    su un DB già migrato trovano comunque le tabelle."""
+    global _item_fts_tables
+    if _item_fts_tables is None:
+        try:
+            names = db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (:fts, :tri)"),
+                {"fts": ITEM_FTS_TABLE, "tri": ITEM_FTS_TRIGRAM_TABLE},
+            ).scalars()
+            _item_fts_tables = set(names)
+        except OperationalError:
+            db.session.rollback()
+            return set()
+    return _item_fts_tables
+
+
+def rebuild_item_search_index(tables=None) -> None:
+    """Ricostruisce da zero il contenuto degli indici full-text degli articoli."""
+    cols = "rowid, " + ", ".join(ITEM_FTS_COLUMNS)
+    for table in (tables or sorted(item_fts_tables())):
+        db.session.execute(text(f"DELETE FROM {table}"))
+        db.session.execute(text(f"INSERT INTO {table}({cols}) SELECT {_item_fts_values_sql('item')} FROM item"))
+
+
+def _fts_unavailable(exc: OperationalError) -> bool:
+    message = str(exc.orig).lower()
+    return "no such module: fts5" in message or "no such tokenizer" in message
+
+
+def ensure_item_search_index():
+    """Crea gli indici FTS5 degli articoli con i relativi trigger ed esegue il backfill iniziale."""
+    global _item_fts_tables
+    _item_fts_tables = set()
+    columns = ", ".join(ITEM_FTS_COLUMNS)
+    definitions = {
+        ITEM_FTS_TABLE: f"CREATE VIRTUAL TABLE IF NOT EXISTS {ITEM_FTS_TABLE} USING fts5("
+                        f"{columns}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        ITEM_FTS_TRIGRAM_TABLE: f"CREATE VIRTUAL TABLE IF NOT EXISTS {ITEM_FTS_TRIGRAM_TABLE} USING fts5("
+                                f"{columns}, tokenize = 'trigram')",
+    }
+    for table, ddl in definitions.items():
+        try:
+            db.session.execute(text(ddl))
+            for trigger_sql in _item_fts_trigger_sql(table):
+                db.session.execute(text(trigger_sql))
+            indexed = db.session.execute(text(f"SELECT count(*) FROM {table}")).scalar() or 0
+            total = db.session.execute(text("SELECT count(*) FROM item")).scalar() or 0
+            if indexed != total:
+                rebuild_item_search_index([table])
+            db.session.commit()
+            _item_fts_tables.add(table)
+        except OperationalError as exc:
+            # Unico errore tollerato: SQLite senza FTS5 (o senza tokenizer trigram), la ricerca
+            # ricade su LIKE. Ogni altro errore interrompe la migrazione.
+            db.session.rollback()
+            if not _fts_unavailable(exc):
+                raise
+            ITEM_FTS_UNAVAILABLE[table] = str(exc.orig)
+            app.logger.warning("Indice full-text %s non disponibile, ricerca con LIKE: %s", table, exc.orig)
+
+
+def _fts_quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+def item_search_match(q: str):
+    """Restituisce (tabella, espressione MATCH) per la ricerca q, oppure None se FTS non è utilizzabile."""
+    tokens = [t for t in re.split(r"\s+", (q or "").strip()) if t]
+    if not tokens:
+        return None
+    tables = item_fts_tables()
+    if all(len(t) >= 3 for t in tokens) and ITEM_FTS_TRIGRAM_TABLE in tables:
+        return ITEM_FTS_TRIGRAM_TABLE, " AND ".join(_fts_quote(t) for t in tokens)
+    if ITEM_FTS_TABLE in tables:
+        words = [w for t in tokens for w in re.findall(r"\w+", t)]
+        if not words:
+            return None
+        return ITEM_FTS_TABLE, " AND ".join(_fts_quote(w) + "*" for w in words)
+    return None
+
+
+def item_search_ids_query(q: str):
+    """Subquery con gli id articolo che corrispondono a q (None se serve il fallback LIKE)."""
+    match = item_search_match(q)
+    if not match:
+        return None
+    table, expr = match
+    return (
+        text(f"SELECT rowid AS item_id FROM {table} WHERE {table} MATCH :fts_match")
+        .bindparams(fts_match=expr)
+        .columns(item_id=db.Integer)
+        .subquery()
+    )
+
+
+def item_search_ranked_ids(q: str, limit: int = 10):
+    """Id articolo ordinati per rilevanza bm25 (None se serve il fallback LIKE)."""
+    match = item_search_match(q)
+    if not match:
+        return None
+    table, expr = match
+    weights = ", ".join(str(w) for w in ITEM_FTS_WEIGHTS)
+    rows = db.session.execute(
+        text(f"SELECT rowid FROM {table} WHERE {table} MATCH :fts_match "
+             f"ORDER BY bm25({table}, {weights}) LIMIT :lim"),
+        {"fts_match": expr, "lim": limit},
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
 _schema_checked = False
-_auth_seeded = False
+
+def ensure_item_names_materialized(strict: bool = False):
+    """Backfill dei nomi/righe etichetta materializzati per gli articoli mai calcolati."""
+    try:
+        missing = db.session.execute(text("SELECT count(*) FROM item WHERE label_line1 IS NULL")).scalar() or 0
+        if missing:
+            rebuild_item_names(Item.label_line1.is_(None))
+    except Exception:
+        db.session.rollback()
+        if strict:
+            raise
+
+# ===================== MIGRAZIONI =====================
+# Registro ordinato delle migrazioni: ognuna viene eseguita una sola volta e registrata in
+# schema_version. Con lo schema aggiornato l'avvio costa una sola query (max(version)).
+# Per nuove colonne/indici/tabelle aggiungere una migrazione con numero successivo.
+# Le migrazioni chiamano gli helper ensure_* con strict=True: un errore interrompe l'avvio
+# senza registrare la versione, così la migrazione viene ritentata al prossimo avvio.
+SCHEMA_MIGRATIONS: list[tuple[int, str, object]] = []
+
+
+def schema_migration(version: int, name: str):
+    def decorator(fn):
+        SCHEMA_MIGRATIONS.append((version, name, fn))
+        SCHEMA_MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return decorator
+
+
+@schema_migration(1, "tabelle base")
+def _migration_create_tables():
+    db.create_all()
+
+
+@schema_migration(2, "colonne aggiunte nelle versioni precedenti")
+def _migration_legacy_columns():
+    ensure_settings_columns(strict=True)
+    ensure_item_columns(strict=True)
+    ensure_category_columns(strict=True)
+    ensure_mqtt_settings_columns(strict=True)
+    ensure_katodo_settings_columns(strict=True)
+    ensure_slot_columns(strict=True)
+    ensure_user_columns(strict=True)
+
+
+@schema_migration(3, "versioni cache e trigger")
+def _migration_cache_versions():
+    ensure_cache_versions(strict=True)
+
+
+@schema_migration(4, "indice full-text articoli")
+def _migration_item_search_index():
+    ensure_item_search_index()
+
+
+@schema_migration(5, "nomi articolo materializzati")
+def _migration_item_names():
+    ensure_item_names_materialized(strict=True)
+
+
+@schema_migration(6, "ruoli, permessi e dati iniziali")
+def _migration_seed_data():
+    seed_if_empty_or_missing()
+
+
+@schema_migration(7, "indici dichiarati nei modelli e indici di copertura")
+def _migration_model_indexes():
+    create_missing_indexes()
+
+
+@schema_migration(8, "parametri import Katodo")
+def _migration_katodo_import_settings():
+    ensure_katodo_settings_columns(strict=True)
+
+
+@schema_migration(9, "watermark sync incrementale Katodo")
+def _migration_katodo_sync_watermark():
+    ensure_katodo_settings_columns(strict=True)
+
+
+@schema_migration(10, "impronta contenuto prodotti Katodo")
+def _migration_katodo_product_hash():
+    ensure_katodo_product_columns(strict=True)
+    ensure_katodo_settings_columns(strict=True)
+
+
+@schema_migration(11, "job di import Katodo")
+def _migration_katodo_import_job():
+    KatodoImportJob.__table__.create(db.session.connection(), checkfirst=True)
+
+
+@schema_migration(12, "versione cache categorie")
+def _migration_category_cache_version():
+    ensure_cache_versions(strict=True)
+
+
+# ===================== INDICI =====================
+def _db_indexes() -> dict[str, tuple[str, tuple[str, ...]]]:
+    """Indici presenti nel DB (esclusi quelli automatici): nome -> (tabella, colonne)."""
+    rows = db.session.execute(text(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    )).fetchall()
+    found = {}
+    for name, table in rows:
+        cols = db.session.execute(text(f'PRAGMA index_info("{name}")')).fetchall()
+        found[name] = (table, tuple(col[2] for col in sorted(cols)))
+    return found
+
+
+def index_advice() -> dict[str, list]:
+    """Confronta gli indici dichiarati nei modelli con quelli in sqlite_master.
+    Restituisce {"missing": [...], "different": [...], "undeclared": [...]}."""
+    existing = _db_indexes()
+    existing_tables = {
+        row[0] for row in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    }
+    declared = {}
+    advice = {"missing": [], "different": [], "undeclared": []}
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for index in table.indexes:
+            cols = tuple(col.name for col in index.columns)
+            declared[index.name] = (table.name, cols)
+            if index.name not in existing:
+                advice["missing"].append((table.name, index.name, cols))
+            elif existing[index.name] != (table.name, cols):
+                advice["different"].append((table.name, index.name, cols))
+    declared_tables = {table.name for table in db.metadata.sorted_tables}
+    for name, (table, cols) in existing.items():
+        if name not in declared and table in declared_tables:
+            advice["undeclared"].append((table, name, cols))
+    return advice
+
+
+def create_missing_indexes() -> list[str]:
+    """Crea gli indici dichiarati mancanti e ricrea quelli con colonne diverse."""
+    advice = index_advice()
+    to_fix = {name for _table, name, _cols in advice["missing"] + advice["different"]}
+    if not to_fix:
+        return []
+    for name in {name for _table, name, _cols in advice["different"]}:
+        db.session.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in to_fix:
+                index.create(db.engine, checkfirst=True)
+    # aggiorna le statistiche del planner per i nuovi indici
+    db.session.execute(text("PRAGMA optimize"))
+    db.session.commit()
+    return sorted(to_fix)
+
+
+@app.cli.command("check-indexes")
+@click.option("--fix", is_flag=True, help="Crea gli indici mancanti.")
+def check_indexes_command(fix: bool):
+    """Verifica che gli indici dichiarati nei modelli esistano nel DB (esce con errore se mancano)."""
+    if fix:
+        for name in create_missing_indexes():
+            click.echo(f"creato: {name}")
+    advice = index_advice()
+    for kind in ("missing", "different", "undeclared"):
+        for table, name, cols in advice[kind]:
+            click.echo(f"{kind}: {table}.{name} ({', '.join(cols)})")
+    if advice["missing"] or advice["different"]:
+        raise SystemExit(1)
+    click.echo("Indici allineati ai modelli.")
+
+
+def _read_schema_version() -> int:
+    try:
+        return db.session.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+    except OperationalError:
+        db.session.rollback()
+        return 0
+
+
+def run_migrations() -> list[str]:
+    """Applica le migrazioni mancanti sotto lock esclusivo tra processi; restituisce quelle eseguite."""
+    latest = SCHEMA_MIGRATIONS[-1][0]
+    if _read_schema_version() >= latest:
+        return []
+    applied = []
+    with instance_file_lock("migrate.lock"):
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+        db.session.commit()
+        current = _read_schema_version()  # un altro processo può averle già applicate
+        db.session.commit()
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            app.logger.info("Migrazione schema %s: %s", version, name)
+            try:
+                migrate()
+                db.session.execute(
+                    text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                    {"v": version, "n": name, "t": datetime.now(timezone.utc).replace(tzinfo=None)},
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            applied.append(f"{version}: {name}")
+    return applied
+
 
 def ensure_core_schema():
-    """Esegue una verifica unica dello schema per aggiungere colonne mancanti."""
+    """Porta lo schema all'ultima versione, una volta per processo."""
     global _schema_checked
     if _schema_checked:
         return
-    ensure_settings_columns()
-    ensure_item_columns()
-    ensure_category_columns()
-    ensure_mqtt_settings_columns()
-    ensure_katodo_settings_columns()
-    ensure_slot_columns()
-    ensure_user_columns()
+    run_migrations()
+    # anche quando le migrazioni erano già applicate da un altro processo
+    item_fts_tables()
     _schema_checked = True
 
 @app.before_request
 def prepare_schema():
     ensure_core_schema()
-    global _auth_seeded
-    if not _auth_seeded:
-        ensure_auth_defaults()
-        _auth_seeded = True
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Applica le migrazioni di schema mancanti."""
+    applied = run_migrations()
+    click.echo("\n".join(applied) if applied else f"Schema aggiornato (versione {_read_schema_version()}).")
 
 @app.before_request
 def enforce_login_and_permissions():
     if request.endpoint in {"login", "register", "static"}:
         return None
     try:
-        user_count = User.query.count()
+        users_exist = has_any_user()
     except Exception:
         return None
-    if user_count == 0 and request.endpoint not in {"login", "register"}:
+    if not users_exist:
         return redirect(url_for("login"))
     if request.path.startswith("/admin"):
         if not current_user.is_authenticated:
@@ -1442,9 +2518,87 @@ def get_katodo_settings() -> KatodoSettings:
         db.session.commit()
     return s
 
+# ===================== IMPOSTAZIONI IN CACHE =====================
+# Snapshot immutabili (namedtuple) delle righe di configurazione, riusati tra richieste
+# finché la versione in cache_version (incrementata dai trigger) non cambia.
+# Per modificare le impostazioni usare get_settings()/get_mqtt_settings()/get_katodo_settings().
+_SETTINGS_SNAPSHOTS: dict[str, tuple[int, tuple]] = {}
+_SETTINGS_SNAPSHOT_TYPES: dict[str, type] = {}
+
+
+def _settings_snapshot(name: str, model, loader):
+    version = cache_version(name)
+    cached = _SETTINGS_SNAPSHOTS.get(name)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+    row = loader()
+    snapshot_type = _SETTINGS_SNAPSHOT_TYPES.get(name)
+    if snapshot_type is None:
+        fields = [attr.key for attr in db.inspect(model).column_attrs]
+        snapshot_type = namedtuple(f"{model.__name__}Snapshot", fields)
+        _SETTINGS_SNAPSHOT_TYPES[name] = snapshot_type
+    snapshot = snapshot_type(**{field: getattr(row, field) for field in snapshot_type._fields})
+    if version is not None:
+        # Il loader può aver salvato dei default: rilegge la versione dopo il commit
+        forget_cache_versions()
+        _SETTINGS_SNAPSHOTS[name] = (cache_version(name), snapshot)
+    return snapshot
+
+
+def settings_snapshot() -> tuple:
+    """Impostazioni etichette/cartellini in sola lettura (cache condivisa tra richieste)."""
+    return _settings_snapshot("settings", Settings, get_settings)
+
+
+def mqtt_settings_snapshot() -> tuple:
+    return _settings_snapshot("mqtt_settings", MqttSettings, get_mqtt_settings)
+
+
+def katodo_settings_snapshot() -> tuple:
+    return _settings_snapshot("katodo_settings", KatodoSettings, get_katodo_settings)
+
+
+def invalidate_settings_cache(name: str | None = None) -> None:
+    """Da chiamare dopo aver salvato le impostazioni: gli altri processi
+    vedono comunque la nuova versione tramite cache_version."""
+    if name is None:
+        _SETTINGS_SNAPSHOTS.clear()
+    else:
+        _SETTINGS_SNAPSHOTS.pop(name, None)
+    forget_cache_versions()
+
+# Una sola sessione HTTP per processo: connessioni keep-alive riusate tra richieste e
+# tra i thread dell'import, con retry e backoff sugli errori temporanei del negozio.
+_PRESTASHOP_SESSION = None   # (pid, requests.Session)
+_PRESTASHOP_SESSION_LOCK = threading.Lock()
+
+
+def prestashop_session():
+    global _PRESTASHOP_SESSION
+    with _PRESTASHOP_SESSION_LOCK:
+        # dopo un fork le connessioni del padre non vanno riusate
+        if _PRESTASHOP_SESSION is None or _PRESTASHOP_SESSION[0] != os.getpid():
+            import requests as _requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=KATODO_HTTP_RETRIES,
+                backoff_factor=KATODO_HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"}),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=KATODO_CONCURRENCY_MAX, max_retries=retry)
+            session = _requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _PRESTASHOP_SESSION = (os.getpid(), session)
+        return _PRESTASHOP_SESSION[1]
+
+
 def prestashop_api_request(path: str, settings: KatodoSettings, params: dict = None, timeout: int = 10) -> dict:
     """Esegue GET al WebService PrestaShop. Restituisce {ok, data, status_code, error}."""
-    import requests as _requests
     if not settings.enabled:
         return {"ok": False, "data": None, "status_code": None, "error": "Integrazione Katodo non abilitata."}
     if not settings.api_key or not settings.api_url:
@@ -1456,7 +2610,7 @@ def prestashop_api_request(path: str, settings: KatodoSettings, params: dict = N
         merged_params.update(params)
     merged_params["ws_key"] = settings.api_key  # nginx strips Authorization header on shared hosting
     try:
-        resp = _requests.get(url, params=merged_params, timeout=timeout)
+        resp = prestashop_session().get(url, params=merged_params, timeout=timeout)
         if resp.status_code == 200:
             try:
                 data = resp.json()
@@ -1475,6 +2629,154 @@ def ps_image_url(api_url: str, image_id: int, size: str = "home_default") -> str
     digits = "/".join(str(image_id))
     return f"{base}/img/p/{digits}/{image_id}-{size}.jpg"
 
+def katodo_image_path(image_id: int, size: str) -> str:
+    return os.path.join(KATODO_IMAGE_DIR, size, f"{int(image_id)}.jpg")
+
+
+def _katodo_image_thumbnail(data: bytes, max_px: int) -> bytes:
+    """Riduce l'immagine a max_px di lato (JPEG); senza Pillow restituisce l'originale."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width <= max_px and img.height <= max_px and img.format == "JPEG":
+                return data
+            img.draft("RGB", (max_px, max_px))  # JPEG: decodifica già ridotta, molto più veloce
+            img.thumbnail((max_px, max_px))
+            out = io.BytesIO()
+            img.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+            return out.getvalue()
+    except (OSError, ValueError):
+        return data
+
+
+def fetch_katodo_image(api_url: str, image_id: int, size: str = "thumb") -> Optional[str]:
+    """Scarica (se manca) l'immagine nella cache locale; restituisce il percorso o None."""
+    global _KATODO_IMAGE_ADDED
+    path = katodo_image_path(image_id, size)
+    if os.path.exists(path):
+        return path
+    ps_size, max_px = KATODO_IMAGE_SIZES[size]
+    try:
+        resp = prestashop_session().get(ps_image_url(api_url, image_id, ps_size), timeout=30)
+    except Exception as exc:
+        app.logger.warning(f"[Katodo immagini] {image_id}: {exc}")
+        return None
+    if resp.status_code != 200 or not resp.content:
+        return None
+    data = _katodo_image_thumbnail(resp.content, max_px)
+    # scrittura atomica: chi legge non vede mai un file a metà
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+    except OSError as exc:  # disco pieno, permessi
+        app.logger.warning(f"[Katodo immagini] {image_id}: {exc}")
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    with _KATODO_IMAGE_LOCK:
+        _KATODO_IMAGE_ADDED += len(data)
+    return path
+
+
+def cache_katodo_images(api_url: str, image_ids, size: str = "thumb", progress=None) -> tuple[int, int]:
+    """Scarica in parallelo (al massimo KATODO_IMAGE_DOWNLOADS alla volta) le immagini mancanti.
+
+    `progress(done, total)` viene chiamata almeno ogni KATODO_JOB_HEARTBEAT secondi, anche
+    mentre nessun download termina (heartbeat del job). Restituisce (scaricate, fallite).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    missing = sorted({int(i) for i in image_ids if i} - set(_katodo_cached_ids(size)))
+    fetched = failed = 0
+    if missing:
+        with ThreadPoolExecutor(max_workers=KATODO_IMAGE_DOWNLOADS, thread_name_prefix="katodo-img") as pool:
+            pending = {pool.submit(fetch_katodo_image, api_url, image_id, size) for image_id in missing}
+            last_progress = time.monotonic()
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=KATODO_JOB_HEARTBEAT, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            ok = future.result() is not None
+                        except OSError as exc:  # un'immagine non scrivibile non deve fermare il sync
+                            app.logger.warning(f"[Katodo immagini] {exc}")
+                            ok = False
+                        if ok:
+                            fetched += 1
+                        else:
+                            failed += 1
+                    if progress and time.monotonic() - last_progress >= KATODO_JOB_HEARTBEAT:
+                        progress(fetched + failed, len(missing))
+                        last_progress = time.monotonic()
+            except BaseException:
+                # job perso o interrotto: i download ancora in coda non servono più
+                for future in pending:
+                    future.cancel()
+                raise
+    evict_katodo_image_cache()
+    return fetched, failed
+
+
+def _katodo_cached_ids(size: str) -> list[int]:
+    try:
+        names = os.listdir(os.path.join(KATODO_IMAGE_DIR, size))
+    except FileNotFoundError:
+        return []
+    return [int(name[:-4]) for name in names if name.endswith(".jpg") and name[:-4].isdigit()]
+
+
+def evict_katodo_image_cache(budget_bytes: Optional[int] = None) -> int:
+    """Elimina le immagini usate meno di recente (mtime) finché la cache rientra nel budget."""
+    global _KATODO_IMAGE_ADDED
+    budget = int(KATODO_IMAGE_CACHE_MB * 1024 * 1024) if budget_bytes is None else budget_bytes
+    entries = []
+    total = 0
+    for size in KATODO_IMAGE_SIZES:
+        try:
+            with os.scandir(os.path.join(KATODO_IMAGE_DIR, size)) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        if entry.name.endswith(".tmp") and time.time() - st.st_mtime > 3600:
+                            # residuo di un processo interrotto durante la scrittura
+                            try:
+                                os.remove(entry.path)
+                            except OSError:
+                                pass
+                            continue
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+        except FileNotFoundError:
+            continue
+    with _KATODO_IMAGE_LOCK:
+        _KATODO_IMAGE_ADDED = 0
+    removed = 0
+    if total <= budget:
+        return removed
+    # si scende al 90% del budget per non ripetere la pulizia a ogni nuova immagine
+    target = budget * 0.9
+    for _mtime, size_bytes, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size_bytes
+        removed += 1
+    app.logger.info(f"[Katodo immagini] Rimosse {removed} immagini dalla cache")
+    return removed
+
+
 def get_or_create_permission(key: str, label: str, description: Optional[str] = None, is_system: bool = False) -> Permission:
     perm = Permission.query.filter_by(key=key).first()
     if not perm:
@@ -1541,37 +2843,33 @@ def ensure_auth_defaults():
 
     db.session.commit()
 
-def required_permissions_for_path(path: str) -> Optional[set]:
-    if path.startswith("/admin/config"):
-        return {"manage_config", "manage_users", "manage_roles"}
-    if path.startswith("/admin/users"):
-        return {"manage_users"}
-    if path.startswith("/admin/roles") or path.startswith("/admin/permissions"):
-        return {"manage_roles"}
-    if path.startswith("/admin/categories") or path.startswith("/admin/subtypes"):
-        return {"manage_config"}
-    if path.startswith("/admin/materials") or path.startswith("/admin/finishes"):
-        return {"manage_config"}
-    if path.startswith("/admin/custom_fields") or path.startswith("/admin/settings") or path.startswith("/admin/mqtt"):
-        return {"manage_config"}
-    if path.startswith("/admin/locations") or path.startswith("/admin/cabinets") or path.startswith("/admin/slots"):
-        return {"manage_locations"}
-    if path.startswith("/admin/posizionamento") or path.startswith("/admin/to_place"):
-        return {"manage_placements"}
-    if path.startswith("/admin/unplaced") or path.startswith("/admin/grid_assign"):
-        return {"manage_placements"}
-    if path.startswith("/admin/auto_assign") or path.startswith("/admin/slot_items") or path.startswith("/admin/slot_label"):
-        return {"manage_placements"}
-    if path.startswith("/admin/items"):
-        if any(keyword in path for keyword in ["set_position", "clear_position", "move_slot", "suggest_position"]):
-            return {"manage_placements"}
-        return {"manage_items"}
-    if path.startswith("/admin/labels") or path.startswith("/admin/cards") or path.startswith("/admin/dymo") or path.startswith("/admin/items/export") or path.startswith("/admin/data"):
-        return {"manage_items"}
+# Regole valutate in ordine: il primo prefisso che corrisponde determina i permessi richiesti
+PATH_PERMISSION_RULES: tuple[tuple[tuple[str, ...], frozenset], ...] = (
+    (("/admin/config",), frozenset({"manage_config", "manage_users", "manage_roles"})),
+    (("/admin/users",), frozenset({"manage_users"})),
+    (("/admin/roles", "/admin/permissions"), frozenset({"manage_roles"})),
+    (("/admin/categories", "/admin/subtypes", "/admin/materials", "/admin/finishes",
+      "/admin/custom_fields", "/admin/settings", "/admin/mqtt"), frozenset({"manage_config"})),
+    (("/admin/locations", "/admin/cabinets", "/admin/slots"), frozenset({"manage_locations"})),
+    (("/admin/posizionamento", "/admin/to_place", "/admin/unplaced", "/admin/grid_assign",
+      "/admin/auto_assign", "/admin/slot_items", "/admin/slot_label"), frozenset({"manage_placements"})),
+    (("/admin/items",), frozenset({"manage_items"})),
+    (("/admin/labels", "/admin/cards", "/admin/dymo", "/admin/data"), frozenset({"manage_items"})),
+    (("/admin/katodo",), frozenset({"manage_katodo"})),
+)
+ITEM_PLACEMENT_PATH_KEYWORDS = ("set_position", "clear_position", "move_slot", "suggest_position")
+_PLACEMENT_PERMISSIONS = frozenset({"manage_placements"})
+
+
+@lru_cache(maxsize=2048)
+def required_permissions_for_path(path: str) -> Optional[frozenset]:
     if path == "/admin":
-        return {"manage_items"}
-    if path.startswith("/admin/katodo"):
-        return {"manage_katodo"}
+        return frozenset({"manage_items"})
+    for prefixes, required in PATH_PERMISSION_RULES:
+        if path.startswith(prefixes):
+            if prefixes == ("/admin/items",) and any(keyword in path for keyword in ITEM_PLACEMENT_PATH_KEYWORDS):
+                return _PLACEMENT_PERMISSIONS
+            return required
     return None
 
 def mqtt_payload_for_slot(cabinet: Cabinet, col_code: str, row_num: int, settings: MqttSettings):
@@ -1634,7 +2932,7 @@ def mqtt_payload_for_slot(cabinet: Cabinet, col_code: str, row_num: int, setting
                 if settings.include_item_id:
                     item_data["id"] = it.id
                 if settings.include_item_name:
-                    item_data["name"] = auto_name_for(it)
+                    item_data["name"] = item_display_name(it)
                 if settings.include_item_category:
                     item_data["category"] = cat.name if cat else None
                 if settings.include_item_category_color:
@@ -1683,8 +2981,8 @@ def publish_mqtt_payload(payload: dict, settings: MqttSettings):
 @app.context_processor
 def inject_utils():
     return dict(
-        compose_caption=auto_name_for,
-        app_settings=get_settings,
+        compose_caption=item_display_name,
+        app_settings=settings_snapshot,
         measure_label_for_category=measure_label_for_category,
         formatted_main_measure=formatted_main_measure,
         main_measure_value=main_measure_value,
@@ -2032,38 +3330,44 @@ def inject_user_avatar():
     return {"current_user_avatar": avatar_url_for(current_user) if current_user.is_authenticated else None}
 
 # ===================== PUBLIC =====================
-def _render_articles_page():
-    ensure_core_schema()
-    low_stock_threshold = 5
-    items_q    = Item.query.options(
-        selectinload(Item.category),
-        selectinload(Item.material),
-        selectinload(Item.finish),
-        selectinload(Item.subtype),
-    )
-    text_q = (request.args.get("q") or "").strip()
-    category_id = request.args.get("category_id", type=int)
-    subtype_id = request.args.get("subtype_id", type=int)
-    material_id = request.args.get("material_id", type=int)
-    finish_id = request.args.get("finish_id", type=int)
-    measure_q = (request.args.get("measure") or request.args.get("thread_size") or "").strip()
-    share_filter = request.args.get("share_drawer")
-    stock_filter = request.args.get("stock")
-    pos_cabinet_id = request.args.get("pos_cabinet_id", type=int)
-    pos_col = (request.args.get("pos_col") or "").strip().upper()
-    pos_row = request.args.get("pos_row", type=int)
-    modified_recent_days = request.args.get("modified_recent_days", type=int)
-    modified_from = (request.args.get("modified_from") or "").strip()
-    modified_to = (request.args.get("modified_to") or "").strip()
+ARTICLES_LOW_STOCK_THRESHOLD = 5
+
+
+def _articles_text_filter(items_q, text_q: str):
+    fts_ids = item_search_ids_query(text_q)
+    if fts_ids is not None:
+        return items_q.filter(Item.id.in_(select(fts_ids.c.item_id)))
+    text_q_lower = text_q.lower()
+    return items_q.filter(or_(
+        func.lower(Item.name).contains(text_q_lower),
+        func.lower(Item.description).contains(text_q_lower),
+        func.lower(Item.thread_size).contains(text_q_lower),
+        func.strftime('%Y-%m-%d %H:%M', Item.updated_at).contains(text_q_lower),
+    ))
+
+
+def _articles_filtered_query(args, items_q=None):
+    """Applica i filtri della pagina articoli (querystring) alla query degli articoli."""
+    low_stock_threshold = ARTICLES_LOW_STOCK_THRESHOLD
+    if items_q is None:
+        items_q = Item.query
+    text_q = (args.get("q") or "").strip()
+    category_id = args.get("category_id", type=int)
+    subtype_id = args.get("subtype_id", type=int)
+    material_id = args.get("material_id", type=int)
+    finish_id = args.get("finish_id", type=int)
+    measure_q = (args.get("measure") or args.get("thread_size") or "").strip()
+    share_filter = args.get("share_drawer")
+    stock_filter = args.get("stock")
+    pos_cabinet_id = args.get("pos_cabinet_id", type=int)
+    pos_col = (args.get("pos_col") or "").strip().upper()
+    pos_row = args.get("pos_row", type=int)
+    modified_recent_days = args.get("modified_recent_days", type=int)
+    modified_from = (args.get("modified_from") or "").strip()
+    modified_to = (args.get("modified_to") or "").strip()
 
     if text_q:
-        text_q_lower = text_q.lower()
-        items_q = items_q.filter(or_(
-            func.lower(Item.name).contains(text_q_lower),
-            func.lower(Item.description).contains(text_q_lower),
-            func.lower(Item.thread_size).contains(text_q_lower),
-            func.strftime('%Y-%m-%d %H:%M', Item.updated_at).contains(text_q_lower),
-        ))
+        items_q = _articles_text_filter(items_q, text_q)
     if category_id:
         items_q = items_q.filter(Item.category_id == category_id)
     if subtype_id:
@@ -2110,7 +3414,17 @@ def _render_articles_page():
             items_q = items_q.filter(Item.updated_at < to_dt)
         except ValueError:
             pass
-    items = items_q.all()
+    return items_q
+
+
+def _render_articles_page():
+    ensure_core_schema()
+    low_stock_threshold = ARTICLES_LOW_STOCK_THRESHOLD
+    stock_filter = request.args.get("stock")
+    measure_q = (request.args.get("measure") or request.args.get("thread_size") or "").strip()
+    modified_recent_days = request.args.get("modified_recent_days", type=int)
+    modified_from = (request.args.get("modified_from") or "").strip()
+    modified_to = (request.args.get("modified_to") or "").strip()
 
     categories = Category.query.order_by(Category.name).all()
     subtypes   = Subtype.query.order_by(Subtype.name).all()
@@ -2120,17 +3434,6 @@ def _render_articles_page():
     cabinets   = Cabinet.query.order_by(Cabinet.name).all()
     measure_labels = build_measure_labels(categories)
 
-    assignments = (
-        db.session.query(Assignment.item_id, Cabinet, Slot)
-        .join(Slot, Assignment.slot_id == Slot.id)
-        .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-        .all()
-    )
-    pos_by_item = {
-        item_id: slot_full_label(cab, slot, for_print=False)
-        for item_id, cab, slot in assignments
-    }
-
     thread_standards, sizes_by_standard = load_form_options()
     default_standard_code = next(
         (s.code for s in thread_standards if s.code == "M"),
@@ -2157,13 +3460,12 @@ def _render_articles_page():
     if current_url.endswith("?"):
         current_url = current_url[:-1]
     return render_template("articles.html",
-        items=items, categories=categories, materials=materials, finishes=finishes,
+        categories=categories, materials=materials, finishes=finishes,
         locations=locations, cabinets=cabinets,
         subtypes_by_cat=subtypes_by_cat,
         thread_standards=thread_standards,
         sizes_by_standard=sizes_by_standard,
         default_standard_code=default_standard_code,
-        pos_by_item=pos_by_item,
         custom_fields=serialized_custom_fields,
         subtypes=subtypes,
         category_fields=category_fields,
@@ -2191,6 +3493,102 @@ def index():
 def articles():
     return _render_articles_page()
 
+def _articles_order_columns():
+    main_measure = case(
+        (Category.main_measure_mode == "thickness", func.coalesce(Item.thickness_mm, Item.length_mm)),
+        else_=func.coalesce(Item.length_mm, Item.thickness_mm),
+    )
+    return {
+        "id": Item.id,
+        "updated_at": Item.updated_at,
+        "category": Category.name,
+        "name": Item.name,
+        "thread_size": Item.thread_size,
+        "outer_d_mm": Item.outer_d_mm,
+        "main_measure": main_measure,
+        "material": Material.name,
+        "quantity": Item.quantity,
+        "share_drawer": Item.share_drawer,
+    }
+
+@app.route("/api/articles")
+def api_articles():
+    """Sorgente dati server-side per la tabella articoli (protocollo DataTables)."""
+    ensure_core_schema()
+    args = request.args
+    draw = args.get("draw", type=int) or 0
+    start = max(0, args.get("start", type=int) or 0)
+    length = args.get("length", type=int)
+    if length is None or length < 0:
+        length = 100
+    length = min(length, 500)
+
+    base_q = _articles_filtered_query(args)
+    search_value = (args.get("search[value]") or "").strip()
+    if search_value:
+        base_q = _articles_text_filter(base_q, search_value)
+
+    records_total = db.session.query(func.count(Item.id)).scalar() or 0
+    records_filtered = base_q.order_by(None).count()
+
+    order_columns = _articles_order_columns()
+    order_by = []
+    idx = 0
+    while f"order[{idx}][column]" in args:
+        col_idx = args.get(f"order[{idx}][column]", type=int)
+        col_name = args.get(f"columns[{col_idx}][data]")
+        col = order_columns.get(col_name)
+        if col is not None:
+            direction = (args.get(f"order[{idx}][dir]") or "asc").lower()
+            order_by.append(col.desc() if direction == "desc" else col.asc())
+        idx += 1
+    order_by.append(Item.id.asc())
+
+    page_items = (
+        base_q
+        .outerjoin(Category, Item.category_id == Category.id)
+        .outerjoin(Material, Item.material_id == Material.id)
+        .options(*item_eager_options())
+        .order_by(*order_by)
+        .offset(start)
+        .limit(length)
+        .all()
+    )
+
+    pos_by_item = positions_for_items(it.id for it in page_items)
+
+    next_url = _safe_next_url(args.get("next")) or url_for("articles")
+    can_manage_items = current_user.is_authenticated and current_user.has_permission("manage_items")
+    data = []
+    for it in page_items:
+        row = {
+            "id": it.id,
+            "category_id": it.category_id,
+            "updated_at": it.updated_at.strftime('%d/%m/%Y %H:%M') if it.updated_at else "",
+            "category": it.category.name if it.category else "",
+            "category_color": it.category.color if it.category else None,
+            "name": item_display_name(it),
+            "thread_size": it.thread_size or "",
+            "outer_d_mm": f"{it.outer_d_mm:.2f}" if it.outer_d_mm is not None else "",
+            "main_measure": formatted_main_measure(it) or "",
+            "main_measure_label": measure_label_for_category(it.category, include_units=False),
+            "material": it.material.name if it.material else "",
+            "quantity": it.quantity,
+            "position": pos_by_item.get(it.id, ""),
+            "share_drawer": bool(it.share_drawer),
+        }
+        if can_manage_items:
+            row["edit_url"] = url_for("edit_item", item_id=it.id, next=next_url)
+            row["delete_url"] = url_for("delete_item", item_id=it.id)
+        data.append(row)
+
+    return jsonify({
+        "draw": draw,
+        "recordsTotal": records_total,
+        "recordsFiltered": records_filtered,
+        "data": data,
+    })
+
 def build_full_grid(cabinet_id:int):
     cab = db.session.get(Cabinet, cabinet_id)
     if not cab: return {"rows":[], "cols":[], "cells":{}, "cab":None}
@@ -2284,7 +3682,7 @@ def build_full_grid(cabinet_id:int):
         cell["entries"].append({
             "text": summary,
             "color": color,
-            "name": auto_name_for(it),
+            "name": item_display_name(it),
             "description": it.description,
             "quantity": it.quantity,
             "share_drawer": bool(getattr(it, "share_drawer", False)),
@@ -2368,12 +3766,7 @@ def unified_thickness_value(item: Item):
 @app.route("/item/<int:item_id>")
 def item_view(item_id):
     """Mobile-friendly card view for QR code scans."""
-    item = Item.query.get_or_404(item_id)
-    a = (db.session.query(Assignment, Slot, Cabinet)
-         .join(Slot, Assignment.slot_id == Slot.id)
-         .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-         .filter(Assignment.item_id == item.id).first())
-    position = slot_full_label(a[2], a[1], for_print=False) if a else None
+    item, position = load_item_with_position_or_404(item_id)
     low_stock_threshold = 5
     custom_values = (
         db.session.query(ItemCustomFieldValue, CustomField)
@@ -2392,15 +3785,10 @@ def item_view(item_id):
 
 @app.route("/api/items/<int:item_id>.json")
 def api_item(item_id):
-    item = Item.query.get_or_404(item_id)
-    a = (db.session.query(Assignment, Slot, Cabinet)
-         .join(Slot, Assignment.slot_id == Slot.id)
-         .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-         .filter(Assignment.item_id == item.id).first())
-    full_pos = slot_full_label(a[2], a[1], for_print=False) if a else None
+    item, full_pos = load_item_with_position_or_404(item_id)
     return jsonify({
         "id": item.id,
-        "name": auto_name_for(item),
+        "name": item_display_name(item),
         "description": item.description,
         "category": item.category.name if item.category else None,
         "category_color": item.category.color if item.category else None,
@@ -2420,35 +3808,29 @@ def api_search():
     q = (request.args.get("q") or "").strip()
     if len(q) < 2:
         return jsonify([])
-    pattern = f"%{q}%"
-    items = (
-        Item.query
-        .join(Item.category)
-        .filter(
-            or_(
-                Item.name.ilike(pattern),
-                Category.name.ilike(pattern),
-                Item.thread_size.ilike(pattern),
-                Item.description.ilike(pattern),
+    ranked_ids = item_search_ranked_ids(q, limit=10)
+    if ranked_ids is None:
+        pattern = f"%{q}%"
+        ranked_ids = [
+            item_id for (item_id,) in
+            db.session.query(Item.id)
+            .join(Item.category)
+            .filter(
+                or_(
+                    Item.name.ilike(pattern),
+                    Category.name.ilike(pattern),
+                    Item.thread_size.ilike(pattern),
+                    Item.description.ilike(pattern),
+                )
             )
-        )
-        .order_by(Item.name)
-        .limit(10)
-        .all()
-    )
+            .order_by(Item.name)
+            .limit(10)
+        ]
     results = []
-    for item in items:
-        asgn = (
-            db.session.query(Assignment, Slot, Cabinet)
-            .join(Slot, Assignment.slot_id == Slot.id)
-            .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-            .filter(Assignment.item_id == item.id)
-            .first()
-        )
-        pos = slot_full_label(asgn[2], asgn[1], for_print=False) if asgn else None
+    for item, pos in load_items_with_positions(ranked_ids):
         results.append({
             "id": item.id,
-            "name": auto_name_for(item),
+            "name": item_display_name(item),
             "category": item.category.name if item.category else None,
             "category_color": item.category.color if item.category else None,
             "quantity": item.quantity,
@@ -2497,6 +3879,7 @@ def api_slot_lookup():
         .join(Category, Item.category_id == Category.id, isouter=True)
         .join(Slot, Assignment.slot_id == Slot.id)
         .filter(Assignment.slot_id.in_(slot_ids))
+        .options(*item_eager_options())
         .order_by(Slot.col_code, Slot.row_num, Assignment.compartment_no)
         .all()
     )
@@ -2504,7 +3887,7 @@ def api_slot_lookup():
     for a, it, cat, slot in assigns:
         items.append({
             "id": it.id,
-            "name": auto_name_for(it),
+            "name": item_display_name(it),
             "category": cat.name if cat else None,
             "color": cat.color if cat else "#999999",
             "position": slot_label(slot, for_display=True, fallback_col=slot.col_code, fallback_row=slot.row_num),
@@ -2517,107 +3900,272 @@ def api_slot_lookup():
 def admin_items():
     return _render_articles_page()
 
+ITEMS_CSV_HEADER = [
+    "id",
+    "name",
+    "category",
+    "subtype",
+    "thread_standard",
+    "thread_size",
+    "length_mm",
+    "outer_d_mm",
+    "inner_d_mm",
+    "thickness_mm",
+    "material",
+    "finish",
+    "description",
+    "quantity",
+    "share_drawer",
+    "updated_at",
+    "position",
+]
+EXPORT_CHUNK_ROWS = 1000
+
+
+def slot_full_label_sql(*, for_print: bool = False):
+    """Equivalente SQL di slot_full_label(cabinet, slot) per query con Slot e Cabinet in join."""
+    override = func.trim(Slot.print_label_override if for_print else Slot.display_label_override)
+    base = case(
+        (func.coalesce(override, "") != "", override),
+        else_=func.upper(Slot.col_code).op("||")(Slot.row_num),
+    )
+    return case(
+        (func.coalesce(Cabinet.name, "") != "", Cabinet.name.op("||")("-").op("||")(base)),
+        else_=base,
+    )
+
+
+def _items_export_rows():
+    """Righe dell'export articoli lette a blocchi dal cursore, con nomi e posizione calcolati in SQL."""
+    # una sola posizione per articolo (l'assegnazione più recente, come il vecchio dizionario)
+    last_assignment = (
+        select(Assignment.item_id, func.max(Assignment.id).label("assignment_id"))
+        .group_by(Assignment.item_id)
+        .subquery()
+    )
+    stmt = (
+        select(
+            Item.id,
+            Item.name,
+            Category.name,
+            Subtype.name,
+            Item.thread_standard,
+            Item.thread_size,
+            Item.length_mm,
+            Item.outer_d_mm,
+            Item.inner_d_mm,
+            Item.thickness_mm,
+            Material.name,
+            Finish.name,
+            Item.description,
+            Item.quantity,
+            Item.share_drawer,
+            Item.updated_at,
+            slot_full_label_sql(),
+        )
+        .outerjoin(Category, Item.category_id == Category.id)
+        .outerjoin(Subtype, Item.subtype_id == Subtype.id)
+        .outerjoin(Material, Item.material_id == Material.id)
+        .outerjoin(Finish, Item.finish_id == Finish.id)
+        .outerjoin(last_assignment, last_assignment.c.item_id == Item.id)
+        .outerjoin(Assignment, Assignment.id == last_assignment.c.assignment_id)
+        .outerjoin(Slot, Assignment.slot_id == Slot.id)
+        .outerjoin(Cabinet, Slot.cabinet_id == Cabinet.id)
+        .order_by(Item.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+    for row in db.session.execute(stmt):
+        (item_id, name, category, subtype_name, thread_standard, thread_size, length_mm, outer_d_mm,
+         inner_d_mm, thickness_mm, material, finish, description, quantity, share_drawer,
+         updated_at, position) = row
+        if not name:
+            name = item_display_name(db.session.get(Item, item_id))
+        yield [
+            item_id,
+            name,
+            category or "",
+            subtype_name or "",
+            thread_standard or "",
+            thread_size or "",
+            length_mm if length_mm is not None else "",
+            outer_d_mm if outer_d_mm is not None else "",
+            inner_d_mm if inner_d_mm is not None else "",
+            thickness_mm if thickness_mm is not None else "",
+            material or "",
+            finish or "",
+            description or "",
+            quantity,
+            "1" if share_drawer else "0",
+            updated_at.isoformat() if updated_at else "",
+            position or "",
+        ]
+
+
+def stream_csv(header: list, rows, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Generatore di blocchi CSV codificati UTF-8 (un blocco ogni chunk_rows righe)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
 @app.route("/admin/items/export")
 @login_required
 def export_items_csv():
-    items = Item.query.options(
-        selectinload(Item.category),
-        selectinload(Item.subtype),
-        selectinload(Item.material),
-        selectinload(Item.finish),
-    ).order_by(Item.id).all()
-
-    assignments = (
-        db.session.query(Assignment.item_id, Cabinet, Slot)
-        .join(Slot, Assignment.slot_id == Slot.id)
-        .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-        .all()
+    return Response(
+        stream_with_context(stream_csv(ITEMS_CSV_HEADER, _items_export_rows())),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=articoli.csv", "X-Accel-Buffering": "no"},
     )
-    pos_by_item = {
-        item_id: slot_full_label(cab, slot, for_print=False)
-        for item_id, cab, slot in assignments
-    }
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "id",
-        "name",
-        "category",
-        "subtype",
-        "thread_standard",
-        "thread_size",
-        "length_mm",
-        "outer_d_mm",
-        "inner_d_mm",
-        "thickness_mm",
-        "material",
-        "finish",
-        "description",
-        "quantity",
-        "share_drawer",
-        "updated_at",
-        "position",
-    ])
-    for item in items:
-        writer.writerow([
-            item.id,
-            auto_name_for(item),
-            item.category.name if item.category else "",
-            item.subtype.name if item.subtype else "",
-            item.thread_standard or "",
-            item.thread_size or "",
-            item.length_mm if item.length_mm is not None else "",
-            item.outer_d_mm if item.outer_d_mm is not None else "",
-            item.inner_d_mm if item.inner_d_mm is not None else "",
-            item.thickness_mm if item.thickness_mm is not None else "",
-            item.material.name if item.material else "",
-            item.finish.name if item.finish else "",
-            item.description or "",
-            item.quantity,
-            "1" if item.share_drawer else "0",
-            item.updated_at.isoformat() if item.updated_at else "",
-            pos_by_item.get(item.id, ""),
-        ])
+@app.route("/admin/items/export.xlsx")
+@login_required
+def export_items_xlsx():
+    # Un .xlsx è uno zip: non si può spedire prima del salvataggio. Il workbook write_only scrive
+    # le righe su disco man mano e il file temporaneo (già rimosso dal filesystem) viene inviato a blocchi.
+    import tempfile
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Articoli")
+    sheet.append(ITEMS_CSV_HEADER)
+    for row in _items_export_rows():
+        sheet.append([None if value == "" else value for value in row])
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
     output.seek(0)
-    buffer = io.BytesIO(output.getvalue().encode("utf-8"))
-    return send_file(buffer, as_attachment=True, download_name="articoli.csv", mimetype="text/csv")
+    return send_file(
+        output,
+        as_attachment=True,
+        download_name="articoli.xlsx",
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+
+# Tabelle dell'export completo, in ordine di dipendenza (l'import le rilegge nello stesso ordine)
+DATA_FORMAT_VERSION = 2
+# limite del JSON legacy, letto intero in memoria (l'NDJSON non ha limiti: è letto in streaming)
+JSON_IMPORT_MAX_MB = float(os.getenv("MAGAZZINO_JSON_IMPORT_MAX_MB", "100"))
+DATA_TABLES = [
+    ("categories", Category, ["id", "name", "color", "main_measure_mode"]),
+    ("materials", Material, ["id", "name"]),
+    ("finishes", Finish, ["id", "name"]),
+    ("thread_standards", ThreadStandard, ["id", "code", "label", "sort_order"]),
+    ("thread_sizes", ThreadSize, ["id", "standard_id", "value", "sort_order"]),
+    ("custom_fields", CustomField, ["id", "name", "field_type", "options", "unit", "sort_order", "is_active"]),
+    ("category_field_settings", CategoryFieldSetting, ["id", "category_id", "field_key", "is_enabled"]),
+    ("subtypes", Subtype, ["id", "category_id", "name"]),
+    ("locations", Location, ["id", "name"]),
+    ("cabinets", Cabinet, ["id", "location_id", "name", "rows_max", "cols_max", "compartments_per_slot"]),
+    ("slots", Slot, ["id", "cabinet_id", "row_num", "col_code", "is_blocked", "display_label_override", "print_label_override"]),
+    ("drawer_merges", DrawerMerge, ["id", "cabinet_id", "row_start", "row_end", "col_start", "col_end"]),
+    ("items", Item, [
+        "id", "category_id", "subtype_id", "name", "description", "share_drawer",
+        "thread_standard", "thread_size", "inner_d_mm", "thickness_mm", "length_mm", "outer_d_mm",
+        "material_id", "finish_id", "quantity", "label_show_category", "label_show_subtype",
+        "label_show_thread", "label_show_measure", "label_show_main", "label_show_material", "updated_at"
+    ]),
+    ("item_custom_field_values", ItemCustomFieldValue, ["id", "item_id", "field_id", "value_text"]),
+    ("assignments", Assignment, ["id", "slot_id", "compartment_no", "item_id"]),
+]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+
+def _dump_json(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+def _iter_table_records(model, fields: list[str]):
+    """Record di una tabella letti a blocchi dal cursore (colonne, non oggetti ORM)."""
+    columns = [getattr(model, field) for field in fields]
+    stmt = select(*columns).order_by(model.id).execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    for row in db.session.execute(stmt):
+        yield dict(zip(fields, row))
+
+
+def _data_export_json_chunks(exported_at: str):
+    """Oggetto JSON compatibile con l'import, emesso una tabella alla volta."""
+    yield f'{{"format_version": {DATA_FORMAT_VERSION}, "exported_at": {_dump_json(exported_at)}'
+    for name, model, fields in DATA_TABLES:
+        yield f",\n{_dump_json(name)}: ["
+        parts = []
+        for idx, record in enumerate(_iter_table_records(model, fields)):
+            parts.append(("\n" if idx == 0 else ",\n") + _dump_json(record))
+            if len(parts) >= EXPORT_CHUNK_ROWS:
+                yield "".join(parts)
+                parts = []
+        parts.append("]")
+        yield "".join(parts)
+    yield "}\n"
+
+
+def _data_export_ndjson_chunks(exported_at: str):
+    """Una riga di intestazione, poi una riga per record ({"table": ..., "row": ...}) e una di chiusura."""
+    yield _dump_json({
+        "format_version": DATA_FORMAT_VERSION,
+        "format": "ndjson",
+        "exported_at": exported_at,
+        "tables": [name for name, _model, _fields in DATA_TABLES],
+    }) + "\n"
+    counts = {}
+    for name, model, fields in DATA_TABLES:
+        parts = []
+        counts[name] = 0
+        for record in _iter_table_records(model, fields):
+            parts.append(_dump_json({"table": name, "row": record}) + "\n")
+            counts[name] += 1
+            if len(parts) >= EXPORT_CHUNK_ROWS:
+                yield "".join(parts)
+                parts = []
+        if parts:
+            yield "".join(parts)
+    yield _dump_json({"end": True, "counts": counts}) + "\n"
+
+
+def _encode_chunks(chunks, compress: bool):
+    """Codifica UTF-8 ed eventualmente comprime in gzip al volo."""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+    import zlib
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
 
-def _serialize_records(query, fields: list[str]) -> list[dict]:
-    records = []
-    for obj in query:
-        record = {field: getattr(obj, field) for field in fields}
-        records.append(record)
-    return records
 
 @app.route("/admin/data/export.json")
 @login_required
 def export_data_json():
-    payload = {
-        "exported_at": datetime.now(timezone.utc).isoformat(),
-        "categories": _serialize_records(Category.query.order_by(Category.id), ["id", "name", "color", "main_measure_mode"]),
-        "materials": _serialize_records(Material.query.order_by(Material.id), ["id", "name"]),
-        "finishes": _serialize_records(Finish.query.order_by(Finish.id), ["id", "name"]),
-        "thread_standards": _serialize_records(ThreadStandard.query.order_by(ThreadStandard.id), ["id", "code", "label", "sort_order"]),
-        "thread_sizes": _serialize_records(ThreadSize.query.order_by(ThreadSize.id), ["id", "standard_id", "value", "sort_order"]),
-        "custom_fields": _serialize_records(CustomField.query.order_by(CustomField.id), ["id", "name", "field_type", "options", "unit", "sort_order", "is_active"]),
-        "category_field_settings": _serialize_records(CategoryFieldSetting.query.order_by(CategoryFieldSetting.id), ["id", "category_id", "field_key", "is_enabled"]),
-        "item_custom_field_values": _serialize_records(ItemCustomFieldValue.query.order_by(ItemCustomFieldValue.id), ["id", "item_id", "field_id", "value_text"]),
-        "subtypes": _serialize_records(Subtype.query.order_by(Subtype.id), ["id", "category_id", "name"]),
-        "locations": _serialize_records(Location.query.order_by(Location.id), ["id", "name"]),
-        "cabinets": _serialize_records(Cabinet.query.order_by(Cabinet.id), ["id", "location_id", "name", "rows_max", "cols_max", "compartments_per_slot"]),
-        "slots": _serialize_records(Slot.query.order_by(Slot.id), ["id", "cabinet_id", "row_num", "col_code", "is_blocked", "display_label_override", "print_label_override"]),
-        "drawer_merges": _serialize_records(DrawerMerge.query.order_by(DrawerMerge.id), ["id", "cabinet_id", "row_start", "row_end", "col_start", "col_end"]),
-        "items": _serialize_records(Item.query.order_by(Item.id), [
-            "id", "category_id", "subtype_id", "name", "description", "share_drawer",
-            "thread_standard", "thread_size", "inner_d_mm", "thickness_mm", "length_mm", "outer_d_mm",
-            "material_id", "finish_id", "quantity", "label_show_category", "label_show_subtype",
-            "label_show_thread", "label_show_measure", "label_show_main", "label_show_material", "updated_at"
-        ]),
-        "assignments": _serialize_records(Assignment.query.order_by(Assignment.id), ["id", "slot_id", "compartment_no", "item_id"]),
-    }
-    buffer = io.BytesIO(json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8"))
-    return send_file(buffer, as_attachment=True, download_name="magazzino_data.json", mimetype="application/json")
+    """Export completo in streaming: ?format=ndjson per una riga per record, ?gzip=1 per comprimere."""
+    ndjson = (request.args.get("format") or "").lower() == "ndjson"
+    compress = _parse_bool(request.args.get("gzip"))
+    exported_at = datetime.now(timezone.utc).isoformat()
+    chunks = _data_export_ndjson_chunks(exported_at) if ndjson else _data_export_json_chunks(exported_at)
+    filename = "magazzino_data.ndjson" if ndjson else "magazzino_data.json"
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    if compress:
+        filename += ".gz"
+        mimetype = "application/gzip"
+    return Response(
+        stream_with_context(_encode_chunks(chunks, compress)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"},
+    )
 
 @app.route("/admin/data/export.csv")
 @login_required
@@ -2637,109 +4185,445 @@ def _parse_float(value: str | None) -> float | None:
         return None
     return float(cleaned)
 
-def _find_or_create_by_name(model, name: str, **extra_fields):
-    cleaned = (name or "").strip()
+IMPORT_CHUNK_ROWS = 1000
+
+
+def _parse_position(value: str) -> tuple[str | None, str | None, int | None]:
+    cleaned = (value or "").strip()
     if not cleaned:
-        return None
-    instance = model.query.filter_by(name=cleaned).first()
-    if instance:
-        return instance
-    instance = model(name=cleaned, **extra_fields)
-    db.session.add(instance)
+        return None, None, None
+    if "-" not in cleaned:
+        return None, None, None
+    cab_name, slot_label = cleaned.rsplit("-", 1)
+    cab_name = cab_name.strip()
+    slot_label = slot_label.strip().upper()
+    match = re.match(r"^([A-Z]{1,2})(\d+)$", slot_label)
+    if not match:
+        return None, None, None
+    return cab_name, match.group(1), int(match.group(2))
+
+def _load_import_lookups() -> dict:
+    """Mappe nome -> id caricate una volta sola per tutto l'import (niente query per riga)."""
+    return {
+        "category": dict(db.session.execute(select(Category.name, Category.id)).all()),
+        "subtype": {
+            (cat_id, name): st_id
+            for st_id, cat_id, name in db.session.execute(select(Subtype.id, Subtype.category_id, Subtype.name))
+        },
+        "material": dict(db.session.execute(select(Material.name, Material.id)).all()),
+        "finish": dict(db.session.execute(select(Finish.name, Finish.id)).all()),
+        "cabinet": dict(db.session.execute(select(Cabinet.name, Cabinet.id)).all()),
+        "item_ids": set(db.session.execute(select(Item.id)).scalars()),
+        "objects": {},
+    }
+
+def _import_item_names(values: dict, lookups: dict) -> tuple[str, str, str]:
+    # Oggetto leggero con gli stessi attributi di Item: costruire un Item ORM per riga costa più dell'insert.
+    related = lookups["objects"]
+    for model, fk in ((Category, "category_id"), (Subtype, "subtype_id"), (Material, "material_id")):
+        key = (model, values[fk])
+        if values[fk] and key not in related:
+            # riferimento forte: la identity map della sessione è debole
+            related[key] = db.session.get(model, values[fk])
+    item = SimpleNamespace(
+        **values,
+        category=related.get((Category, values["category_id"])),
+        subtype=related.get((Subtype, values["subtype_id"])),
+        material=related.get((Material, values["material_id"])),
+    )
+    return _computed_item_names(item)
+
+def _lookup_or_create(lookups: dict, kind: str, key, factory) -> int:
+    ids = lookups[kind]
+    if key not in ids:
+        instance = factory()
+        db.session.add(instance)
+        db.session.flush()
+        ids[key] = instance.id
+        if kind == "category":
+            reset_category_role_cache()
+    return ids[key]
+
+def _parse_import_row(row: dict, lookups: dict) -> tuple[dict, tuple | None, str | None]:
+    """Valida una riga e ritorna (valori articolo, posizionamento, avviso).
+    Solleva ValueError per le righe da scartare; la tassonomia mancante viene creata solo per righe valide."""
+    category_name = (row.get("category") or "").strip()
+    if not category_name:
+        raise ValueError("categoria mancante")
+    raw_id = (row.get("id") or "").strip()
+    try:
+        item_id = int(raw_id) if raw_id else None
+    except ValueError:
+        raise ValueError(f"id non valido: {raw_id!r}") from None
+    values = {"id": item_id}
+    for field in ("length_mm", "outer_d_mm", "inner_d_mm", "thickness_mm"):
+        try:
+            values[field] = _parse_float(row.get(field))
+        except ValueError:
+            raise ValueError(f"{field} non numerico: {row.get(field)!r}") from None
+    raw_quantity = (row.get("quantity") or "").strip()
+    try:
+        values["quantity"] = int(raw_quantity) if raw_quantity else 0
+    except ValueError:
+        raise ValueError(f"quantità non valida: {raw_quantity!r}") from None
+
+    placement, warning = None, None
+    raw_position = (row.get("position") or "").strip()
+    if raw_position:
+        cab_name, col_code, row_num = _parse_position(raw_position)
+        if not (cab_name and col_code and row_num):
+            warning = f"posizione '{raw_position}' non riconosciuta"
+        elif cab_name not in lookups["cabinet"]:
+            warning = f"cassettiera '{cab_name}' non trovata"
+        else:
+            placement = (lookups["cabinet"][cab_name], col_code, row_num)
+
+    category_id = _lookup_or_create(lookups, "category", category_name, lambda: Category(name=category_name))
+    subtype_name = (row.get("subtype") or "").strip()
+    material_name = (row.get("material") or "").strip()
+    finish_name = (row.get("finish") or "").strip()
+    values.update(
+        category_id=category_id,
+        subtype_id=_lookup_or_create(
+            lookups, "subtype", (category_id, subtype_name),
+            lambda: Subtype(category_id=category_id, name=subtype_name),
+        ) if subtype_name else None,
+        material_id=_lookup_or_create(
+            lookups, "material", material_name, lambda: Material(name=material_name)
+        ) if material_name else None,
+        finish_id=_lookup_or_create(
+            lookups, "finish", finish_name, lambda: Finish(name=finish_name)
+        ) if finish_name else None,
+        thread_standard=(row.get("thread_standard") or "").strip() or None,
+        thread_size=(row.get("thread_size") or "").strip() or None,
+        description=(row.get("description") or "").strip() or None,
+        share_drawer=_parse_bool(row.get("share_drawer")),
+    )
+    return values, placement, warning
+
+def _write_import_chunk(chunk: list, lookups: dict, report: dict) -> None:
+    """Scrive un blocco di righe validate (insert e update in executemany), poi i posizionamenti."""
+    now = datetime.utcnow()
+    inserts, updates = [], []
+    for _line_no, values, _placement in chunk:
+        values["name"], values["label_line1"], values["label_line2"] = _import_item_names(values, lookups)
+        values["updated_at"] = now
+        if values["id"] in lookups["item_ids"]:
+            updates.append(values)
+            continue
+        # Id assegnati qui: la richiesta di import tiene già il lock di scrittura, e così
+        # l'insert resta un executemany senza RETURNING riga per riga.
+        if values["id"] is None:
+            values["id"] = lookups["next_id"]
+        lookups["next_id"] = max(lookups["next_id"], values["id"] + 1)
+        lookups["item_ids"].add(values["id"])
+        inserts.append(values)
+    if inserts:
+        db.session.execute(Item.__table__.insert(), inserts)
+    if updates:
+        db.session.execute(update(Item), updates)
+    report["created"] += len(inserts)
+    report["updated"] += len(updates)
+
+    pending = [(line_no, values["id"], placement) for line_no, values, placement in chunk if placement]
+    if not pending:
+        return
+    items = {
+        item.id: item
+        for item in Item.query.options(*item_eager_options()).filter(Item.id.in_({p[1] for p in pending}))
+    }
+    line_by_item = {item_id: line_no for line_no, item_id, _placement in pending}
+    results = bulk_assign_positions(
+        [(items[item_id], *placement) for _line_no, item_id, placement in pending],
+        force_share=True,
+    )
+    for result in results:
+        if result["ok"]:
+            report["placed"] += 1
+        else:
+            item_id = result["item"].id
+            report["warnings"].append(
+                (line_by_item[item_id], f"posizione non assegnata per articolo {item_id}: {result['error']}")
+            )
     db.session.flush()
-    return instance
 
-def _parse_position(value: str) -> tuple[str | None, str | None, int | None]:
-    cleaned = (value or "").strip()
-    if not cleaned:
-        return None, None, None
-    if "-" not in cleaned:
-        return None, None, None
-    cab_name, slot_label = cleaned.rsplit("-", 1)
-    cab_name = cab_name.strip()
-    slot_label = slot_label.strip().upper()
-    match = re.match(r"^([A-Z]{1,2})(\\d+)$", slot_label)
-    if not match:
-        return None, None, None
-    return cab_name, match.group(1), int(match.group(2))
+class ImportInterrupted(Exception):
+    """Import fermato da un errore dopo che `committed` articoli erano già stati salvati."""
 
-def _import_items_from_csv(file_storage) -> tuple[int, list[str]]:
-    content = file_storage.read()
-    text = content.decode("utf-8-sig")
-    reader = csv.DictReader(io.StringIO(text))
-    imported = 0
-    warnings = []
-    for row in reader:
-        category = _find_or_create_by_name(Category, row.get("category") or "")
-        if not category:
-            warnings.append("Categoria mancante per una riga CSV.")
-            continue
-        subtype = None
-        subtype_name = (row.get("subtype") or "").strip()
-        if subtype_name:
-            subtype = Subtype.query.filter_by(category_id=category.id, name=subtype_name).first()
-            if not subtype:
-                subtype = Subtype(category_id=category.id, name=subtype_name)
-                db.session.add(subtype)
-                db.session.flush()
-        material = _find_or_create_by_name(Material, row.get("material") or "")
-        finish = _find_or_create_by_name(Finish, row.get("finish") or "")
-
-        item_id = None
-        if row.get("id"):
+    def __init__(self, cause: BaseException, committed: int):
+        super().__init__(str(cause))
+        self.committed = committed
+
+def import_item_rows(rows, *, dry_run: bool = False, chunk_rows: int = IMPORT_CHUNK_ROWS) -> dict:
+    """
+    Importa articoli da un iterabile di (numero riga, dict con le colonne di ITEMS_CSV_HEADER).
+    Righe non valide vengono scartate e riportate in "errors"; le altre sono scritte a blocchi
+    di chunk_rows con un commit per blocco. Con dry_run tutto avviene in transazione e viene
+    annullato alla fine: il report dice cosa sarebbe successo.
+    Un errore dopo il primo commit (file illeggibile a metà, DB) solleva ImportInterrupted
+    con il numero di articoli già salvati.
+    """
+    committed = 0
+    report = {"rows": 0, "created": 0, "updated": 0, "placed": 0, "errors": [], "warnings": [], "dry_run": dry_run}
+    lookups = _load_import_lookups()
+    lookups["next_id"] = max(lookups["item_ids"], default=0) + 1
+    chunk = []
+    try:
+        for line_no, row in rows:
+            report["rows"] += 1
             try:
-                item_id = int(row["id"])
-            except ValueError:
-                item_id = None
-        item = Item.query.get(item_id) if item_id else None
-        if not item:
-            item = Item(id=item_id) if item_id else Item()
-            db.session.add(item)
+                values, placement, warning = _parse_import_row(row, lookups)
+            except ValueError as exc:
+                report["errors"].append((line_no, str(exc)))
+                continue
+            if warning:
+                report["warnings"].append((line_no, warning))
+            chunk.append((line_no, values, placement))
+            if len(chunk) >= chunk_rows:
+                _write_import_chunk(chunk, lookups, report)
+                if not dry_run:
+                    db.session.commit()
+                    committed = report["created"] + report["updated"]
+                chunk = []
+        if chunk:
+            _write_import_chunk(chunk, lookups, report)
+    except Exception as exc:
+        db.session.rollback()
+        if committed:
+            raise ImportInterrupted(exc, committed) from exc
+        raise
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    return report
 
-        item.category_id = category.id
-        item.subtype_id = subtype.id if subtype else None
-        item.thread_standard = (row.get("thread_standard") or "").strip() or None
-        item.thread_size = (row.get("thread_size") or "").strip() or None
-        item.length_mm = _parse_float(row.get("length_mm"))
-        item.outer_d_mm = _parse_float(row.get("outer_d_mm"))
-        item.inner_d_mm = _parse_float(row.get("inner_d_mm"))
-        item.thickness_mm = _parse_float(row.get("thickness_mm"))
-        item.material_id = material.id if material else None
-        item.finish_id = finish.id if finish else None
-        item.description = (row.get("description") or "").strip() or None
-        quantity_val = row.get("quantity")
-        item.quantity = int(quantity_val) if quantity_val not in (None, "") else 0
-        item.share_drawer = _parse_bool(row.get("share_drawer"))
-        item.name = auto_name_for(item)
-        db.session.flush()
+def _check_csv_stream(file_storage) -> None:
+    """Prima passata senza scritture: decodifica e parsing dell'intero CSV, così un byte non valido
+    o una riga malformata in fondo al file vengono segnalati prima di qualunque commit."""
+    wrapper = io.TextIOWrapper(file_storage.stream, encoding="utf-8-sig", newline="")
+    try:
+        for _row in csv.reader(wrapper):
+            pass
+    finally:
+        wrapper.detach()  # lo stream dell'upload resta aperto per la seconda passata
+    file_storage.stream.seek(0)
 
-        cab_name, col_code, row_num = _parse_position(row.get("position") or "")
-        if cab_name and col_code and row_num:
-            cabinet = Cabinet.query.filter_by(name=cab_name).first()
-            if cabinet:
-                try:
-                    _assign_position(item, cabinet.id, col_code, row_num, force_share=True)
-                except Exception as exc:
-                    warnings.append(f"Posizione non assegnata per articolo {item.id}: {exc}")
-            else:
-                warnings.append(f"Cassettiera '{cab_name}' non trovata per articolo {item.id}.")
+def _csv_import_rows(file_storage):
+    """Decodifica il CSV in streaming: una riga alla volta, senza leggere tutto il file in memoria."""
+    reader = csv.DictReader(io.TextIOWrapper(file_storage.stream, encoding="utf-8-sig", newline=""))
+    for row in reader:
+        yield reader.line_num, row
 
-        imported += 1
-    db.session.commit()
-    return imported, warnings
+def _xlsx_cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Excel salva anche gli interi come numeri in virgola mobile
+    return str(value)
+
+def _xlsx_import_rows(file_storage):
+    """Apre il primo foglio in modalità read_only e ritorna le righe come per il CSV (intestazione in riga 1)."""
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+    except Exception as exc:  # zip corrotto, file non xlsx, xml non valido
+        raise ValueError(str(exc) or type(exc).__name__) from exc
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    header = [_xlsx_cell_text(value).strip() for value in next(rows, ())]
+
+    def generate():
+        try:
+            for line_no, values in enumerate(rows, start=2):
+                if not any(value not in (None, "") for value in values):
+                    continue
+                yield line_no, {key: _xlsx_cell_text(value) for key, value in zip(header, values) if key}
+        finally:
+            workbook.close()
+
+    return generate()
+
+def _flash_import_report(report: dict, label: str) -> None:
+    for kind, category in (("errors", "danger"), ("warnings", "warning")):
+        entries = report[kind]
+        for line_no, message in entries[:5]:
+            flash(f"Riga {line_no}: {message}", category)
+        if len(entries) > 5:
+            flash(f"Altri {len(entries) - 5} {'errori' if kind == 'errors' else 'avvisi'} durante l'import.", category)
+    valid = report["created"] + report["updated"]
+    summary = (
+        f"{valid} articoli ({report['created']} nuovi, {report['updated']} aggiornati), "
+        f"{report['placed']} posizionati, {len(report['errors'])} righe scartate"
+    )
+    if report["dry_run"]:
+        flash(f"Verifica {label} completata, nessuna modifica salvata: {summary}.", "info")
+    else:
+        flash(f"Import {label} completato: {summary}.", "success")
+
+def _upsert_records(model, records: list[dict], fields: list[str]) -> dict[str, int]:
+    """INSERT ... ON CONFLICT(id) DO UPDATE in executemany: aggiorna solo i campi presenti nel record.
+    Ritorna {"inserted", "updated", "unchanged"}; le righe identiche non vengono riscritte."""
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-def _merge_records(model, records: list[dict], fields: list[str]) -> int:
-    imported = 0
+    table = model.__table__
+    groups: dict[tuple, list[dict]] = {}
     for record in records:
         if not isinstance(record, dict):
             continue
-        payload = {field: record.get(field) for field in fields if field in record}
+        payload = {field: record[field] for field in fields if field in record}
         if not payload:
             continue
-        obj = model(**payload)
-        db.session.merge(obj)
-        imported += 1
-    return imported
+        for field, value in payload.items():
+            # le date arrivano come stringhe ISO dall'export JSON
+            if isinstance(value, str) and isinstance(table.c[field].type, db.DateTime):
+                payload[field] = datetime.fromisoformat(value)
+        groups.setdefault(tuple(payload), []).append(payload)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for keys, payloads in groups.items():
+        stmt = sqlite_insert(table)
+        update_keys = [key for key in keys if key != "id"]
+        existing = 0
+        if "id" in keys:
+            ids = list({payload["id"] for payload in payloads})
+            for start in range(0, len(ids), 500):
+                existing += db.session.execute(
+                    select(func.count()).select_from(table).where(table.c.id.in_(ids[start:start + 500]))
+                ).scalar()
+        if "id" in keys and update_keys:
+            # Righe identiche non vengono riscritte: niente trigger FTS né pagine sporche inutili.
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={key: stmt.excluded[key] for key in update_keys},
+                where=or_(*(table.c[key].is_distinct_from(stmt.excluded[key]) for key in update_keys)),
+            )
+        elif "id" in keys:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.id])
+        # rowcount: righe inserite più righe davvero aggiornate (le invariate non contano)
+        written = db.session.execute(stmt, payloads).rowcount
+        inserted = len(payloads) - existing
+        counts["inserted"] += inserted
+        counts["updated"] += written - inserted
+        counts["unchanged"] += existing - (written - inserted)
+    return counts
+
+def restore_data(batches) -> dict[str, dict[str, int]]:
+    """
+    Ripristina un export (coppie tabella, record in ordine di dipendenza) in un'unica transazione.
+    Il commit resta a carico del chiamante; ritorna per tabella i record inseriti, aggiornati e invariati.
+    """
+    # Con i vincoli attivi, il controllo delle chiavi esterne avviene solo al commit.
+    db.session.execute(text("PRAGMA defer_foreign_keys = ON"))
+    counts: dict[str, dict[str, int]] = {}
+    current = None
+
+    def log_table(name):
+        c = counts[name]
+        app.logger.info("Import JSON: %s completata, %d nuovi, %d aggiornati, %d invariati",
+                        name, c["inserted"], c["updated"], c["unchanged"])
+
+    for name, records in batches:
+        if name != current and current is not None:
+            log_table(current)
+        current = name
+        model, fields = DATA_TABLE_SPECS[name]
+        table_counts = counts.setdefault(name, {"inserted": 0, "updated": 0, "unchanged": 0})
+        for key, value in _upsert_records(model, records, fields).items():
+            table_counts[key] += value
+    if current is not None:
+        log_table(current)
+    return counts
+
+DATA_TABLE_SPECS = {name: (model, fields) for name, model, fields in DATA_TABLES}
+
+
+def _check_data_format_version(header: dict) -> None:
+    version = header.get("format_version", 1)
+    if not isinstance(version, int) or version > DATA_FORMAT_VERSION:
+        raise ValueError(f"versione formato {version!r} non supportata (massima {DATA_FORMAT_VERSION})")
+
+
+def _iter_ndjson_import(reader):
+    """Righe NDJSON dopo l'intestazione; la riga di chiusura è obbligatoria e i conteggi devono tornare."""
+    current, batch = None, []
+    counts: dict[str, int] = {}
+    for line_no, line in enumerate(reader, start=2):
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if not isinstance(entry, dict):
+            raise ValueError(f"riga {line_no} non valida")
+        if entry.get("end"):
+            expected = entry.get("counts")
+            if not isinstance(expected, dict):
+                raise ValueError(f"riga {line_no}: conteggi di chiusura mancanti")
+            for name in expected.keys() | counts.keys():
+                if expected.get(name, 0) != counts.get(name, 0):
+                    raise ValueError(
+                        f"tabella {name}: {counts.get(name, 0)} record letti, {expected.get(name, 0)} attesi"
+                    )
+            if reader.read().strip():
+                raise ValueError(f"dati dopo la riga di chiusura (riga {line_no})")
+            if batch:
+                yield current, batch
+            return
+        name = entry.get("table")
+        if name not in DATA_TABLE_SPECS or not isinstance(entry.get("row"), dict):
+            raise ValueError(f"riga {line_no} non valida")
+        if name != current or len(batch) >= EXPORT_CHUNK_ROWS:
+            if batch:
+                yield current, batch
+            current, batch = name, []
+        batch.append(entry["row"])
+        counts[name] = counts.get(name, 0) + 1
+    # l'ultimo blocco non viene scritto: la transazione sarà annullata dal chiamante
+    raise ValueError("file troncato: manca la riga di chiusura")
+
+
+def _load_json_import(reader, head: str):
+    """Export JSON legacy (un oggetto con un array per tabella): letto intero con json.loads,
+    fino a JSON_IMPORT_MAX_MB. Per file più grandi usare l'export NDJSON, letto in streaming."""
+    limit = int(JSON_IMPORT_MAX_MB * 1024 * 1024)
+    data = head + reader.read(max(limit + 1 - len(head), 0))
+    if len(data) > limit:
+        raise ValueError(f"file JSON oltre {JSON_IMPORT_MAX_MB:g} MB, usa l'export NDJSON")
+    payload = json.loads(data)
+    if not isinstance(payload, dict):
+        raise ValueError("atteso un oggetto JSON")
+    _check_data_format_version(payload)
+    for name, _model, _fields in DATA_TABLES:
+        records = payload.get(name, [])
+        if not isinstance(records, list):
+            raise ValueError(f"tabella {name}: attesa una lista di record")
+        for start in range(0, len(records), EXPORT_CHUNK_ROWS):
+            yield name, records[start:start + EXPORT_CHUNK_ROWS]
+
+
+def _iter_data_import(file_storage):
+    """Legge un export JSON o NDJSON (anche .gz) e restituisce (tabella, record) a blocchi.
+    NDJSON viene letto in streaming; il JSON legacy intero, entro JSON_IMPORT_MAX_MB.
+    Un file troncato viene rifiutato prima del commit."""
+    stream = file_storage.stream
+    if stream.read(2) == b"\x1f\x8b":
+        import gzip
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    reader = io.TextIOWrapper(stream, encoding="utf-8-sig")
+    try:
+        first_line = reader.readline()
+        try:
+            header = json.loads(first_line)
+        except json.JSONDecodeError:
+            header = None
+        if isinstance(header, dict) and header.get("format") == "ndjson":
+            _check_data_format_version(header)
+            yield from _iter_ndjson_import(reader)
+        else:
+            yield from _load_json_import(reader, first_line)
+    except (json.JSONDecodeError, UnicodeDecodeError, OSError, EOFError) as exc:
+        raise ValueError(str(exc)) from exc
 
 @app.route("/admin/data/import", methods=["POST"])
 @login_required
@@ -2751,45 +4635,52 @@ def import_data():
         return redirect(url_for("admin_items"))
 
     if format_name == "csv":
-        imported, warnings = _import_items_from_csv(file_storage)
-        if warnings:
-            for warning in warnings[:5]:
-                flash(warning, "warning")
-            if len(warnings) > 5:
-                flash(f"Altri {len(warnings) - 5} avvisi durante l'import.", "warning")
-        flash(f"Import CSV completato: {imported} articoli.", "success")
+        try:
+            _check_csv_stream(file_storage)
+            report = import_item_rows(_csv_import_rows(file_storage), dry_run=_parse_bool(request.form.get("dry_run")))
+        except (UnicodeDecodeError, csv.Error) as exc:
+            flash(f"File CSV non valido, nessun articolo importato: {exc}", "danger")
+            return redirect(url_for("admin_items"))
+        except ImportInterrupted as exc:
+            flash(f"Import CSV interrotto: {exc}. {exc.committed} articoli erano già stati salvati.", "danger")
+            return redirect(url_for("admin_items"))
+        _flash_import_report(report, "CSV")
         return redirect(url_for("admin_items"))
 
-    if format_name == "json":
+    if format_name == "xlsx":
         try:
-            payload = json.loads(file_storage.read().decode("utf-8"))
-        except (json.JSONDecodeError, ValueError):
-            flash("File JSON non valido.", "danger")
+            rows = _xlsx_import_rows(file_storage)
+            report = import_item_rows(rows, dry_run=_parse_bool(request.form.get("dry_run")))
+        except ValueError as exc:
+            flash(f"File XLSX non valido, nessun articolo importato: {exc}", "danger")
             return redirect(url_for("admin_items"))
+        except ImportInterrupted as exc:
+            flash(f"Import XLSX interrotto: {exc}. {exc.committed} articoli erano già stati salvati.", "danger")
+            return redirect(url_for("admin_items"))
+        _flash_import_report(report, "XLSX")
+        return redirect(url_for("admin_items"))
 
-        total = 0
-        total += _merge_records(Category, payload.get("categories", []), ["id", "name", "color", "main_measure_mode"])
-        total += _merge_records(Material, payload.get("materials", []), ["id", "name"])
-        total += _merge_records(Finish, payload.get("finishes", []), ["id", "name"])
-        total += _merge_records(ThreadStandard, payload.get("thread_standards", []), ["id", "code", "label", "sort_order"])
-        total += _merge_records(ThreadSize, payload.get("thread_sizes", []), ["id", "standard_id", "value", "sort_order"])
-        total += _merge_records(CustomField, payload.get("custom_fields", []), ["id", "name", "field_type", "options", "unit", "sort_order", "is_active"])
-        total += _merge_records(CategoryFieldSetting, payload.get("category_field_settings", []), ["id", "category_id", "field_key", "is_enabled"])
-        total += _merge_records(Subtype, payload.get("subtypes", []), ["id", "category_id", "name"])
-        total += _merge_records(Location, payload.get("locations", []), ["id", "name"])
-        total += _merge_records(Cabinet, payload.get("cabinets", []), ["id", "location_id", "name", "rows_max", "cols_max", "compartments_per_slot"])
-        total += _merge_records(Slot, payload.get("slots", []), ["id", "cabinet_id", "row_num", "col_code", "is_blocked", "display_label_override", "print_label_override"])
-        total += _merge_records(DrawerMerge, payload.get("drawer_merges", []), ["id", "cabinet_id", "row_start", "row_end", "col_start", "col_end"])
-        total += _merge_records(Item, payload.get("items", []), [
-            "id", "category_id", "subtype_id", "name", "description", "share_drawer",
-            "thread_standard", "thread_size", "inner_d_mm", "thickness_mm", "length_mm", "outer_d_mm",
-            "material_id", "finish_id", "quantity", "label_show_category", "label_show_subtype",
-            "label_show_thread", "label_show_measure", "label_show_main", "label_show_material", "updated_at"
-        ])
-        total += _merge_records(ItemCustomFieldValue, payload.get("item_custom_field_values", []), ["id", "item_id", "field_id", "value_text"])
-        total += _merge_records(Assignment, payload.get("assignments", []), ["id", "slot_id", "compartment_no", "item_id"])
-        db.session.commit()
-        flash(f"Import JSON completato: {total} record.", "success")
+    if format_name == "json":
+        try:
+            counts = restore_data(_iter_data_import(file_storage))
+            db.session.commit()
+        except ValueError as exc:
+            db.session.rollback()
+            flash(f"File JSON non valido: {exc}", "danger")
+            return redirect(url_for("admin_items"))
+        except IntegrityError as exc:
+            db.session.rollback()
+            flash(f"Import JSON annullato, dati in conflitto: {exc.orig}", "danger")
+            return redirect(url_for("admin_items"))
+        written = {name for name, c in counts.items() if c["inserted"] or c["updated"]}
+        if written & {"categories", "subtypes", "materials", "items"}:
+            rebuild_item_names()
+        detail = "; ".join(
+            f"{name}: {c['inserted']} nuovi, {c['updated']} aggiornati, {c['unchanged']} invariati"
+            for name, c in counts.items()
+        )
+        total = sum(c["inserted"] + c["updated"] for c in counts.values())
+        flash(f"Import JSON completato: {total} record scritti ({detail}).", "success")
         return redirect(url_for("admin_items"))
 
     flash("Formato import non supportato.", "danger")
@@ -2838,7 +4729,7 @@ def add_item():
         label_show_material=bool(f.get("label_show_material")),
         updated_at=datetime.utcnow(),
     )
-    item.name = auto_name_for(item)
+    refresh_item_names(item)
     db.session.add(item); db.session.flush()
     save_custom_field_values(item, f)
     cab_id  = f.get("cabinet_id"); row_num = f.get("row_num"); col_code = f.get("col_code")
@@ -2890,7 +4781,7 @@ def edit_item(item_id):
         item.label_show_main     = bool(f.get("label_show_main"))
         item.label_show_material = bool(f.get("label_show_material"))
         item.updated_at = datetime.utcnow()
-        item.name = auto_name_for(item)
+        refresh_item_names(item)
         save_custom_field_values(item, f)
         db.session.commit()
         flash("Articolo aggiornato", "success")
@@ -2993,71 +4884,288 @@ def _can_share_slot(existing_items: list[Item], new_item: Item) -> bool:
     return ok
 
 def _assign_position(item, cabinet_id:int, col_code:str, row_num:int, *, force_share: bool = False):
-    if not column_code_valid(col_code):         raise ValueError("Colonna non valida (A..Z o AA..ZZ).")
-    if not (1 <= int(row_num) <= 128):          raise ValueError("Riga non valida (1..128).")
-    anchor_slot, slots, assignments, slot_items = _collect_region_assignments(
-        cabinet_id, col_code, row_num, ignore_item_id=item.id
+    result = bulk_assign_positions([(item, cabinet_id, col_code, row_num)], force_share=force_share)[0]
+    if result["error"] is not None:
+        raise result["error"]
+
+def _load_cabinet_occupancy(cabinet: Cabinet) -> dict:
+    """
+    Carica una volta sola lo stato della cassettiera: slot, assegnamenti (con articoli) e fusioni.
+    Le funzioni _occupancy_* lavorano su questo dizionario senza ulteriori query.
+    """
+    slots = {(s.col_code, s.row_num): s for s in Slot.query.filter_by(cabinet_id=cabinet.id).all()}
+    rows = (
+        db.session.query(Assignment, Item)
+        .join(Item, Assignment.item_id == Item.id)
+        .join(Slot, Assignment.slot_id == Slot.id)
+        .filter(Slot.cabinet_id == cabinet.id)
+        .order_by(Assignment.id)
+        .all()
     )
-    if anchor_slot.is_blocked:                         raise RuntimeError("La cella è bloccata (non assegnabile).")
-    Assignment.query.filter_by(item_id=item.id).delete()
+    assigns_by_slot = {}
+    items = {}
+    for a, it in rows:
+        assigns_by_slot.setdefault(a.slot_id, []).append(a)
+        items[it.id] = it
+    return {
+        "cabinet": cabinet,
+        "merges": merge_region_index(cabinet.id),
+        "slots": slots,
+        "assigns": assigns_by_slot,
+        "items": items,
+    }
 
-    can_share, blockers = _share_slot_status(slot_items, item)
-    if not can_share:
-        if blockers and force_share:
-            for it in blockers:
-                it.share_drawer = True
-        elif blockers:
-            raise SharePermissionError(blockers)
-        else:
-            raise RuntimeError("Il cassetto contiene articoli che non supportano la condivisione.")
 
-    cab = db.session.get(Cabinet, int(cabinet_id))
-    max_comp = _max_compartments_for_slot(cab, anchor_slot.col_code, anchor_slot.row_num)
-    if len(assignments) >= max_comp:
-        raise RuntimeError("Nessuno scomparto libero nello slot scelto.")
+def _occupancy_region(occ: dict, col_code: str, row_num: int) -> dict:
+    """Stato della cella (o della regione fusa che la contiene) letto dall'occupazione in memoria."""
+    region = occ["merges"].get((colcode_to_idx(col_code), row_num))
+    if region:
+        anchor = (region["anchor_col"], region["anchor_row"])
+        cells = merge_cells_from_region(region)
+    else:
+        anchor = (col_code, row_num)
+        cells = [anchor]
+    assigns = []
+    for cell in cells:
+        slot = occ["slots"].get(cell)
+        if slot is not None:
+            assigns.extend(occ["assigns"].get(slot.id, []))
+    assigns.sort(key=lambda a: a.id)
+    anchor_slot = occ["slots"].get(anchor)
+    base = occ["cabinet"].compartments_per_slot or 6
+    return {
+        "anchor": anchor,
+        "cells": cells,
+        "anchor_slot": anchor_slot,
+        "blocked": bool(anchor_slot and anchor_slot.is_blocked),
+        "assigns": assigns,
+        "items": [occ["items"][a.item_id] for a in assigns if a.item_id in occ["items"]],
+        "capacity": max(1, int(base)) * max(1, len(cells)),
+    }
+
+
+def _occupancy_anchor_slot(occ: dict, anchor: tuple) -> Slot:
+    slot = occ["slots"].get(anchor)
+    if slot is None:
+        slot = Slot(cabinet_id=occ["cabinet"].id, col_code=anchor[0], row_num=anchor[1], is_blocked=False)
+        db.session.add(slot)
+        occ["slots"][anchor] = slot
+    return slot
+
+
+def _write_region_assignments(plans: list[tuple[dict, dict]]) -> int:
+    """
+    Scrive gli assegnamenti pianificati, una lista di (occupazione, {cella anchor: [Item, ...]}).
+    Gli assegnamenti esistenti di ogni regione vengono portati sullo slot anchor e
+    rinumerati; i nuovi ricevono i comparti successivi con un unico INSERT multiplo.
+    """
+    targets = []
+    for occ, plan in plans:
+        for anchor, new_items in plan.items():
+            targets.append((_occupancy_region(occ, *anchor), _occupancy_anchor_slot(occ, anchor), new_items))
+    db.session.flush()  # id per gli slot anchor appena creati
+
+    renumber = []
+    new_rows = []
+    for region, slot, new_items in targets:
+        existing = region["assigns"]
+        if len(existing) + len(new_items) > region["capacity"]:
+            raise RuntimeError(f"Capienza scomparti superata in {slot.col_code}{slot.row_num}.")
+        for n, a in enumerate(existing, start=1):
+            if a.slot_id != slot.id or a.compartment_no != n:
+                renumber.append((a, slot.id, n))
+        for n, it in enumerate(new_items, start=len(existing) + 1):
+            new_rows.append({"slot_id": slot.id, "compartment_no": n, "item_id": it.id})
+
+    if renumber:
+        # Due passaggi per non violare uq_compartment_in_slot durante la rinumerazione.
+        for a, _, n in renumber:
+            a.compartment_no = -n
+        db.session.flush()
+        for a, slot_id, n in renumber:
+            a.slot_id = slot_id
+            a.compartment_no = n
+        db.session.flush()
+    if new_rows:
+        db.session.execute(insert(Assignment), new_rows)
+    return len(new_rows)
+
+
+def bulk_assign_positions(placements, *, force_share: bool = False) -> list[dict]:
+    """
+    Posiziona in blocco una lista di (item, cabinet_id, col_code, row_num).
+    Validazione (cella, blocco, condivisione, capienza) in memoria sull'occupazione delle
+    cassettiere coinvolte, poi un'unica scrittura. Ritorna un esito per ogni posizionamento:
+    {"item": Item, "ok": bool, "position": str | None, "error": Exception | None}.
+    Il commit resta a carico del chiamante, come per _assign_position.
+    """
+    results = []
+    occupancies = {}
+    plans = {}        # cabinet_id -> {anchor: [Item, ...]}
+    moving = set()    # articoli validati: i loro assegnamenti precedenti verranno rimossi
+    seen = set()
+    for item, cabinet_id, col_code, row_num in placements:
+        result = {"item": item, "ok": False, "position": None, "error": None}
+        results.append(result)
+        try:
+            col_code = (col_code or "").strip().upper()
+            if not column_code_valid(col_code):         raise ValueError("Colonna non valida (A..Z o AA..ZZ).")
+            if not (1 <= int(row_num) <= 128):          raise ValueError("Riga non valida (1..128).")
+            row_num = int(row_num)
+            if item.id in seen:
+                raise ValueError("Articolo presente più volte nello stesso posizionamento.")
+            cabinet_id = int(cabinet_id)
+            occ = occupancies.get(cabinet_id)
+            if occ is None:
+                cab = db.session.get(Cabinet, cabinet_id)
+                if not cab:
+                    raise ValueError("Cassettiera inesistente.")
+                occ = occupancies[cabinet_id] = _load_cabinet_occupancy(cab)
+            region = _occupancy_region(occ, col_code, row_num)
+            if region["blocked"]:                       raise RuntimeError("La cella è bloccata (non assegnabile).")
+
+            planned = plans.setdefault(cabinet_id, {}).get(region["anchor"], [])
+            staying = [a for a in region["assigns"] if a.item_id != item.id and a.item_id not in moving]
+            slot_items = [occ["items"][a.item_id] for a in staying if a.item_id in occ["items"]] + planned
+            can_share, blockers = _share_slot_status(slot_items, item)
+            if not can_share:
+                if blockers and force_share:
+                    for it in blockers:
+                        it.share_drawer = True
+                elif blockers:
+                    raise SharePermissionError(blockers)
+                else:
+                    raise RuntimeError("Il cassetto contiene articoli che non supportano la condivisione.")
+            if len(staying) + len(planned) >= region["capacity"]:
+                raise RuntimeError("Nessuno scomparto libero nello slot scelto.")
+        except (ValueError, RuntimeError) as exc:
+            result["error"] = exc
+            continue
+
+        seen.add(item.id)
+        moving.add(item.id)
+        plans[cabinet_id].setdefault(region["anchor"], []).append(item)
+        result["ok"] = True
+        anchor_slot = region["anchor_slot"]
+        result["position"] = slot_full_label(
+            occ["cabinet"], anchor_slot, fallback_col=region["anchor"][0], fallback_row=region["anchor"][1]
+        )
+
+    if moving:
+        old_assigns = Assignment.query.filter(Assignment.item_id.in_(moving)).all()
+        for occ in occupancies.values():
+            for slot_id, assigns in occ["assigns"].items():
+                assigns[:] = [a for a in assigns if a.item_id not in moving]
+        for a in old_assigns:
+            db.session.delete(a)
+        db.session.flush()
+        _write_region_assignments([(occupancies[cab_id], plan) for cab_id, plan in plans.items() if plan])
+    return results
+
 
-    # Sposta tutti gli assignment della regione nello slot anchor e riassegna i comparti.
-    for a in assignments:
-        a.slot_id = anchor_slot.id
-    db.session.add(Assignment(slot_id=anchor_slot.id, compartment_no=0, item_id=item.id))
-    _reassign_compartments(anchor_slot.id, cab)
+SUGGEST_POSITION_LIMIT = 5
+
+
+def _suggest_positions(item: Item, *, limit: int = SUGGEST_POSITION_LIMIT,
+                       preferred_cabinet_id: int | None = None,
+                       preferred_location_id: int | None = None) -> list[dict]:
+    """
+    Cassetti già popolati compatibili con l'articolo (stessa misura/categoria, tutti condivisibili)
+    e con scomparti liberi, ordinati per preferenza. La compatibilità è valutata in SQL con
+    un'unica query aggregata; la capienza usa l'indice delle fusioni in cache.
+    """
+    # Con articoli già presenti serve che anche il nuovo accetti la condivisione (vedi _share_slot_status).
+    if not item.share_drawer:
+        return []
+    measure_new = _normalize_thread_size(item.thread_size)
+    norm_size = func.lower(func.trim(func.coalesce(Item.thread_size, "")))
+    assign_count = func.count(Assignment.id)
+    min_cat = func.min(Item.category_id)
+    max_cat = func.max(Item.category_id)
+    if item.category_id is None:
+        same_category = func.count(Item.category_id) == 0
+    else:
+        same_category = (min_cat == item.category_id) & (max_cat == item.category_id) & (func.count(Item.category_id) == assign_count)
+    same_measure = (func.min(norm_size) == measure_new) & (func.max(norm_size) == measure_new)
+    all_shared = func.min(case((Item.share_drawer.is_(True), 1), else_=0)) == 1
+    having = same_measure & all_shared
+    if not measure_new:
+        having = having & same_category
 
-def _suggest_position(item: Item):
     rows = (
         db.session.query(
-            Slot,
-            Cabinet,
-            func.count(Assignment.id).label("assign_count"),
-            func.min(Item.category_id).label("min_cat"),
-            func.max(Item.category_id).label("max_cat"),
+            Slot, Cabinet,
+            assign_count.label("assign_count"),
+            case((same_category, 1), else_=0).label("same_category"),
         )
         .join(Cabinet, Slot.cabinet_id == Cabinet.id)
-        .outerjoin(Assignment, Assignment.slot_id == Slot.id)
-        .outerjoin(Item, Assignment.item_id == Item.id)
+        .join(Assignment, Assignment.slot_id == Slot.id)
+        .join(Item, Assignment.item_id == Item.id)
+        .filter(Slot.is_blocked.is_(False), Item.id != item.id)
         .group_by(Slot.id, Cabinet.id)
-        .order_by(Cabinet.name, Slot.col_code, Slot.row_num)
+        .having(having)
         .all()
     )
-    for slot, cab, assign_count, min_cat, max_cat in rows:
-        if slot.is_blocked or assign_count == 0:
+
+    candidates = []
+    for slot, cab, count, category_match in rows:
+        region = merge_region_for(cab.id, slot.col_code, slot.row_num)
+        capacity = _max_compartments_for_slot(cab, slot.col_code, slot.row_num)
+        free = capacity - count
+        if free <= 0:
             continue
-        _, slot_items = _load_slot_assignments(slot.id)
-        if not _can_share_slot(slot_items, item):
+        col_code = region["anchor_col"] if region else slot.col_code
+        row_num = region["anchor_row"] if region else slot.row_num
+        rank = (
+            0 if preferred_cabinet_id and cab.id == preferred_cabinet_id else 1,
+            0 if preferred_location_id and cab.location_id == preferred_location_id else 1,
+            0 if category_match else 1,
+            cab.name or "",
+            colcode_to_idx(col_code),
+            row_num,
+        )
+        candidates.append((rank, {
+            "cabinet_id": cab.id,
+            "cabinet": cab.name,
+            "col_code": col_code,
+            "row_num": row_num,
+            "position": slot_full_label(cab, slot),
+            "free": free,
+        }))
+    candidates.sort(key=lambda c: c[0])
+    seen = set()
+    out = []
+    for _, cand in candidates:
+        key = (cand["cabinet_id"], cand["col_code"], cand["row_num"])
+        if key in seen:
             continue
-        max_comp = _max_compartments_for_slot(cab, slot.col_code, slot.row_num)
-        if assign_count < max_comp:
-            return cab.id, slot.col_code, slot.row_num
-    return None
+        seen.add(key)
+        out.append(cand)
+        if len(out) >= limit:
+            break
+    return out
 
 @app.route("/admin/items/<int:item_id>/suggest_position")
 @login_required
 def suggest_position(item_id):
     item = Item.query.get_or_404(item_id)
-    sug = _suggest_position(item)
-    if not sug:
+    limit = max(1, min(request.args.get("limit", type=int) or SUGGEST_POSITION_LIMIT, 50))
+    candidates = _suggest_positions(
+        item,
+        limit=limit,
+        preferred_cabinet_id=request.args.get("cabinet_id", type=int),
+        preferred_location_id=request.args.get("location_id", type=int),
+    )
+    if not candidates:
         return jsonify({"ok": False, "error": "Nessuna posizione compatibile trovata dove la categoria è già presente."})
-    cab_id, col_code, row_num = sug
-    return jsonify({"ok": True, "cabinet_id": cab_id, "col_code": col_code, "row_num": row_num})
+    best = candidates[0]
+    return jsonify({
+        "ok": True,
+        "cabinet_id": best["cabinet_id"],
+        "col_code": best["col_code"],
+        "row_num": best["row_num"],
+        "candidates": candidates,
+    })
 
 @app.route("/admin/items/<int:item_id>/set_position", methods=["POST"])
 @login_required
@@ -3075,7 +5183,7 @@ def set_position(item_id):
         flash("Posizione aggiornata.", "success")
     except SharePermissionError as e:
         db.session.rollback()
-        blocker_names = ", ".join(sorted({auto_name_for(it) for it in e.items}))
+        blocker_names = ", ".join(sorted({item_display_name(it) for it in e.items}))
         flash(f"Il cassetto contiene articoli che non supportano la condivisione: {blocker_names}.", "danger")
     except Exception as e:
         db.session.rollback(); flash(str(e), "danger")
@@ -3083,6 +5191,7 @@ def set_position(item_id):
 
 @app.route("/admin/items/<int:item_id>/set_position.json", methods=["POST"])
 @login_required
+@retry_on_busy
 def set_position_json(item_id):
     item = Item.query.get_or_404(item_id)
     cab_id  = request.form.get("cabinet_id")
@@ -3097,12 +5206,48 @@ def set_position_json(item_id):
         return jsonify({"ok": True})
     except SharePermissionError as e:
         db.session.rollback()
-        blockers = [{"id": it.id, "name": auto_name_for(it)} for it in e.items]
+        blockers = [{"id": it.id, "name": item_display_name(it)} for it in e.items]
         return jsonify({"ok": False, "error": str(e), "share_blockers": blockers}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({"ok": False, "error": str(e)}), 400
 
+@app.route("/admin/items/bulk_set_position.json", methods=["POST"])
+@login_required
+@retry_on_busy
+def bulk_set_position_json():
+    payload = request.get_json(silent=True) or {}
+    raw = payload.get("placements")
+    if not isinstance(raw, list) or not raw:
+        return jsonify({"ok": False, "error": "Nessun posizionamento indicato."}), 400
+    try:
+        parsed = [
+            (int(p["item_id"]), int(p["cabinet_id"]), str(p.get("col_code") or ""), int(p["row_num"]))
+            for p in raw
+        ]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Parametri non validi."}), 400
+    items = {it.id: it for it in Item.query.filter(Item.id.in_({p[0] for p in parsed})).all()}
+    results = [{"item_id": p[0], "ok": False, "error": "Articolo inesistente."} for p in parsed]
+    indexed = [(i, (items[p[0]],) + p[1:]) for i, p in enumerate(parsed) if p[0] in items]
+    try:
+        outcome = bulk_assign_positions([pl for _, pl in indexed], force_share=bool(payload.get("force_share")))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": str(e)}), 400
+    for (i, _), res in zip(indexed, outcome):
+        entry = {"item_id": res["item"].id, "ok": res["ok"]}
+        if res["ok"]:
+            entry["position"] = res["position"]
+        else:
+            entry["error"] = str(res["error"])
+            if isinstance(res["error"], SharePermissionError):
+                entry["share_blockers"] = [{"id": it.id, "name": item_display_name(it)} for it in res["error"].items]
+        results[i] = entry
+    assigned = sum(1 for r in results if r["ok"])
+    return jsonify({"ok": assigned == len(results), "assigned": assigned, "results": results})
+
 @app.route("/admin/items/<int:item_id>/clear_position", methods=["POST"])
 @login_required
 def clear_position(item_id):
@@ -3202,12 +5347,14 @@ def add_category():
     if len(name) < 2: return _flash_back("Nome categoria troppo corto.", "danger", "admin_config", "categorie")
     if Category.query.filter_by(name=name).first(): return _flash_back("Categoria già esistente.", "danger", "admin_config", "categorie")
     db.session.add(Category(name=name, color=color, main_measure_mode=mode)); db.session.commit()
+    reset_category_role_cache()
     flash("Categoria aggiunta.", "success"); return redirect(_admin_config_url("categorie"))
 
 @app.route("/admin/categories/<int:cat_id>/update", methods=["POST"])
 @login_required
 def update_category(cat_id):
     cat = Category.query.get_or_404(cat_id)
+    old_name = cat.name
     new_name = request.form.get("name","").strip()
     new_color = request.form.get("color","#000000").strip()
     new_mode = request.form.get("main_measure_mode","").strip().lower()
@@ -3218,8 +5365,12 @@ def update_category(cat_id):
             return _flash_back("Esiste già una categoria con questo nome.", "danger", "admin_config", "categorie")
         cat.name = new_name
     cat.color = new_color or cat.color
+    renamed = cat.name != old_name
     cat.main_measure_mode = new_mode
     db.session.commit()
+    reset_category_role_cache()
+    if renamed:
+        rebuild_item_names(Item.category_id == cat.id)
     flash("Categoria aggiornata.", "success"); return redirect(_admin_config_url("categorie"))
 
 @app.route("/admin/categories/<int:cat_id>/delete", methods=["POST"])
@@ -3230,7 +5381,14 @@ def delete_category(cat_id):
     if used:
         flash("Impossibile eliminare: ci sono articoli associati.", "danger")
     else:
-        db.session.delete(cat); db.session.commit(); flash("Categoria eliminata.", "success")
+        db.session.delete(cat); db.session.commit(); reset_category_role_cache(); flash("Categoria eliminata.", "success")
+    return redirect(_admin_config_url("categorie"))
+
+@app.route("/admin/categories/rebuild_names", methods=["POST"])
+@login_required
+def rebuild_names():
+    changed = rebuild_item_names()
+    flash(f"Nomi articoli ricalcolati: {changed} aggiornati.", "success")
     return redirect(_admin_config_url("categorie"))
 
 def _flash_back(msg, kind, endpoint, anchor=None):
@@ -3289,9 +5447,12 @@ def update_subtype(st_id):
     if clash:
         return _flash_back("Esiste già un sottotipo con questo nome per la categoria selezionata.", "danger", "admin_config", "sottotipi")
 
+    renamed = st.name != name
     st.name = name
     st.category_id = category_id
     db.session.commit()
+    if renamed:
+        rebuild_item_names(Item.subtype_id == st.id)
     flash("Sottotipo aggiornato.", "success")
     return redirect(_admin_config_url("sottotipi"))
 
@@ -3334,8 +5495,11 @@ def update_material(mat_id):
     if Material.query.filter(Material.id != mat.id, Material.name == name).first():
         return _flash_back("Esiste già un materiale con questo nome.", "danger", "admin_config", "materiali")
 
+    renamed = mat.name != name
     mat.name = name
     db.session.commit()
+    if renamed:
+        rebuild_item_names(Item.material_id == mat.id)
     flash("Materiale aggiornato.", "success")
     return redirect(_admin_config_url("materiali"))
 
@@ -3502,6 +5666,7 @@ def update_user_role(user_id):
             return _flash_back("Deve esistere almeno un amministratore.", "danger", "admin_config", "utenti")
     user.role = role
     db.session.commit()
+    reset_permission_cache()
     flash("Ruolo utente aggiornato.", "success")
     return redirect(_admin_config_url("utenti"))
 
@@ -3517,6 +5682,7 @@ def add_role():
     role = Role(name=name, description=description, is_system=False)
     db.session.add(role)
     db.session.commit()
+    reset_permission_cache()
     flash("Ruolo creato.", "success")
     return redirect(_admin_config_url("ruoli"))
 
@@ -3545,6 +5711,7 @@ def update_role(role_id):
     permissions = Permission.query.filter(Permission.key.in_(permission_keys)).all() if permission_keys else []
     role.permissions = permissions
     db.session.commit()
+    reset_permission_cache()
     flash("Ruolo aggiornato.", "success")
     return redirect(_admin_config_url("ruoli"))
 
@@ -3558,6 +5725,7 @@ def delete_role(role_id):
         return _flash_back("Impossibile eliminare: ci sono utenti associati.", "danger", "admin_config", "ruoli")
     db.session.delete(role)
     db.session.commit()
+    reset_permission_cache()
     flash("Ruolo eliminato.", "success")
     return redirect(_admin_config_url("ruoli"))
 
@@ -3575,6 +5743,7 @@ def add_permission():
         return _flash_back("Esiste già un permesso con questa chiave.", "danger", "admin_config", "permessi")
     db.session.add(Permission(key=key, label=label, description=description, is_system=False))
     db.session.commit()
+    reset_permission_cache()
     flash("Permesso creato.", "success")
     return redirect(_admin_config_url("permessi"))
 
@@ -3707,6 +5876,7 @@ def update_settings():
         url = request.form.get("qr_base_url","").strip()
         s.qr_base_url = url or None
         db.session.commit()
+        invalidate_settings_cache("settings")
         flash("Impostazioni aggiornate.", "success")
     except Exception as e:
         db.session.rollback(); flash(f"Errore salvataggio: {e}", "danger")
@@ -3749,6 +5919,7 @@ def update_mqtt_settings():
         s.include_item_finish = bool(request.form.get("include_item_finish"))
         s.include_empty = bool(request.form.get("include_empty"))
         db.session.commit()
+        invalidate_settings_cache("mqtt_settings")
         flash("Configurazione MQTT aggiornata.", "success")
     except Exception as e:
         db.session.rollback()
@@ -3869,6 +6040,7 @@ def add_drawer_merge():
         col_end=col_end,
     ))
     db.session.commit()
+    reset_merge_region_cache(cab.id)
     flash("Fusione cassetti aggiunta.", "success")
     return redirect(url_for("admin_config"))
 
@@ -3876,8 +6048,10 @@ def add_drawer_merge():
 @login_required
 def delete_drawer_merge(merge_id):
     merge = DrawerMerge.query.get_or_404(merge_id)
+    cab_id = merge.cabinet_id
     db.session.delete(merge)
     db.session.commit()
+    reset_merge_region_cache(cab_id)
     flash("Fusione cassetti eliminata.", "success")
     return redirect(url_for("admin_config"))
 
@@ -4029,10 +6203,10 @@ def move_slot():
 def api_unplaced():
     cat_id = request.args.get("category_id", type=int)
     subq = select(Assignment.item_id)
-    q = Item.query.filter(Item.id.not_in(subq))
+    q = Item.query.options(*item_eager_options()).filter(Item.id.not_in(subq))
     if cat_id: q = q.filter(Item.category_id == cat_id)
     items = q.order_by(Item.category_id, Item.id).all()
-    return jsonify([{"id":it.id,"caption":auto_name_for(it),"category_id":it.category_id} for it in items])
+    return jsonify([{"id":it.id,"caption":item_display_name(it),"category_id":it.category_id} for it in items])
 
 @app.route("/admin/grid_assign", methods=["POST"])
 @login_required
@@ -4052,7 +6226,7 @@ def grid_assign():
         db.session.commit()
     except SharePermissionError as e:
         db.session.rollback()
-        blockers = [{"id": it.id, "name": auto_name_for(it)} for it in e.items]
+        blockers = [{"id": it.id, "name": item_display_name(it)} for it in e.items]
         return jsonify({"ok":False, "error":str(e), "share_blockers": blockers}), 409
     except Exception as e:
         db.session.rollback()
@@ -4099,6 +6273,7 @@ def slot_items():
         .join(Category, Item.category_id == Category.id, isouter=True)
         .join(Slot, Assignment.slot_id == Slot.id)
         .filter(Assignment.slot_id.in_(slot_ids))
+        .options(*item_eager_options())
         .order_by(Slot.col_code, Slot.row_num, Assignment.compartment_no)
         .all()
     )
@@ -4107,7 +6282,7 @@ def slot_items():
     for a, it, cat, slot in assigns:
         items.append({
             "id": it.id,
-            "name": auto_name_for(it),
+            "name": item_display_name(it),
             "quantity": it.quantity,
             "category": cat.name if cat else None,
             "color": cat.color if cat else "#999999",
@@ -4179,7 +6354,7 @@ def mqtt_publish_slot():
     cabinet = Cabinet.query.get(cab_id)
     if not cabinet:
         return jsonify({"ok": False, "error": "Cassettiera non trovata."}), 404
-    settings = get_mqtt_settings()
+    settings = mqtt_settings_snapshot()
     mqtt_payload = mqtt_payload_for_slot(cabinet, col_code, row_num, settings)
     if mqtt_payload is None:
         return jsonify({"ok": False, "skipped": True, "error": "Nessun contenuto da pubblicare."}), 200
@@ -4192,6 +6367,46 @@ def mqtt_publish_slot():
 
 # ===================== KATODO.COM — PRESTASHOP INTEGRATION =====================
 
+def katodo_product_hash(fields: dict) -> str:
+    """Impronta dei campi importati (synced_at escluso): stessa impronta = prodotto invariato."""
+    payload = {key: value for key, value in fields.items() if key != "synced_at"}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=_json_default).encode("utf-8")).hexdigest()
+
+
+def upsert_katodo_products(products: dict[int, dict]) -> tuple[int, int, int]:
+    """
+    Scrive una pagina di prodotti (ps_id -> campi) con un solo INSERT ... ON CONFLICT(ps_id) DO UPDATE
+    in executemany. I prodotti con impronta invariata non vengono inviati a SQLite: nessuna scrittura
+    e nessuna crescita del WAL. Ritorna (nuovi, aggiornati, invariati); il commit resta al chiamante.
+    """
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+    if not products:
+        return 0, 0, 0
+    stored = dict(db.session.execute(
+        select(KatodoProduct.ps_id, KatodoProduct.content_hash).where(KatodoProduct.ps_id.in_(list(products)))
+    ).all())
+    rows = []
+    created = 0
+    for ps_id, fields in products.items():
+        content_hash = katodo_product_hash(fields)
+        if ps_id in stored and stored[ps_id] == content_hash:
+            continue
+        created += ps_id not in stored
+        rows.append({"ps_id": ps_id, **fields, "content_hash": content_hash})
+    if rows:
+        table = KatodoProduct.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.ps_id],
+            set_={key: stmt.excluded[key] for key in rows[0] if key != "ps_id"},
+            # anche a livello SQL: una riga identica non viene riscritta
+            where=table.c.content_hash.is_distinct_from(stmt.excluded.content_hash),
+        )
+        db.session.execute(stmt, rows)
+    return created, len(rows) - created, len(products) - len(rows)
+
+
 @app.route("/admin/katodo/settings", methods=["GET", "POST"])
 @login_required
 def katodo_settings():
@@ -4207,18 +6422,26 @@ def katodo_settings():
                 key = (request.form.get("api_key") or "").strip()
                 if key:
                     s.api_key = key
+            page_size = int(request.form.get("import_page_size") or KATODO_PAGE_SIZE_DEFAULT)
+            s.import_page_size = min(max(page_size, 1), KATODO_PAGE_SIZE_MAX)
+            concurrency = int(request.form.get("import_concurrency") or KATODO_CONCURRENCY_DEFAULT)
+            s.import_concurrency = min(max(concurrency, 1), KATODO_CONCURRENCY_MAX)
             db.session.commit()
+            invalidate_settings_cache("katodo_settings")
             flash("Configurazione Katodo salvata.", "success")
         except Exception as e:
             db.session.rollback()
             flash(f"Errore salvataggio: {e}", "danger")
         return redirect(url_for("katodo_settings"))
-    return render_template("admin/katodo_settings.html", s=s)
+    return render_template(
+        "admin/katodo_settings.html", s=s,
+        page_size_max=KATODO_PAGE_SIZE_MAX, concurrency_max=KATODO_CONCURRENCY_MAX,
+    )
 
 @app.route("/admin/katodo/test", methods=["POST"])
 @login_required
 def katodo_test():
-    s = get_katodo_settings()
+    s = katodo_settings_snapshot()
     result = prestashop_api_request("", s, timeout=8)
     if result["ok"]:
         data = result["data"] or []
@@ -4229,7 +6452,7 @@ def katodo_test():
 @app.route("/admin/katodo/field_discovery")
 @login_required
 def katodo_field_discovery():
-    s = get_katodo_settings()
+    s = katodo_settings_snapshot()
     schema_result = prestashop_api_request("products", s, params={"schema": "full"})
     example_result = None
     example_id = None
@@ -4287,71 +6510,173 @@ def katodo_field_discovery():
 @app.route("/admin/katodo/products")
 @login_required
 def katodo_products():
-    s = get_katodo_settings()
+    s = katodo_settings_snapshot()
     products = KatodoProduct.query.order_by(KatodoProduct.reference).all()
-    last_sync = db.session.query(db.func.max(KatodoProduct.synced_at)).scalar()
+    last_sync = s.last_sync_at or db.session.query(db.func.max(KatodoProduct.synced_at)).scalar()
     return render_template("admin/katodo_products.html", s=s, products=products,
-                           last_sync=last_sync, ps_image_url=ps_image_url)
+                           last_sync=last_sync, running_job=katodo_running_job())
 
-@app.route("/admin/katodo/import", methods=["POST"])
-@login_required
-def katodo_import():
-    s = get_katodo_settings()
+def _katodo_float(val):
+    try:
+        return float(val) if val not in (None, "", "0.000000") else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _katodo_datetime(raw) -> datetime | None:
+    raw = str(raw or "")
+    # PrestaShop usa "0000-00-00 00:00:00" per le date assenti
+    if not raw or not raw.replace("0", "").replace("-", "").replace(" ", "").replace(":", ""):
+        return None
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _katodo_product_fields(p: dict, category_cache: dict, now: datetime) -> dict:
+    ps_image_id = None
+    try:
+        v = int(p.get("id_default_image") or 0)
+        if v > 0:
+            ps_image_id = v
+    except (TypeError, ValueError):
+        pass
+    return dict(
+        reference          = p.get("reference") or None,
+        supplier_reference = p.get("supplier_reference") or None,
+        name               = p.get("name") or None,
+        description_short  = p.get("description_short") or None,
+        description        = p.get("description") or None,
+        manufacturer_name  = p.get("manufacturer_name") or None,
+        category_name      = category_cache.get(str(p.get("id_category_default", ""))),
+        price              = _katodo_float(p.get("price")),
+        wholesale_price    = _katodo_float(p.get("wholesale_price")),
+        weight             = _katodo_float(p.get("weight")),
+        active             = str(p.get("active")) == "1",
+        quantity           = int(p.get("quantity") or 0),
+        ps_image_id        = ps_image_id,
+        ps_date_add        = _katodo_datetime(p.get("date_add")),
+        ps_date_upd        = _katodo_datetime(p.get("date_upd")),
+        synced_at          = now,
+    )
 
-    def _sse(data: dict) -> str:
-        import json as _json
-        return f"data: {_json.dumps(data)}\n\n"
 
-    def _flt(val):
+# ---- job di import in background ----
+# L'import gira in un thread del processo, non dentro la richiesta HTTP: ogni pagina viene
+# salvata insieme al checkpoint (offset e contatori) nella stessa transazione. Il job aggiorna
+# heartbeat_at; se il processo muore il job resta "running" con heartbeat vecchio e il primo
+# che lo trova (pagina prodotti, avvio import, stream di avanzamento) lo riprende dall'ultimo
+# checkpoint. L'endpoint SSE si limita a leggere la riga del job.
+KATODO_PRODUCT_DISPLAY = "[id,reference,supplier_reference,manufacturer_name,id_category_default,price,wholesale_price,weight,active,date_add,date_upd,id_default_image,name,description_short,description,quantity]"
+KATODO_JOB_HEARTBEAT = 15        # secondi
+KATODO_JOB_STALE_AFTER = 90      # secondi senza heartbeat prima di considerare il job orfano
+
+
+class KatodoJobLost(Exception):
+    """Il job è stato preso in carico da un altro processo."""
+
+
+def _katodo_job_owner() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _katodo_job_checkpoint(job_id: int, owner: str, **values) -> None:
+    """Aggiorna il job (e fa commit di quanto scritto finora) solo se è ancora nostro."""
+    values["heartbeat_at"] = datetime.utcnow()
+    result = db.session.execute(
+        update(KatodoImportJob)
+        .where(KatodoImportJob.id == job_id, KatodoImportJob.owner == owner)
+        .values(**values)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        raise KatodoJobLost(job_id)
+    db.session.commit()
+
+
+def _katodo_wait(future, job_id: int, owner: str):
+    """Attende una risposta tenendo vivo l'heartbeat anche con server lenti e retry."""
+    from concurrent.futures import TimeoutError as FutureTimeout
+    while True:
         try:
-            return float(val) if val not in (None, "", "0.000000") else None
-        except (ValueError, TypeError):
-            return None
+            return future.result(timeout=KATODO_JOB_HEARTBEAT)
+        except FutureTimeout:
+            _katodo_job_checkpoint(job_id, owner)
 
-    def generate():
-        import json as _json
 
-        if not s.enabled or not s.api_key:
-            yield _sse({"done": True, "error": "Integrazione non configurata."})
-            return
+def _katodo_call(job_id: int, owner: str, resource: str, s, **kwargs) -> dict:
+    """Chiamata singola (categorie, elenco id) su un thread a parte, con heartbeat durante l'attesa."""
+    from concurrent.futures import ThreadPoolExecutor
 
-        # ---- categorie ----
-        app.logger.info("[Katodo import] Caricamento categorie...")
-        yield _sse({"step": "Caricamento categorie…", "progress": 2, "done": False})
-        cats_result = prestashop_api_request("categories", s,
-                                             params={"display": "[id,name]", "language": "1"},
-                                             timeout=60)
-        if not cats_result["ok"]:
-            msg = f"Errore categorie: {cats_result['error']}"
-            app.logger.error(f"[Katodo import] {msg}")
-            yield _sse({"done": True, "error": msg})
-            return
-        category_cache = {str(c["id"]): c.get("name", "")
-                          for c in cats_result["data"].get("categories", cats_result["data"])}
-        app.logger.info(f"[Katodo import] {len(category_cache)} categorie caricate.")
-        yield _sse({"step": f"{len(category_cache)} categorie caricate.", "progress": 5, "done": False})
-
-        # ---- paginazione prodotti ----
-        display_fields = "[id,reference,supplier_reference,manufacturer_name,id_category_default,price,wholesale_price,weight,active,date_add,date_upd,id_default_image,name,description_short,description,quantity]"
-        page_size = 25      # piccolo per server lenti — aggiorna UI ogni 25 prodotti
-        offset = 0
-        total_new = 0
-        total_upd = 0
-        now = datetime.now(timezone.utc).replace(tzinfo=None)
-
-        while True:
-            limit = f"{page_size},{offset}" if offset else str(page_size)
-            app.logger.info(f"[Katodo import] Richiesta prodotti offset={offset} limit={page_size}…")
-            yield _sse({"step": f"Recupero prodotti {offset + 1}–{offset + page_size}…",
-                        "progress": min(10 + offset // 6, 90), "done": False})
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="katodo-fetch")
+    try:
+        return _katodo_wait(pool.submit(prestashop_api_request, resource, s, **kwargs), job_id, owner)
+    finally:
+        pool.shutdown(wait=False)
+
+
+def run_katodo_import_job(job_id: int, owner: str) -> None:
+    """Esegue (o riprende dal checkpoint) il job di import indicato."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    s = katodo_settings_snapshot()
+    job = db.session.get(KatodoImportJob, job_id)
+    delta_since = job.delta_since
+    offset = job.next_offset
+    totals = {"total_new": job.total_new, "total_updated": job.total_updated, "total_unchanged": job.total_unchanged}
+    watermark = job.watermark
+    db.session.commit()
+
+    def fail(msg: str) -> None:
+        app.logger.error(f"[Katodo import] {msg}")
+        _katodo_job_checkpoint(job_id, owner, status="error", error=msg, step=msg, finished_at=datetime.utcnow())
 
-            result = prestashop_api_request("products", s,
-                                            params={"display": display_fields, "language": "1", "limit": limit},
-                                            timeout=120)
+    if not s.enabled or not s.api_key:
+        fail("Integrazione non configurata.")
+        return
+    if offset:
+        app.logger.info(f"[Katodo import] Job {job_id} ripreso da offset {offset}")
+
+    # ---- categorie ----
+    app.logger.info("[Katodo import] Caricamento categorie...")
+    _katodo_job_checkpoint(job_id, owner, step="Caricamento categorie…", progress=max(job.progress or 0, 2))
+    cats_result = _katodo_call(job_id, owner, "categories", s,
+                               params={"display": "[id,name]", "language": "1"}, timeout=60)
+    if not cats_result["ok"]:
+        fail(f"Errore categorie: {cats_result['error']}")
+        return
+    category_cache = {str(c["id"]): c.get("name", "")
+                      for c in cats_result["data"].get("categories", cats_result["data"])}
+    app.logger.info(f"[Katodo import] {len(category_cache)} categorie caricate.")
+
+    # ---- paginazione prodotti ----
+    page_size = s.import_page_size or KATODO_PAGE_SIZE_DEFAULT
+    concurrency = s.import_concurrency or KATODO_CONCURRENCY_DEFAULT
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    page_params = {"display": KATODO_PRODUCT_DISPLAY, "language": "1"}
+    if delta_since:
+        # ">" stretto sul secondo precedente: include i prodotti modificati nello stesso secondo del watermark
+        since = delta_since - timedelta(seconds=1)
+        page_params.update({"filter[date_upd]": f">[{since:%Y-%m-%d %H:%M:%S}]", "date": "1"})
+        app.logger.info(f"[Katodo import] Sync incrementale da date_upd {delta_since}")
+
+    def fetch_page(page_offset):
+        # eseguita nei thread del pool: solo HTTP, nessun accesso al DB
+        limit = f"{page_size},{page_offset}" if page_offset else str(page_size)
+        return prestashop_api_request("products", s, params={**page_params, "limit": limit}, timeout=120)
+
+    # Fino a `concurrency` pagine in volo; le risposte si consumano in ordine su questo
+    # thread, che resta l'unico a scrivere nel DB.
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="katodo-fetch")
+    pending = [pool.submit(fetch_page, offset + n * page_size) for n in range(concurrency)]
+    next_offset = offset + concurrency * page_size
+    try:
+        while pending:
+            app.logger.info(f"[Katodo import] Richiesta prodotti offset={offset} limit={page_size}…")
+            result = _katodo_wait(pending.pop(0), job_id, owner)
             if not result["ok"]:
-                msg = f"Errore prodotti (offset {offset}): {result['error']}"
-                app.logger.error(f"[Katodo import] {msg}")
-                yield _sse({"done": True, "error": msg})
+                fail(f"Errore prodotti (offset {offset}): {result['error']}")
                 return
 
             page_prods = result["data"].get("products", result["data"]) if isinstance(result["data"], dict) else result["data"]
@@ -4359,82 +6684,254 @@ def katodo_import():
                 app.logger.info("[Katodo import] Nessun altro prodotto — fine paginazione.")
                 break
 
+            page_rows = {}
             for p in page_prods:
                 ps_id = int(p.get("id", 0) or 0)
                 if not ps_id:
                     continue
-
-                date_add = date_upd = None
-                try:
-                    raw_add = str(p.get("date_add") or "")
-                    if raw_add and raw_add.replace("0","").replace("-","").replace(" ","").replace(":",""):
-                        date_add = datetime.strptime(raw_add, "%Y-%m-%d %H:%M:%S")
-                    raw_upd = str(p.get("date_upd") or "")
-                    if raw_upd and raw_upd.replace("0","").replace("-","").replace(" ","").replace(":",""):
-                        date_upd = datetime.strptime(raw_upd, "%Y-%m-%d %H:%M:%S")
-                except (ValueError, TypeError):
-                    pass
-
-                ps_image_id = None
-                try:
-                    v = int(p.get("id_default_image") or 0)
-                    if v > 0:
-                        ps_image_id = v
-                except (TypeError, ValueError):
-                    pass
-
-                fields = dict(
-                    reference          = p.get("reference") or None,
-                    supplier_reference = p.get("supplier_reference") or None,
-                    name               = p.get("name") or None,
-                    description_short  = p.get("description_short") or None,
-                    description        = p.get("description") or None,
-                    manufacturer_name  = p.get("manufacturer_name") or None,
-                    category_name      = category_cache.get(str(p.get("id_category_default", ""))),
-                    price              = _flt(p.get("price")),
-                    wholesale_price    = _flt(p.get("wholesale_price")),
-                    weight             = _flt(p.get("weight")),
-                    active             = str(p.get("active")) == "1",
-                    quantity           = int(p.get("quantity") or 0),
-                    ps_image_id        = ps_image_id,
-                    ps_date_add        = date_add,
-                    ps_date_upd        = date_upd,
-                    synced_at          = now,
-                )
-                existing = KatodoProduct.query.filter_by(ps_id=ps_id).first()
-                if existing:
-                    for k, v in fields.items():
-                        setattr(existing, k, v)
-                    total_upd += 1
-                else:
-                    db.session.add(KatodoProduct(ps_id=ps_id, **fields))
-                    total_new += 1
-
-            db.session.commit()
-            processed = offset + len(page_prods)
-            app.logger.info(f"[Katodo import] Salvati {processed} prodotti (nuovi={total_new} aggiornati={total_upd}).")
-            yield _sse({"step": f"Salvati {processed} prodotti (nuovi: {total_new}, agg.: {total_upd})",
-                        "progress": min(10 + processed // 6, 90), "done": False,
-                        "count": processed})
+                fields = _katodo_product_fields(p, category_cache, now)
+                if fields["ps_date_upd"] and (watermark is None or fields["ps_date_upd"] > watermark):
+                    watermark = fields["ps_date_upd"]
+                page_rows[ps_id] = fields
+
+            created, updated, unchanged = upsert_katodo_products(page_rows)
+            totals["total_new"] += created
+            totals["total_updated"] += updated
+            totals["total_unchanged"] += unchanged
             offset += len(page_prods)
+            app.logger.info(f"[Katodo import] Salvati {offset} prodotti (nuovi={totals['total_new']} aggiornati={totals['total_updated']} invariati={totals['total_unchanged']}).")
+            # pagina e checkpoint nella stessa transazione: una ripresa non salta né ripete pagine
+            _katodo_job_checkpoint(
+                job_id, owner, next_offset=offset, watermark=watermark, progress=min(10 + offset // 6, 90),
+                step=f"Salvati {offset} prodotti (nuovi: {totals['total_new']}, agg.: {totals['total_updated']}, invariati: {totals['total_unchanged']})",
+                **totals,
+            )
             if len(page_prods) < page_size:
                 break
+            pending.append(pool.submit(fetch_page, next_offset))
+            next_offset += page_size
+    finally:
+        # pagine oltre la fine o dopo un errore: non servono più
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+    # ---- prodotti rimossi dal negozio (elenco dei soli id, vale anche per un job ripreso) ----
+    _katodo_job_checkpoint(job_id, owner, step="Verifica prodotti rimossi…", progress=92)
+    ids_result = _katodo_call(job_id, owner, "products", s, params={"display": "[id]"}, timeout=120)
+    if not ids_result["ok"]:
+        fail(f"Errore elenco id prodotti: {ids_result['error']}")
+        return
+    id_rows = ids_result["data"].get("products", []) if isinstance(ids_result["data"], dict) else ids_result["data"]
+    remote_ids = {int(row["id"]) for row in id_rows if row.get("id")}
+    local_ids = set(db.session.execute(select(KatodoProduct.ps_id)).scalars())
+    removed = sorted(local_ids - remote_ids)
+    for start in range(0, len(removed), 500):
+        KatodoProduct.query.filter(KatodoProduct.ps_id.in_(removed[start:start + 500])).delete(synchronize_session=False)
+    _katodo_job_checkpoint(job_id, owner, step="Download immagini…", progress=94)
+
+    # ---- miniature nella cache locale (solo quelle mancanti) ----
+    image_ids = db.session.execute(
+        select(KatodoProduct.ps_image_id).where(KatodoProduct.ps_image_id.isnot(None))
+    ).scalars().all()
+    db.session.rollback()  # nessun lock tenuto durante i download
+    images_new, images_failed = cache_katodo_images(
+        s.api_url, image_ids, "thumb",
+        progress=lambda done, total: _katodo_job_checkpoint(job_id, owner, step=f"Download immagini {done}/{total}…"),
+    )
+    app.logger.info(f"[Katodo import] Immagini scaricate={images_new} non disponibili={images_failed}")
+
+    # watermark salvato solo a sync completato: un errore a metà fa ripartire dal precedente
+    settings_row = get_katodo_settings()
+    settings_row.sync_watermark = watermark
+    settings_row.last_sync_at = now
+    _katodo_job_checkpoint(
+        job_id, owner, status="done", total_deleted=len(removed), progress=100,
+        step="Importazione completata!", finished_at=datetime.utcnow(),
+    )
+    invalidate_settings_cache("katodo_settings")
+    app.logger.info(f"[Katodo import] Completato — nuovi={totals['total_new']} aggiornati={totals['total_updated']} invariati={totals['total_unchanged']} rimossi={len(removed)}")
+
+
+def _katodo_job_thread(job_id: int) -> None:
+    owner = _katodo_job_owner()
+    with app.app_context():
+        # fuori da una richiesta: le transazioni del job scrivono, quindi BEGIN IMMEDIATE
+        g.sqlite_write_transaction = True
+        try:
+            # presa in carico atomica: solo un thread (di qualunque processo) esegue il job
+            claimed = db.session.execute(
+                update(KatodoImportJob)
+                .where(KatodoImportJob.id == job_id, KatodoImportJob.status == "running",
+                       or_(KatodoImportJob.owner.is_(None),
+                           KatodoImportJob.heartbeat_at < datetime.utcnow() - timedelta(seconds=KATODO_JOB_STALE_AFTER)))
+                .values(owner=owner, heartbeat_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                run_katodo_import_job(job_id, owner)
+        except KatodoJobLost:
+            app.logger.warning(f"[Katodo import] Job {job_id} preso in carico da un altro processo")
+        except Exception as exc:
+            db.session.rollback()
+            app.logger.exception(f"[Katodo import] Job {job_id} interrotto")
+            try:
+                _katodo_job_checkpoint(job_id, owner, status="error", error=str(exc)[:500],
+                                       step="Importazione interrotta.", finished_at=datetime.utcnow())
+            except KatodoJobLost:
+                pass
+        finally:
+            db.session.remove()
+
+
+def _spawn_katodo_job(job_id: int) -> None:
+    threading.Thread(target=_katodo_job_thread, args=(job_id,), name=f"katodo-import-{job_id}", daemon=True).start()
+
+
+def katodo_running_job() -> Optional[KatodoImportJob]:
+    """Job in corso, se c'è; un job orfano (processo terminato) viene ripreso qui."""
+    job = (KatodoImportJob.query.filter_by(status="running")
+           .order_by(KatodoImportJob.id.desc()).first())
+    if job and (job.owner is None or job.heartbeat_at < datetime.utcnow() - timedelta(seconds=KATODO_JOB_STALE_AFTER)):
+        app.logger.info(f"[Katodo import] Ripresa del job {job.id} da offset {job.next_offset}")
+        _spawn_katodo_job(job.id)
+    return job
+
+
+def start_katodo_import(delta: bool) -> KatodoImportJob:
+    """Avvia un nuovo job, oppure restituisce quello già in corso (una sola importazione alla volta)."""
+    job = katodo_running_job()
+    if job:
+        return job
+    s = katodo_settings_snapshot()
+    job = KatodoImportJob(
+        mode="delta" if delta else "full",
+        delta_since=s.sync_watermark if delta else None,
+        watermark=s.sync_watermark,
+        step="Avvio importazione…",
+        progress=1,
+    )
+    db.session.add(job)
+    db.session.commit()
+    _spawn_katodo_job(job.id)
+    return job
+
 
-        app.logger.info(f"[Katodo import] Completato — nuovi={total_new} aggiornati={total_upd} totale={total_new+total_upd}")
-        yield _sse({"done": True, "new": total_new, "updated": total_upd,
-                    "total": total_new + total_upd, "progress": 100,
-                    "step": "Importazione completata!"})
+def _katodo_job_event(job: KatodoImportJob) -> dict:
+    event = {
+        "job": job.id, "step": job.step, "progress": job.progress or 0, "done": job.status != "running",
+        "delta": job.mode == "delta",
+    }
+    if job.status == "error":
+        event["error"] = job.error or "Importazione non riuscita."
+    elif job.status == "done":
+        event.update(new=job.total_new, updated=job.total_updated, unchanged=job.total_unchanged,
+                     deleted=job.total_deleted, total=job.total_new + job.total_updated + job.total_unchanged)
+    return event
+
+
+def _katodo_progress_stream(job_id: int):
+    last = None
+    while True:
+        job = db.session.get(KatodoImportJob, job_id)
+        if job is None:
+            yield f"data: {json.dumps({'done': True, 'error': 'Job non trovato.'})}\n\n"
+            return
+        if job.status == "running":
+            katodo_running_job()  # riprende il job se il processo che lo eseguiva è morto
+        event = _katodo_job_event(job)
+        db.session.rollback()  # niente snapshot di lettura aperto tra un controllo e l'altro
+        if event != last:
+            yield f"data: {json.dumps(event)}\n\n"
+            last = event
+        elif not event["done"]:
+            yield ": keep-alive\n\n"
+        if event["done"]:
+            return
+        time.sleep(1)
+
+
+@app.route("/admin/katodo/import", methods=["POST"])
+@login_required
+def katodo_import():
+    s = katodo_settings_snapshot()
+    # delta: solo i prodotti con date_upd successivo all'ultimo sync riuscito (serve un watermark)
+    job = start_katodo_import(delta=request.values.get("mode") == "delta" and s.sync_watermark is not None)
+    return jsonify({"ok": True, "job": job.id, "progress_url": url_for("katodo_import_progress", job=job.id)})
 
+
+@app.route("/admin/katodo/import/progress")
+@login_required
+def katodo_import_progress():
+    """Stream SSE dell'avanzamento: ci si può ricollegare in qualunque momento, anche da un'altra sessione."""
+    job_id = request.args.get("job", type=int)
+    if job_id is None:
+        job = KatodoImportJob.query.order_by(KatodoImportJob.id.desc()).first()
+        if job is None:
+            abort(404)
+        job_id = job.id
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(_katodo_progress_stream(job_id)),
         content_type="text/event-stream",
         headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
     )
 
+@app.route("/admin/katodo/images/<size>/<int:image_id>.jpg")
+@login_required
+def katodo_image(size, image_id):
+    """Miniatura dalla cache locale (scaricata al volo se manca), con cache del browser ed ETag."""
+    if size not in KATODO_IMAGE_SIZES:
+        abort(404)
+    path = katodo_image_path(image_id, size)
+    if os.path.exists(path):
+        # l'mtime fa da "ultimo accesso" per la pulizia LRU; aggiornato al più una volta al giorno
+        if time.time() - os.path.getmtime(path) > 86400:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+    else:
+        path = fetch_katodo_image(katodo_settings_snapshot().api_url, image_id, size)
+        if path is None:
+            # immagine assente sul negozio: il browser non la richiede di nuovo per un'ora
+            response = Response(status=404)
+            response.cache_control.private = True
+            response.cache_control.max_age = 3600
+            return response
+        if _KATODO_IMAGE_ADDED > KATODO_IMAGE_CACHE_MB * 1024 * 1024 / 20:
+            evict_katodo_image_cache()
+    try:
+        response = send_file(path, mimetype="image/jpeg", max_age=KATODO_IMAGE_MAX_AGE)
+    except FileNotFoundError:  # rimossa dalla pulizia nel frattempo
+        abort(404)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+@app.cli.command("katodo-import")
+@click.option("--delta", is_flag=True, help="Solo i prodotti modificati dall'ultimo sync riuscito.")
+def katodo_import_command(delta: bool):
+    """Avvia (o riprende) l'import Katodo e ne segue l'avanzamento fino alla fine."""
+    job = start_katodo_import(delta=delta and katodo_settings_snapshot().sync_watermark is not None)
+    job_id, last = job.id, None
+    while True:
+        event = _katodo_job_event(db.session.get(KatodoImportJob, job_id))
+        db.session.rollback()
+        if event["step"] != last:
+            click.echo(event["step"])
+            last = event["step"]
+        if event["done"]:
+            break
+        time.sleep(1)
+    if event.get("error"):
+        raise click.ClickException(event["error"])
+    click.echo(f"nuovi={event['new']} aggiornati={event['updated']} invariati={event['unchanged']} rimossi={event['deleted']}")
+
 @app.route("/admin/katodo/products/<int:ps_id>", methods=["GET", "POST"])
 @login_required
 def katodo_product_detail(ps_id):
-    s = get_katodo_settings()
+    s = katodo_settings_snapshot()
     p = KatodoProduct.query.filter_by(ps_id=ps_id).first_or_404()
     if request.method == "POST":
         try:
@@ -4454,13 +6951,15 @@ def katodo_product_detail(ps_id):
             p.active   = bool(request.form.get("active"))
             qty_raw = request.form.get("quantity", "0").strip()
             p.quantity = int(qty_raw) if qty_raw.lstrip("-").isdigit() else p.quantity
+            # la riga non corrisponde più al negozio: il prossimo sync completo la riscrive
+            p.content_hash = None
             db.session.commit()
             flash("Prodotto aggiornato.", "success")
         except Exception as e:
             db.session.rollback()
             flash(f"Errore: {e}", "danger")
         return redirect(url_for("katodo_product_detail", ps_id=ps_id))
-    return render_template("admin/katodo_product_detail.html", s=s, p=p, ps_image_url=ps_image_url)
+    return render_template("admin/katodo_product_detail.html", s=s, p=p)
 
 
 @app.route("/admin/slot_items/<int:item_id>/clear", methods=["POST"])
@@ -4606,41 +7105,41 @@ def _auto_assign_category(category_id: int,
     requested = len(items)
     total_unplaced = len(all_candidates)
 
-    assignments_plan = []   # (item, col_code, row_num)
+    occ = _load_cabinet_occupancy(cab)
+    assignments_plan = []   # (item, cella anchor)
     skipped_occupied = set()   # celle saltate perché già occupate (clear_occupied=False)
     reused_slots = set()       # celle che verranno liberate e riutilizzate (clear_occupied=True)
-    planned_items = {}         # key -> lista di Item (esistenti + pianificati) per compatibilità
-    slot_plan = []             # lista ordinata di slot percorsi con capacità residua e contenuto
+    planned_items = {}         # anchor -> lista di Item (esistenti + pianificati) per compatibilità
+    slot_plan = []             # lista ordinata di regioni percorse con capacità residua e contenuto
+    visited = set()
 
     for col_code, row_num in _iter_cabinet_walk(cab, start_col, start_row, direction):
-        slot = Slot.query.filter_by(cabinet_id=cab.id, col_code=col_code, row_num=row_num).first()
-        if slot and slot.is_blocked:
+        region = _occupancy_region(occ, col_code, row_num)
+        anchor = region["anchor"]
+        # Le celle fuse appartengono a un'unica regione: si valuta solo la prima volta.
+        if anchor in visited:
             continue
-        slot_key = (col_code, row_num)
-        assigns = []
-        slot_items = []
-        if slot:
-            assigns, slot_items = _load_slot_assignments(slot.id)
-        has_content = bool(assigns)
+        visited.add(anchor)
+        if region["blocked"]:
+            continue
+        slot_items = region["items"]
+        has_content = bool(region["assigns"])
         if has_content and clear_occupied:
-            reused_slots.add(slot_key)
+            reused_slots.add(anchor)
             slot_items = []
             existing_count = 0
         else:
-            existing_count = len(assigns)
+            existing_count = len(region["assigns"])
 
-        max_here = _max_compartments_for_slot(cab, col_code, row_num)
-        free_here = max_here - existing_count
+        free_here = region["capacity"] - existing_count
         if free_here <= 0:
             if has_content and not clear_occupied:
-                skipped_occupied.add(slot_key)
+                skipped_occupied.add(anchor)
             continue
 
-        planned_items.setdefault(slot_key, slot_items.copy())
+        planned_items[anchor] = slot_items.copy()
         slot_plan.append({
-            "key": slot_key,
-            "col": col_code,
-            "row": row_num,
+            "key": anchor,
             "has_content": has_content,
             "remaining": free_here,
         })
@@ -4659,7 +7158,7 @@ def _auto_assign_category(category_id: int,
             if not _can_share_slot(planned_items[info["key"]], itm):
                 skipped_occupied.add(info["key"])
                 continue
-            assignments_plan.append((itm, info["col"], info["row"]))
+            assignments_plan.append((itm, info["key"]))
             planned_items[info["key"]].append(itm)
             info["remaining"] -= 1
             placed = True
@@ -4676,7 +7175,7 @@ def _auto_assign_category(category_id: int,
                 if info["has_content"] and not clear_occupied:
                     skipped_occupied.add(info["key"])
                 continue
-            assignments_plan.append((itm, info["col"], info["row"]))
+            assignments_plan.append((itm, info["key"]))
             planned_items[info["key"]].append(itm)
             info["remaining"] -= 1
             placed = True
@@ -4694,22 +7193,29 @@ def _auto_assign_category(category_id: int,
     assigned = 0
     try:
         if clear_occupied and reused_slots:
-            for col_code, row_num in sorted(reused_slots):
-                slot = Slot.query.filter_by(cabinet_id=cab.id, col_code=col_code, row_num=row_num).first()
-                if slot:
-                    deleted = Assignment.query.filter_by(slot_id=slot.id).delete()
-                    if deleted:
-                        cleared_slots += 1
-
-        for item, col_code, row_num in assignments_plan:
-            _assign_position(item, cab.id, col_code, row_num)
-            assigned += 1
-        touched_cells = {(col_code, row_num) for _, col_code, row_num in assignments_plan}
-        for col_code, row_num in touched_cells:
-            anchor_slot, _, _, slot_items = _collect_region_assignments(cab.id, col_code, row_num)
-            auto_label = shared_drawer_label(slot_items)
+            cleared_ids = []
+            for anchor in sorted(reused_slots):
+                region = _occupancy_region(occ, *anchor)
+                if region["assigns"]:
+                    cleared_ids.extend(a.id for a in region["assigns"])
+                    cleared_slots += 1
+                for cell in region["cells"]:
+                    slot = occ["slots"].get(cell)
+                    if slot is not None:
+                        occ["assigns"].pop(slot.id, None)
+            if cleared_ids:
+                Assignment.query.filter(Assignment.id.in_(cleared_ids)).delete(synchronize_session=False)
+
+        plan = {}
+        for item, anchor in assignments_plan:
+            plan.setdefault(anchor, []).append(item)
+        assigned = _write_region_assignments([(occ, plan)])
+
+        for anchor in plan:
+            auto_label = shared_drawer_label(planned_items[anchor])
             if not auto_label:
                 continue
+            anchor_slot = occ["slots"][anchor]
             if not (anchor_slot.display_label_override or "").strip():
                 anchor_slot.display_label_override = auto_label
             if not (anchor_slot.print_label_override or "").strip():
@@ -5011,7 +7517,7 @@ def _placements_internal(target_endpoint="cassettiere"):
     can_manage_placements = current_user.is_authenticated and current_user.has_permission("manage_placements")
     can_manage_items = current_user.is_authenticated and current_user.has_permission("manage_items")
     unplaced_json = [
-        {"id": it.id, "caption": auto_name_for(it), "category_id": it.category_id}
+        {"id": it.id, "caption": item_display_name(it), "category_id": it.category_id}
         for it in items_to_place
     ] if can_manage_placements else []
 
@@ -5180,7 +7686,7 @@ def labels_pdf():
             parts.append(next(iter(materials)))
         return parts
 
-    s = get_settings()
+    s = settings_snapshot()
     include_qr = s.qr_default
 
     buf = io.BytesIO()
@@ -5228,7 +7734,7 @@ def labels_pdf():
 
     def _type_text(item: Item) -> str:
         # Base: name o descrizione auto-generata, senza la categoria duplicata
-        base = item.name or auto_name_for(item)
+        base = item_display_name(item)
         cat_name = item.category.name if item.category else ""
         if cat_name and base.lower().startswith(cat_name.lower() + " "):
             base = base[len(cat_name) + 1 :].lstrip()
@@ -5474,7 +7980,7 @@ def labels_pdf():
 
         # Fallback: se per qualche motivo non abbiamo scritto nulla, uso il nome completo
         if not line1_text and not line2_text:
-            fallback = item.name or auto_name_for(item)
+            fallback = item_display_name(item)
             lines = wrap_to_lines(fallback, title_font, title_size, text_right_limit, max_lines=2)
             c.setFont(title_font, title_size)
             for ln in lines:
@@ -5500,7 +8006,7 @@ def labels_pdf():
         # QR a destra
         if qr_box:
             try:
-                s = get_settings()
+                s = settings_snapshot()
                 if s.qr_base_url:
                     url = f"{s.qr_base_url.rstrip('/')}/api/items/{item.id}.json"
                 else:
@@ -5555,7 +8061,7 @@ def dymo_labels_pdf():
                    .all())
     pos_by_item = {item_id: (cab, slot) for item_id, cab, slot in assignments}
 
-    s = get_settings()
+    s = settings_snapshot()
     label_w = mm_to_pt(s.dymo_label_w_mm)
     label_h = mm_to_pt(s.dymo_label_h_mm)
     margin_x = mm_to_pt(s.dymo_margin_x_mm)
@@ -5654,7 +8160,7 @@ def cards_pdf():
     pos_by_item = {item_id: (cab, slot) for item_id, cab, slot in assignments}
     original_order = {item.id: idx for idx, item in enumerate(items)}
 
-    s = get_settings()
+    s = settings_snapshot()
     base_page_size = page_size_for_format(s.card_page_format)
     page_size = (landscape(base_page_size) if s.card_orientation_landscape else portrait(base_page_size))
     buf = io.BytesIO()
@@ -5771,7 +8277,7 @@ def cards_pdf():
         title_font_size = 12
         title_leading = 11
         title_lines = wrap_to_lines(
-            auto_name_for(item),
+            item_display_name(item),
             "Helvetica-Bold",
             title_font_size,
             text_area_w,
@@ -5861,11 +8367,6 @@ def cards_pdf():
 # ===================== INIT / SEED =====================
 
 def seed_if_empty_or_missing():
-    ensure_settings_columns()
-    ensure_item_columns()
-    ensure_category_columns()
-    ensure_slot_columns()
-    ensure_user_columns()
     ensure_auth_defaults()
     if not Settings.query.get(1):
         db.session.add(Settings(
@@ -6005,11 +8506,31 @@ def seed_if_empty_or_missing():
 
 def init_db():
     with app.app_context():
-        db.create_all()
-        seed_if_empty_or_missing()
+        ensure_core_schema()
+
+_bootstrapped = False
+
+def bootstrap(start_scheduler: bool = True) -> None:
+    """Avvio dell'applicazione: schema, dati di base e backup di avvio.
+    Eseguito sotto lock tra processi; con un server che fa fork dei worker
+    (es. gunicorn --preload) gira una sola volta nel processo principale."""
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with instance_file_lock("bootstrap.lock"):
+        init_db()
+        with app.app_context():
+            # Nessuna connessione SQLite deve passare ai worker creati con fork
+            db.engine.dispose()
+    run_startup_backup()
+    if start_scheduler:
+        start_backup_scheduler()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_backup_after_fork)
+    _bootstrapped = True
 
 # ===================== MAIN =====================
 if __name__ == "__main__":
-    init_db()
-    run_startup_backup()
+    # Con il reloader di debug il processo servente è il figlio (WERKZEUG_RUN_MAIN)
+    bootstrap(start_scheduler=os.environ.get("WERKZEUG_RUN_MAIN") == "true")
     app.run(debug=True, host="0.0.0.0")
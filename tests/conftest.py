@@ -0,0 +1,86 @@
+"""Fixture comuni: un'istanza di prova in una cartella temporanea (DB, backup, cache)."""
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSTANCE = tempfile.mkdtemp(prefix="magazzino-test-")
+atexit.register(shutil.rmtree, INSTANCE, ignore_errors=True)
+os.environ["MAGAZZINO_INSTANCE_PATH"] = INSTANCE
+os.environ["MAGAZZINO_BACKUP_SCHEDULER"] = "0"
+sys.path.insert(0, ROOT)
+
+import magazzino  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    magazzino.app.config["TESTING"] = True
+    magazzino.init_db()
+    with magazzino.app.app_context():
+        if not magazzino.User.query.filter_by(username="admin").first():
+            admin = magazzino.User(username="admin", role=magazzino.Role.query.filter_by(name="Admin").one())
+            admin.set_password("admin")
+            magazzino.db.session.add(admin)
+            magazzino.db.session.commit()
+    return magazzino.app
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+        magazzino.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    c = app.test_client()
+    with app.app_context():
+        admin_id = magazzino.User.query.filter_by(username="admin").one().id
+    with c.session_transaction() as sess:
+        sess["_user_id"] = str(admin_id)
+        sess["_fresh"] = True
+    return c
+
+
+@pytest.fixture
+def prestashop(app, monkeypatch):
+    """Stub PrestaShop configurato nelle impostazioni Katodo; i job di import girano in linea."""
+    from prestashop_stub import PrestaShopStub
+
+    stub = PrestaShopStub()
+    with app.app_context():
+        magazzino.db.session.execute(magazzino.text("DELETE FROM katodo_product"))
+        magazzino.db.session.execute(magazzino.text("DELETE FROM katodo_import_job"))
+        settings = magazzino.get_katodo_settings()
+        settings.enabled = True
+        settings.api_url = stub.api_url
+        settings.api_key = "TEST"
+        settings.import_page_size = 10
+        settings.import_concurrency = 4
+        settings.sync_watermark = None
+        magazzino.db.session.commit()
+        magazzino.invalidate_settings_cache("katodo_settings")
+    monkeypatch.setattr(magazzino, "_spawn_katodo_job", magazzino._katodo_job_thread)
+    yield stub
+    stub.close()
+    with app.app_context():
+        # nessun job "running" deve sopravvivere allo stub
+        magazzino.db.session.execute(magazzino.text("DELETE FROM katodo_import_job"))
+        magazzino.db.session.commit()
+
+
+def run_fresh_process(code: str) -> dict:
+    """Esegue `code` in un nuovo interprete sulla stessa istanza; `code` stampa un JSON."""
+    out = subprocess.run(
+        [sys.executable, "-c", "import magazzino\n" + code],
+        cwd=ROOT, env=dict(os.environ), capture_output=True, text=True, timeout=120, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
@@ -0,0 +1,124 @@
+"""Server PrestaShop finto per i test dell'integrazione Katodo (WebService JSON, locale)."""
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_products(count: int, date_upd: str = "2024-01-01 10:00:00") -> list[dict]:
+    return [
+        {
+            "id": i, "reference": f"R{i}", "name": f"Prodotto {i}", "price": "1.500000", "active": "1",
+            "quantity": str(i % 10), "id_category_default": "2", "date_add": "2024-01-01 10:00:00",
+            "date_upd": date_upd, "id_default_image": str(i),
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def make_jpeg(size: int = 600) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + b"\0" * 64 + b"\xff\xd9"  # senza Pillow basta un contenuto qualsiasi
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), (200, 30, 30)).save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+class PrestaShopStub:
+    def __init__(self, products=None):
+        self.products = products or []
+        self.max_latency = 0.0             # ritardo casuale per pagina: risposte fuori ordine
+        self.slow: dict[str, float] = {}   # ritardo fisso per "categories", "ids" (elenco dei soli id), "images"
+        self.fail_offsets: dict[int, int] = {}   # offset pagina -> status HTTP da restituire
+        self.page_offsets: list[int] = []
+        self.connections: set = set()
+        self.requests = 0
+        self.image = make_jpeg()
+        self.missing_images: set[int] = set()
+        self.image_requests: list[str] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _products_page(self, query: dict):
+        src = self.products
+        flt = query.get("filter[date_upd]", [None])[0]
+        if flt:
+            src = [p for p in src if p["date_upd"] > flt[2:-1]]
+        if query.get("display") == ["[id]"]:
+            time.sleep(self.slow.get("ids", 0))
+            return 200, {"products": [{"id": p["id"]} for p in src]}
+        size, _, offset = query.get("limit", ["1000"])[0].partition(",")
+        size, offset = int(size), int(offset or 0)
+        with self._lock:
+            self.page_offsets.append(offset)
+        if offset in self.fail_offsets:
+            return self.fail_offsets[offset], {"errors": [{"message": "errore di prova"}]}
+        if self.max_latency:
+            time.sleep(random.uniform(0, self.max_latency))
+        items = src[offset:offset + size]
+        # PrestaShop risponde con una lista vuota quando non ci sono risultati
+        return 200, ({"products": items} if items else [])
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = 64 * 1024  # header e corpo in un'unica scrittura (niente ritardi Nagle)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.startswith("/img/p/"):
+                    self._send_image(url.path)
+                    return
+                if url.path.endswith("/categories"):
+                    time.sleep(stub.slow.get("categories", 0))
+                    status, data = 200, {"categories": [{"id": 2, "name": "Elettronica"}]}
+                elif url.path.endswith("/products"):
+                    status, data = stub._products_page(query)
+                else:
+                    status, data = 404, {}
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_image(self, path):
+                # /img/p/1/2/12-cart_default.jpg
+                name = path.rsplit("/", 1)[1]
+                with stub._lock:
+                    stub.image_requests.append(name)
+                time.sleep(stub.slow.get("images", 0))
+                image_id = int(name.split("-", 1)[0])
+                body = b"" if image_id in stub.missing_images else stub.image
+                self.send_response(200 if body else 404)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,93 @@
+import sqlite3
+from contextlib import contextmanager
+
+import magazzino as m
+
+
+@contextmanager
+def count_queries(app):
+    """Raccoglie le query eseguite (BEGIN/COMMIT esclusi)."""
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = m.db.engine
+    m.sa_event.listen(engine, "before_cursor_execute", _count)
+    try:
+        yield statements
+    finally:
+        m.sa_event.remove(engine, "before_cursor_execute", _count)
+
+
+def _add_placed_items(prefix, count, first_row):
+    cat = m.Category.query.filter_by(name="Perni").first()
+    if cat is None:
+        cat = m.Category(name="Perni")
+        m.db.session.add(cat)
+    items = [m.Item(name=f"{prefix} {n}", category=cat, quantity=n) for n in range(count)]
+    m.db.session.add_all(items)
+    m.db.session.flush()
+    cabinet = m.Cabinet.query.first()
+    results = m.bulk_assign_positions(
+        [(item, cabinet.id, "B", first_row + n) for n, item in enumerate(items)], force_share=True
+    )
+    assert all(r["ok"] for r in results)
+    m.db.session.commit()
+    return [item.id for item in items]
+
+
+# Le richieste girano senza app context attivo: ognuna ha la sua sessione e il suo `g`,
+# come in produzione.
+def test_api_search_query_count_does_not_grow_with_results(app, client):
+    with app.app_context():
+        _add_placed_items("Perno conico", 2, 1)
+    client.get("/api/search?q=conico")  # cache di permessi, impostazioni, ruoli categoria
+    with count_queries(app) as few:
+        assert len(client.get("/api/search?q=conico").get_json()) == 2
+    with app.app_context():
+        _add_placed_items("Perno conico", 8, 3)
+    with count_queries(app) as many:
+        results = client.get("/api/search?q=conico").get_json()
+    assert len(results) == 10
+    assert all(r["position"] for r in results)
+    assert len(many) == len(few)
+
+
+def test_api_item_query_count(app, client):
+    with app.app_context():
+        item_id = _add_placed_items("Perno cilindrico", 1, 20)[0]
+    client.get(f"/api/items/{item_id}.json")
+    with count_queries(app) as statements:
+        data = client.get(f"/api/items/{item_id}.json").get_json()
+    assert data["position"]
+    assert len(statements) <= 8, statements
+
+
+def test_category_roles_follow_changes_from_other_processes(app):
+    with app.app_context():
+        cat = m.Category.query.filter(m.func.lower(m.Category.name) == "viti").first()
+        if cat is None:
+            cat = m.Category(name="Viti")
+            m.db.session.add(cat)
+            m.db.session.commit()
+        cat_id = cat.id
+    with app.test_request_context():
+        assert m._category_role_id("screw") == cat_id
+        with count_queries(app) as statements:
+            m._category_role_id("screw")
+            m._category_role_id("washer")
+        assert statements == []  # ruoli (anche assenti) in cache, versione già letta
+
+    # rinomina da un'altra connessione, come farebbe un altro worker
+    conn = sqlite3.connect(m.db_path)
+    conn.execute("UPDATE category SET name = 'Viti TCEI' WHERE id = ?", (cat_id,))
+    conn.commit()
+    try:
+        with app.test_request_context():
+            assert m._category_role_id("screw") is None
+    finally:
+        conn.execute("UPDATE category SET name = 'Viti' WHERE id = ?", (cat_id,))
+        conn.commit()
+        conn.close()
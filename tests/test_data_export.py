@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+
+import magazzino as m
+
+
+def _post_import(client, data: bytes, name="data.json"):
+    return client.post(
+        "/admin/data/import",
+        data={"format": "json", "file": (io.BytesIO(data), name)},
+        content_type="multipart/form-data",
+        follow_redirects=True,
+    ).get_data(as_text=True)
+
+
+def _category_count(app):
+    with app.app_context():
+        return m.Category.query.count()
+
+
+def test_ndjson_round_trip(app, client):
+    dump = client.get("/admin/data/export.json?format=ndjson").get_data()
+    assert json.loads(dump.splitlines()[-1])["end"] is True
+    assert "Import JSON completato" in _post_import(client, dump, "data.ndjson")
+
+
+def test_ndjson_without_end_line_is_rejected(app, client):
+    lines = client.get("/admin/data/export.json?format=ndjson").get_data().splitlines()
+    with app.app_context():
+        m.db.session.execute(m.text("DELETE FROM category WHERE name = 'Solo nel dump'"))
+        m.db.session.commit()
+    extra = json.dumps({"table": "categories", "row": {"id": 9999, "name": "Solo nel dump", "color": "#000000"}})
+    truncated = b"\n".join(lines[:1] + [extra.encode()] + lines[1:-1]) + b"\n"
+    before = _category_count(app)
+    page = _post_import(client, truncated, "data.ndjson")
+    assert "manca la riga di chiusura" in page
+    assert _category_count(app) == before
+
+
+def test_ndjson_with_wrong_counts_is_rejected(app, client):
+    lines = client.get("/admin/data/export.json?format=ndjson").get_data().splitlines()
+    end = json.loads(lines[-1])
+    end["counts"]["categories"] += 1
+    page = _post_import(client, b"\n".join(lines[:-1] + [json.dumps(end).encode()]) + b"\n", "data.ndjson")
+    assert "record letti" in page
+
+
+def test_json_round_trip_gzip(app, client):
+    dump = client.get("/admin/data/export.json?gzip=1").get_data()
+    assert dump[:2] == b"\x1f\x8b"
+    assert "Import JSON completato" in _post_import(client, dump, "data.json.gz")
+
+
+def _load_json(text):
+    reader = io.StringIO(text)
+    return list(m._load_json_import(reader, reader.readline()))
+
+
+def test_legacy_json_is_split_in_table_order(monkeypatch):
+    monkeypatch.setattr(m, "EXPORT_CHUNK_ROWS", 2)
+    rows = [{"id": i, "name": f"Cat {i}", "color": "#123456"} for i in range(1, 6)]
+    text = json.dumps({"items": [], "unknown": [1, 2], "categories": rows, "format_version": 2}, indent=2)
+    batches = _load_json(text)
+    assert [name for name, _ in batches] == ["categories"] * 3
+    assert [r for _, batch in batches for r in batch] == rows
+
+
+@pytest.mark.parametrize("text, message", [
+    ('{"categories": [{"id": 1}', "Expecting"),
+    ('{"format_version": 99, "categories": []}', "non supportata"),
+    ('[1, 2]', "oggetto JSON"),
+    ('{"categories": []} trailing', "Extra data"),
+    ('{"categories": {"id": 1}}', "lista di record"),
+])
+def test_legacy_json_rejects_bad_input(text, message):
+    with pytest.raises(ValueError, match=message):
+        _load_json(text)
+
+
+def test_legacy_json_over_size_limit_is_rejected(app, client, monkeypatch):
+    monkeypatch.setattr(m, "JSON_IMPORT_MAX_MB", 0.001)
+    dump = json.dumps({"categories": [{"id": 1, "name": "x" * 2000, "color": "#000000"}]}).encode()
+    before = _category_count(app)
+    assert "usa l&#39;export NDJSON" in _post_import(client, dump)
+    assert _category_count(app) == before
+
+
+def test_restore_reports_inserted_updated_unchanged(ctx):
+    first, second = m.Category.query.order_by(m.Category.id).limit(2).all()
+    new_id = m.db.session.query(m.func.max(m.Category.id)).scalar() + 1
+    records = [
+        {"id": first.id, "name": first.name, "color": first.color},
+        {"id": second.id, "name": second.name + " (mod)", "color": second.color},
+        {"id": new_id, "name": "Categoria nuova", "color": "#abcdef"},
+    ]
+    try:
+        counts = m.restore_data([("categories", records)])
+        assert counts == {"categories": {"inserted": 1, "updated": 1, "unchanged": 1}}
+    finally:
+        m.db.session.rollback()
@@ -0,0 +1,122 @@
+import csv
+import functools
+import io
+
+import pytest
+
+import magazzino as m
+
+
+def _rows(*rows):
+    """Righe nel formato di import_item_rows: (numero riga, dict con le colonne di ITEMS_CSV_HEADER)."""
+    return [(n, {key: "" for key in m.ITEMS_CSV_HEADER} | row) for n, row in enumerate(rows, start=2)]
+
+
+def _csv_bytes(rows) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=m.ITEMS_CSV_HEADER)
+    writer.writeheader()
+    for _line_no, row in rows:
+        writer.writerow(row)
+    return out.getvalue().encode()
+
+
+def _items_named(description):
+    return m.Item.query.filter_by(description=description).all()
+
+
+@pytest.fixture
+def cabinet(ctx):
+    location = m.Location.query.filter_by(name="Import test").first() or m.Location(name="Import test")
+    m.db.session.add(location)
+    m.db.session.flush()
+    cab = m.Cabinet.query.filter_by(name="IMP").first() or m.Cabinet(location_id=location.id, name="IMP")
+    m.db.session.add(cab)
+    m.db.session.commit()
+    return cab
+
+
+def test_dry_run_leaves_db_unchanged(ctx):
+    items_before = m.Item.query.count()
+    report = m.import_item_rows(
+        _rows({"category": "Categoria solo in prova", "description": "dry-run", "quantity": "3"}),
+        dry_run=True,
+    )
+    assert report["created"] == 1
+    assert m.Item.query.count() == items_before
+    assert m.Category.query.filter_by(name="Categoria solo in prova").first() is None
+
+
+def test_mixed_create_and_update(ctx):
+    m.import_item_rows(_rows({"category": "Viti", "description": "mixed-a", "quantity": "1"}))
+    existing = _items_named("mixed-a")[0]
+    report = m.import_item_rows(_rows(
+        {"id": str(existing.id), "category": "Viti", "description": "mixed-a", "quantity": "7"},
+        {"category": "Viti", "description": "mixed-b", "quantity": "2"},
+    ))
+    assert (report["created"], report["updated"]) == (1, 1)
+    m.db.session.expire_all()
+    assert m.db.session.get(m.Item, existing.id).quantity == 7
+    assert len(_items_named("mixed-b")) == 1
+
+
+def test_invalid_rows_are_reported_and_skipped(ctx):
+    report = m.import_item_rows(_rows(
+        {"category": "", "description": "invalid-a"},
+        {"category": "Viti", "id": "abc", "description": "invalid-b"},
+        {"category": "Viti", "length_mm": "dieci", "description": "invalid-c"},
+        {"category": "Viti", "quantity": "tanti", "description": "invalid-d"},
+        {"category": "Viti", "description": "invalid-ok"},
+    ))
+    assert [line for line, _message in report["errors"]] == [2, 3, 4, 5]
+    assert "categoria mancante" in report["errors"][0][1]
+    assert "quantità non valida" in report["errors"][3][1]
+    assert report["created"] == 1
+    assert not _items_named("invalid-a")
+
+
+def test_placement_and_warnings(cabinet):
+    report = m.import_item_rows(_rows(
+        {"category": "Viti", "description": "placed", "position": "IMP-A1"},
+        {"category": "Viti", "description": "bad-position", "position": "senza trattino"},
+        {"category": "Viti", "description": "unknown-cabinet", "position": "NESSUNA-B2"},
+    ))
+    assert report["placed"] == 1
+    warnings = dict(report["warnings"])
+    assert "non riconosciuta" in warnings[3]
+    assert "cassettiera 'NESSUNA' non trovata" in warnings[4]
+    item = _items_named("placed")[0]
+    slot = (
+        m.Slot.query.join(m.Assignment, m.Assignment.slot_id == m.Slot.id)
+        .filter(m.Assignment.item_id == item.id)
+        .one()
+    )
+    assert (slot.cabinet_id, slot.col_code, slot.row_num) == (cabinet.id, "A", 1)
+
+
+def test_failure_after_a_commit_reports_saved_rows(ctx):
+    def rows():
+        yield from _rows(*({"category": "Viti", "description": f"interrupted-{n}"} for n in range(3)))
+        raise csv.Error("riga malformata")
+
+    with pytest.raises(m.ImportInterrupted) as info:
+        m.import_item_rows(rows(), chunk_rows=2)
+    assert info.value.committed == 2
+    assert len(_items_named("interrupted-0")) == 1
+    assert not _items_named("interrupted-2")
+
+
+def test_csv_with_bad_byte_at_the_end_writes_nothing(app, client, monkeypatch):
+    # blocchi piccoli: senza la prima passata i primi blocchi sarebbero già salvati
+    monkeypatch.setattr(m, "import_item_rows", functools.partial(m.import_item_rows, chunk_rows=2))
+    rows = _rows(*({"category": "Viti", "description": f"bad-byte-{n}"} for n in range(500)))
+    data = _csv_bytes(rows) + b"9999,\xff\n"
+    page = client.post(
+        "/admin/data/import",
+        data={"format": "csv", "file": (io.BytesIO(data), "items.csv")},
+        content_type="multipart/form-data",
+        follow_redirects=True,
+    ).get_data(as_text=True)
+    assert "nessun articolo importato" in page
+    with app.app_context():
+        assert not _items_named("bad-byte-0")
@@ -0,0 +1,28 @@
+import magazzino as m
+
+
+def test_fresh_db_has_every_declared_index(ctx):
+    advice = m.index_advice()
+    assert advice["missing"] == []
+    assert advice["different"] == []
+    indexes = m._db_indexes()
+    # indici coprenti: la colonna di ricerca è la prima
+    assert indexes["ix_assignment_item"][0] == "assignment"
+    assert indexes["ix_assignment_item"][1][0] == "item_id"
+    assert indexes["ix_assignment_slot"][1][0] == "slot_id"
+
+
+def test_missing_index_is_reported_and_repaired(ctx, app):
+    m.db.session.execute(m.text("DROP INDEX ix_assignment_item"))
+    m.db.session.commit()
+    try:
+        missing = [(table, name) for table, name, _cols in m.index_advice()["missing"]]
+        assert missing == [("assignment", "ix_assignment_item")]
+        result = app.test_cli_runner().invoke(args=["check-indexes"])
+        assert result.exit_code == 1
+        assert "missing: assignment.ix_assignment_item" in result.output
+    finally:
+        result = app.test_cli_runner().invoke(args=["check-indexes", "--fix"])
+    assert "creato: ix_assignment_item" in result.output
+    assert result.exit_code == 0
+    assert m.index_advice()["missing"] == []
@@ -0,0 +1,115 @@
+import os
+import shutil
+
+import pytest
+
+import magazzino as m
+from prestashop_stub import make_products
+
+
+@pytest.fixture
+def image_cache(prestashop):
+    shutil.rmtree(m.KATODO_IMAGE_DIR, ignore_errors=True)
+    yield m.KATODO_IMAGE_DIR
+    shutil.rmtree(m.KATODO_IMAGE_DIR, ignore_errors=True)
+
+
+def _thumb_files(size="thumb"):
+    folder = os.path.join(m.KATODO_IMAGE_DIR, size)
+    return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+
+def test_sync_downloads_thumbnails(app, prestashop, image_cache):
+    prestashop.products = make_products(12)
+    prestashop.missing_images = {7}
+    with app.app_context():
+        job = m.start_katodo_import(delta=False)
+        job_id = job.id
+    with app.app_context():
+        assert m.db.session.get(m.KatodoImportJob, job_id).status == "done"
+
+    assert _thumb_files() == sorted(f"{i}.jpg" for i in range(1, 13) if i != 7)
+    assert all(name.endswith("-cart_default.jpg") for name in prestashop.image_requests)
+    assert not [name for name in _thumb_files() if name.endswith(".tmp")]
+
+    # secondo sync: nessun download per le immagini già in cache
+    prestashop.image_requests.clear()
+    with app.app_context():
+        m.start_katodo_import(delta=False)
+    assert prestashop.image_requests == ["7-cart_default.jpg"]
+
+
+def test_thumbnail_is_downscaled(app, prestashop, image_cache):
+    image = pytest.importorskip("PIL.Image")
+    with app.app_context():
+        path = m.fetch_katodo_image(prestashop.api_url, 5, "thumb")
+    with image.open(path) as img:
+        assert max(img.size) <= m.KATODO_IMAGE_SIZES["thumb"][1]
+    assert os.path.getsize(path) < len(prestashop.image)
+
+
+def test_image_route_cache_headers_and_etag(app, client, prestashop, image_cache):
+    first = client.get("/admin/katodo/images/thumb/3.jpg")
+    assert first.status_code == 200
+    assert first.mimetype == "image/jpeg"
+    assert "private" in first.headers["Cache-Control"]
+    assert "public" not in first.headers["Cache-Control"]
+    assert f"max-age={m.KATODO_IMAGE_MAX_AGE}" in first.headers["Cache-Control"]
+    etag = first.headers["ETag"]
+
+    again = client.get("/admin/katodo/images/thumb/3.jpg", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert prestashop.image_requests == ["3-cart_default.jpg"]  # servita dalla cache locale
+
+    prestashop.missing_images = {4}
+    missing = client.get("/admin/katodo/images/thumb/4.jpg")
+    assert missing.status_code == 404
+    assert "max-age=3600" in missing.headers["Cache-Control"]
+    assert client.get("/admin/katodo/images/huge/3.jpg").status_code == 404
+
+
+def test_eviction_removes_least_recently_used(app, prestashop, image_cache):
+    with app.app_context():
+        for image_id in range(1, 11):
+            m.fetch_katodo_image(prestashop.api_url, image_id, "thumb")
+        paths = {i: m.katodo_image_path(i, "thumb") for i in range(1, 11)}
+        for image_id, path in paths.items():
+            os.utime(path, (1000 + image_id, 1000 + image_id))  # 1 il meno recente
+        stale_tmp = paths[1] + ".123.456.tmp"
+        with open(stale_tmp, "wb") as handle:
+            handle.write(b"x")
+        os.utime(stale_tmp, (1, 1))
+        size = os.path.getsize(paths[1])
+
+        removed = m.evict_katodo_image_cache(budget_bytes=size * 5)
+
+    assert removed == 6  # si scende al 90% del budget: restano 4 immagini
+    assert _thumb_files() == ["10.jpg", "7.jpg", "8.jpg", "9.jpg"]
+    assert not os.path.exists(stale_tmp)
+
+
+def test_write_failure_counts_as_failed_and_leaves_no_tmp(app, prestashop, image_cache, monkeypatch):
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if dst.endswith(os.sep + "2.jpg"):
+            raise OSError(28, "No space left on device")
+        return replace(src, dst)
+
+    monkeypatch.setattr(m.os, "replace", failing_replace)
+    with app.app_context():
+        fetched, failed = m.cache_katodo_images(prestashop.api_url, [1, 2, 3], "thumb")
+    assert (fetched, failed) == (2, 1)
+    assert _thumb_files() == ["1.jpg", "3.jpg"]
+
+
+def test_progress_is_time_based_while_downloads_are_slow(app, prestashop, image_cache, monkeypatch):
+    prestashop.slow = {"images": 0.3}
+    monkeypatch.setattr(m, "KATODO_JOB_HEARTBEAT", 0.05)
+    monkeypatch.setattr(m, "KATODO_IMAGE_DOWNLOADS", 2)
+    calls = []
+    with app.app_context():
+        result = m.cache_katodo_images(prestashop.api_url, [1, 2], progress=lambda done, total: calls.append(done))
+    assert result == (2, 0)
+    # heartbeat anche prima che un download termini, non ogni N immagini
+    assert calls[:2] == [0, 0]
@@ -0,0 +1,168 @@
+import sqlite3
+
+import pytest
+
+import magazzino as m
+from prestashop_stub import make_products
+
+
+def _run_import(app, delta=False):
+    with app.app_context():
+        job_id = m.start_katodo_import(delta=delta).id
+        m.db.session.remove()
+    with app.app_context():
+        return m.db.session.get(m.KatodoImportJob, job_id)
+
+
+def test_pages_are_written_in_order_and_stop_on_short_page(app, prestashop, monkeypatch):
+    prestashop.products = make_products(93)
+    prestashop.max_latency = 0.05  # le pagine concorrenti arrivano in ordine sparso
+    written = []
+    upsert = m.upsert_katodo_products
+
+    def recording_upsert(products):
+        written.append(min(products))
+        return upsert(products)
+
+    monkeypatch.setattr(m, "upsert_katodo_products", recording_upsert)
+    job = _run_import(app)
+
+    assert job.status == "done", job.error
+    assert (job.total_new, job.next_offset) == (93, 93)
+    assert written == [1, 11, 21, 31, 41, 51, 61, 71, 81, 91]
+    # la pagina corta (offset 90) chiude la paginazione: al più `concurrency` pagine in anticipo
+    assert max(prestashop.page_offsets) < 90 + 4 * 10
+    # sessione condivisa: le connessioni vengono riusate
+    assert len(prestashop.connections) <= 4 + 2 < prestashop.requests
+    with app.app_context():
+        assert m.KatodoProduct.query.count() == 93
+
+
+def test_error_page_fails_the_job(app, prestashop):
+    prestashop.products = make_products(50)
+    prestashop.fail_offsets = {20: 400}
+    job = _run_import(app)
+
+    assert job.status == "error"
+    assert "offset 20" in job.error
+    # le pagine prima dell'errore restano salvate con il loro checkpoint
+    assert job.next_offset == 20
+    with app.app_context():
+        assert m.KatodoProduct.query.count() == 20
+        assert m.katodo_settings_snapshot().sync_watermark is None
+
+
+def test_full_sync_restores_locally_edited_product(app, client, prestashop):
+    prestashop.products = make_products(15)
+    assert _run_import(app).total_new == 15
+    client.post("/admin/katodo/products/3", data={"name": "Modificato a mano", "price": "9.99", "quantity": "3"})
+    with app.app_context():
+        edited = m.KatodoProduct.query.filter_by(ps_id=3).one()
+        assert (edited.name, edited.content_hash) == ("Modificato a mano", None)
+
+    job = _run_import(app)
+    assert (job.total_updated, job.total_unchanged) == (1, 14)
+    with app.app_context():
+        restored = m.KatodoProduct.query.filter_by(ps_id=3).one()
+        assert (restored.name, restored.price) == ("Prodotto 3", 1.5)
+        assert restored.content_hash is not None
+
+
+def _stale_job(app, **values):
+    with app.app_context():
+        job = m.KatodoImportJob(
+            owner="999999:1", heartbeat_at=m.datetime.utcnow() - m.timedelta(hours=1), **values
+        )
+        m.db.session.add(job)
+        m.db.session.commit()
+        return job.id
+
+
+def test_stale_job_is_claimed_and_resumed_from_checkpoint(app, prestashop, monkeypatch):
+    prestashop.products = make_products(60)
+    with app.app_context():
+        now = m.datetime.utcnow()
+        m.upsert_katodo_products({p["id"]: m._katodo_product_fields(p, {}, now) for p in prestashop.products[:30]})
+        m.db.session.commit()
+    job_id = _stale_job(app, next_offset=30, total_new=30, progress=15)
+    written = []
+    upsert = m.upsert_katodo_products
+    monkeypatch.setattr(m, "upsert_katodo_products", lambda rows: written.append(min(rows)) or upsert(rows))
+
+    with app.app_context():
+        assert m.katodo_running_job().id == job_id  # trova il job orfano e lo riprende
+    with app.app_context():
+        job = m.db.session.get(m.KatodoImportJob, job_id)
+        assert job.status == "done", job.error
+        assert job.owner != "999999:1"
+        assert (job.next_offset, job.total_new, job.total_updated) == (60, 60, 0)
+        assert m.KatodoProduct.query.count() == 60
+    assert min(prestashop.page_offsets) == 30
+    assert written == [31, 41, 51]
+
+
+def test_job_with_live_heartbeat_is_not_claimed(app, prestashop):
+    with app.app_context():
+        job = m.KatodoImportJob(owner="999999:1", heartbeat_at=m.datetime.utcnow())
+        m.db.session.add(job)
+        m.db.session.commit()
+        job_id = job.id
+    m._katodo_job_thread(job_id)
+    assert prestashop.requests == 0
+    with app.app_context():
+        assert m.db.session.get(m.KatodoImportJob, job_id).owner == "999999:1"
+
+
+def test_checkpoint_by_second_claimer_raises_job_lost(app, prestashop):
+    job_id = _stale_job(app)
+    with app.app_context():
+        m._katodo_job_checkpoint(job_id, "999999:1", next_offset=10)
+        with pytest.raises(m.KatodoJobLost):
+            m._katodo_job_checkpoint(job_id, "888888:1", next_offset=20)
+        assert m.db.session.get(m.KatodoImportJob, job_id).next_offset == 10
+
+
+def test_runner_stops_when_job_is_taken_over(app, prestashop, monkeypatch):
+    prestashop.products = make_products(80)
+    prestashop.max_latency = 0.02
+    pages = []
+    upsert = m.upsert_katodo_products
+
+    def takeover_after_two_pages(rows):
+        pages.append(min(rows))
+        if len(pages) == 2:
+            # un altro worker ha considerato il job orfano e lo ha preso in carico
+            conn = sqlite3.connect(m.db_path)
+            conn.execute("UPDATE katodo_import_job SET owner = '888888:1'")
+            conn.commit()
+            conn.close()
+        return upsert(rows)
+
+    monkeypatch.setattr(m, "upsert_katodo_products", takeover_after_two_pages)
+    job = _run_import(app)
+
+    assert len(pages) == 2  # il vecchio esecutore si ferma al checkpoint successivo
+    assert (job.status, job.owner, job.next_offset) == ("running", "888888:1", 10)
+    with app.app_context():
+        # la seconda pagina è stata annullata insieme al checkpoint rifiutato
+        assert m.KatodoProduct.query.count() == 10
+
+
+def test_slow_categories_and_id_listing_keep_the_heartbeat(app, prestashop, monkeypatch):
+    prestashop.products = make_products(5)
+    prestashop.slow = {"categories": 0.3, "ids": 0.3}
+    monkeypatch.setattr(m, "KATODO_JOB_HEARTBEAT", 0.05)
+    events = []
+    checkpoint = m._katodo_job_checkpoint
+
+    def recording_checkpoint(job_id, owner, **values):
+        events.append(values.get("step", "heartbeat"))
+        return checkpoint(job_id, owner, **values)
+
+    monkeypatch.setattr(m, "_katodo_job_checkpoint", recording_checkpoint)
+    job = _run_import(app)
+
+    assert job.status == "done", job.error
+    for step in ("Caricamento categorie…", "Verifica prodotti rimossi…"):
+        following = events[events.index(step) + 1:]
+        assert following[:2] == ["heartbeat", "heartbeat"], events
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import magazzino as m
+
+
+def _schema_version():
+    return m.db.session.execute(m.text("SELECT max(version) FROM schema_version")).scalar()
+
+
+def test_failed_migration_is_not_recorded_and_is_retried(ctx, monkeypatch):
+    applied = _schema_version()
+    version = applied + 1
+    monkeypatch.setattr(m, "SCHEMA_MIGRATIONS", list(m.SCHEMA_MIGRATIONS))
+
+    @m.schema_migration(version, "prova cache su tabella mancante")
+    def _migration():
+        m.ensure_cache_versions(strict=True)
+
+    try:
+        monkeypatch.setitem(m.CACHE_VERSION_SOURCES, "prova", ("tabella_inesistente",))
+        with pytest.raises(OperationalError):
+            m.run_migrations()
+        assert _schema_version() == applied
+
+        monkeypatch.delitem(m.CACHE_VERSION_SOURCES, "prova")
+        assert m.run_migrations() == [f"{version}: prova cache su tabella mancante"]
+        assert _schema_version() == version
+    finally:
+        m.db.session.execute(m.text("DELETE FROM schema_version WHERE version = :v"), {"v": version})
+        m.db.session.execute(m.text("DELETE FROM cache_version WHERE name = 'prova'"))
+        m.db.session.commit()
+
+
+@pytest.mark.parametrize("ddl, tolerated", [
+    ("CREATE VIRTUAL TABLE t USING fts5(a, tokenize = 'inesistente')", True),
+    ("CREATE VIRTUAL TABLE t USING modulo_inesistente(a)", False),
+    ("INSERT INTO tabella_inesistente VALUES (1)", False),
+])
+def test_only_missing_fts_is_tolerated(ctx, ddl, tolerated):
+    with pytest.raises(OperationalError) as info:
+        m.db.session.execute(m.text(ddl))
+    m.db.session.rollback()
+    assert m._fts_unavailable(info.value) is tolerated
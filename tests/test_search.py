@@ -0,0 +1,46 @@
+import magazzino as m
+from conftest import run_fresh_process
+
+
+def _add_item(name, **extra):
+    cat = m.Category.query.first() or m.Category(name="Viti")
+    item = m.Item(name=name, category=cat, **extra)
+    m.db.session.add(item)
+    m.db.session.commit()
+    return item
+
+
+def test_fts_tables_read_from_db(ctx):
+    m.ensure_item_search_index()
+    m._item_fts_tables = None  # come un processo che non ha eseguito la migrazione
+    assert m.item_fts_tables() == {m.ITEM_FTS_TABLE, m.ITEM_FTS_TRIGRAM_TABLE}
+    assert m.item_search_match("vite")[0] == m.ITEM_FTS_TRIGRAM_TABLE
+    assert m.item_search_match("M3")[0] == m.ITEM_FTS_TABLE
+
+
+def test_fts_search_finds_items(ctx):
+    item = _add_item("Distanziale ottone esagonale")
+    m._item_fts_tables = None
+    ids = m.db.session.execute(m.select(m.item_search_ids_query("ottone").c.item_id)).scalars().all()
+    assert item.id in ids
+
+
+def test_fresh_process_on_migrated_db_uses_fts(ctx):
+    _add_item("Rondella grower inox")
+    result = run_fresh_process(
+        "import json\n"
+        "with magazzino.app.app_context():\n"
+        "    magazzino.ensure_core_schema()\n"
+        "    db = magazzino.db\n"
+        "    tables = sorted(magazzino.item_fts_tables())\n"
+        "    match = magazzino.item_search_match('grower')\n"
+        "    db.session.execute(magazzino.text('DELETE FROM item_fts'))\n"
+        "    magazzino.rebuild_item_search_index()\n"
+        "    indexed = db.session.execute(magazzino.text('SELECT count(*) FROM item_fts')).scalar()\n"
+        "    items = db.session.execute(magazzino.text('SELECT count(*) FROM item')).scalar()\n"
+        "    db.session.rollback()\n"
+        "    print(json.dumps({'tables': tables, 'match': match, 'indexed': indexed, 'items': items}))\n"
+    )
+    assert result["tables"] == sorted([m.ITEM_FTS_TABLE, m.ITEM_FTS_TRIGRAM_TABLE])
+    assert result["match"] == [m.ITEM_FTS_TRIGRAM_TABLE, '"grower"']
+    assert result["indexed"] == result["items"] > 0
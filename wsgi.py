@@ -0,0 +1,10 @@
+"""Entry point WSGI per l'esecuzione in produzione.
+
+Esempi:
+    gunicorn --preload -w 4 --threads 4 -b 0.0.0.0:5000 wsgi:application
+    waitress-serve --listen=0.0.0.0:5000 --threads=8 wsgi:application
+"""
+from magazzino import app, bootstrap
+
+bootstrap()
+application = app